@@ -81,6 +81,33 @@ export class ProcessingStack extends cdk.Stack {
         A2CAI_PROMPTS: 'a2cai_prompts.yaml',
         MODEL_NAME: 'model_name.yaml',
         STACK_GENERATION_PROMPTS: 'stack_gen_prompts.yaml',
+        RESULT_CACHE_TTL_SECONDS: '604800',
+        RESULT_CACHE_MAX_BYTES: '1073741824',
+        STAGE_CACHE_BACKEND: 'memory',
+        STAGE_CACHE_MAX_BYTES: '67108864',
+        MODEL_STREAMING: 'true',
+        COMPLETIONS_MAX_IN_FLIGHT: '4',
+        COMPLETIONS_REQUESTS_PER_MINUTE: '50',
+        BEDROCK_MAX_IN_FLIGHT: '4',
+        STAGING_GENERATOR: 'template',
+        FUSED_MODULE_STAGE: 'false',
+        ARTIFACT_COMPRESSION_LEVEL: '6',
+        PROGRESS_UPDATE_INTERVAL_SECONDS: '1',
+        SECRET_CACHE_TTL_SECONDS: '900',
+        SECRET_REFRESH_AHEAD_SECONDS: '180',
+        TRACE_METRICS_NAMESPACE: 'A2C/CodeGenerator',
+        LOG_LEVEL: 'INFO',
+        LOG_MAX_PAYLOAD_CHARS: '1000',
+        LOG_PAYLOAD_SAMPLE_RATE: '1',
+        // Model step outputs are kept under transcripts/ (expired after 30 days) for replay and debugging;
+        // set to 's3' to keep full prompts too, or 'off' to keep nothing
+        LOG_TRANSCRIPTS: 'steps',
+        BATCH_MAX_CONCURRENT_JOBS: '4',
+        BATCH_TIME_RESERVE_SECONDS: '300',
+        TOKEN_BUDGET_MODE: 'adaptive',
+        TOKEN_BUDGET_MAX_CONTINUATIONS: '3',
+        PROMPT_CACHING: 'true',
+        PROMPT_CACHE_MIN_TOKENS: '1024',
       },
       initialPolicy: [
         new iam.PolicyStatement({
@@ -100,6 +127,19 @@ export class ProcessingStack extends cdk.Stack {
             props.codeOutputBucket.bucketArn.concat('/*'),
           ],
         }),
+        // Result and stage cache eviction delete entries under their prefixes in the output bucket
+        new iam.PolicyStatement({
+          actions: ['s3:DeleteObject'],
+          resources: [
+            props.codeOutputBucket.bucketArn.concat('/cache/*'),
+            props.codeOutputBucket.bucketArn.concat('/stage-cache/*'),
+          ],
+        }),
+        // The artifact writer aborts its multipart upload when a run fails
+        new iam.PolicyStatement({
+          actions: ['s3:AbortMultipartUpload'],
+          resources: [props.codeOutputBucket.bucketArn.concat('/output/*')],
+        }),
         new iam.PolicyStatement({
           actions: ['bedrock:InvokeModel', 'bedrock:InvokeModelWithResponseStream'],
           resources: ['*'],
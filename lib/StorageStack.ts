@@ -42,6 +42,24 @@ export class StorageStack extends cdk.Stack {
     this.codeOutputBucket = new s3.Bucket(this, 'codeOutputBucket', {
       ...securityProps,
       bucketName: `a2a-${this.account}-codeoutput-${this.region}`,
+      // Evicted result cache entries leave noncurrent versions behind in the versioned bucket
+      lifecycleRules: [
+        ...['cache/', 'stage-cache/'].map((prefix) => ({
+          prefix,
+          noncurrentVersionExpiration: cdk.Duration.days(1),
+        })),
+        // Artifacts are streamed with multipart uploads; clean up parts left by failed runs
+        {
+          prefix: 'output/',
+          abortIncompleteMultipartUploadAfter: cdk.Duration.days(1),
+        },
+        // Step output and prompt transcripts of each execution (LOG_TRANSCRIPTS) are for replay and debugging only
+        {
+          prefix: 'transcripts/',
+          expiration: cdk.Duration.days(30),
+          noncurrentVersionExpiration: cdk.Duration.days(1),
+        },
+      ],
     });
 
     // DynamoDB table for tracking code synthesis progress
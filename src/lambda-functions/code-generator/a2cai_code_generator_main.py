@@ -1,18 +1,36 @@
-import asyncio
-import boto3
-from a2cai_v2 import *
+from a2cai_v2 import a2c_ai_do_it_all
+from code_generator_utils_v2 import set_api_key_source
 import os
-import yaml
-from utils2_v2 import *
-from yaml.loader import SafeLoader
+import time
+import uuid
+import asyncio
+from utils2_v2 import load_yaml_data, load_model_name, load_stack_generation_prompts, generate_presigned_url, send_download_notification, send_failure_notification
+from result_cache import compute_result_cache_key, lookup_cached_artifact, copy_cached_artifact, store_uploaded_artifact_in_cache
+from aws_async import run_blocking, get_persistent_event_loop, cancel_pending_tasks
+from http_session import reset_http_session
+from progress_publisher import flush_progress
+from aws_clients import get_client
+from image_ingest import read_s3_object
+from artifact_writer import ArtifactWriter
+from run_manifest import copy_run_manifest
+from warm_state import RefreshAheadValue
+from tracing import start_trace, finish_trace
+from model_transport import save_cassette
+from execution_context import set_execution, current_execution_id
 import json
+from structured_logging import get_logger, flush_transcript
 
-def get_api_key_from_secrets():
+log = get_logger(__name__)
+
+DEFAULT_BATCH_MAX_CONCURRENT_JOBS = 4
+# Jobs are not started when less time than this is left before the Lambda timeout
+DEFAULT_BATCH_TIME_RESERVE_SECONDS = 300
+
+def fetch_api_key_from_secrets():
     """
     Retrieves API key from AWS Secrets Manager
     """
-    session = boto3.session.Session()
-    client = session.client('secretsmanager')
+    client = get_client('secretsmanager')
     
     try:
         secret_response = client.get_secret_value(
@@ -23,44 +41,35 @@ def get_api_key_from_secrets():
         api_key = secret_value['A2A_API_KEY']
         return api_key
     except Exception as e:
-        print(f"Error retrieving API key from Secrets Manager: {str(e)}")
+        log.error("Error retrieving API key from Secrets Manager: %s", e)
         raise e
-    
-async def async_lambda_handler(event, context):
-    """
-    AWS Lambda handler function that orchestrates the A2A AI code generation process.
-    Loads configuration from YAML files, sets up prompts and parameters,
-    and calls the a2c_ai_do_it_all function to generate code from an architecture diagram.
 
-    Args:
-        event (dict): Lambda event data containing S3 URI and code language information.
-        context (object): Lambda context object.
+# Kept across warm invocations (SECRET_CACHE_TTL_SECONDS) and refreshed in the background
+# shortly before it expires, so a rotated key is picked up without a cold start
+_api_key = RefreshAheadValue(fetch_api_key_from_secrets, name='API key secret')
+# Completions calls reload the key from here when it is rejected
+set_api_key_source(_api_key)
 
-    Returns:
-        dict: A dictionary containing the path to the generated zip file and a success message.
+def get_api_key_from_secrets():
     """
-
-    # Extract S3 URI and code language from the event data
-    image_s3_uri = event['file_path']
-    code_language = event['code_language']
-    execution_id = event.get('execution_id', '')
+    Returns the API key, calling Secrets Manager only when the cached key is missing or expired
+    """
+    return _api_key.get()
     
-    # Set execution ID for progress tracking via DynamoDB
-    os.environ['_EXECUTION_ID'] = execution_id
-    print(f"Code generator execution_id: {execution_id}")
-    print(f"Full event: {event}")
+def load_generation_config():
+    """
+    Load the prompt configurations and the model name (kept across warm invocations, see
+    warm_state.load_cached_file).
 
-    # Modified section of async_lambda_handler to use secrets
-    api_key = get_api_key_from_secrets()        # Check whether the required scripts and config files are present in the Lambda environment
-    storage_dir = '/tmp'
+    Returns:
+        tuple: (prompt_config_dict, stack_generation_prompt_dict, model_name)
+    """
     local_dir='/var/task'
-    print(os.listdir(local_dir))
   
     # Load configuration from environment variables
     prompts_config_file = os.environ['A2CAI_PROMPTS']
     model_config_file = os.environ['MODEL_NAME']
     stack_gen_prompts_config_file = os.environ['STACK_GENERATION_PROMPTS']
-    result_bucket_name = os.environ['RESULTS_BUCKET_NAME']
 
     # Load the main prompts configuration from YAML file
     prompt_config_dict = load_yaml_data(os.path.join(local_dir,prompts_config_file))
@@ -71,15 +80,69 @@ async def async_lambda_handler(event, context):
     # Load additional stack generation prompts from separate YAML file
     stack_generation_prompt_dict = load_stack_generation_prompts(os.path.join(stack_gen_prompts_config_file))
 
+    return prompt_config_dict, stack_generation_prompt_dict, model_name
+
+
+async def generate_code(event, api_key, config):
+    """
+    Generate the code for one diagram of the current execution: serve it from the result cache
+    or run a2c_ai_do_it_all, then publish the download URL.
+
+    Args:
+        event (dict): 'file_path' (S3 URI), 'code_language' and optionally 'bypass_cache' and
+            'previous_execution_id' (an earlier execution of an edited version of the diagram,
+            whose unchanged modules are reused).
+        api_key (str): Completions API key.
+        config (tuple): Result of load_generation_config.
+
+    Returns:
+        dict: The presigned download URL and a success message.
+    """
+    image_s3_uri = event['file_path']
+    code_language = event['code_language']
+    bypass_cache = str(event.get('bypass_cache', False)).lower() == 'true'
+    prompt_config_dict, stack_generation_prompt_dict, model_name = config
+    storage_dir = '/tmp'
+    result_bucket_name = os.environ['RESULTS_BUCKET_NAME']
+
+    # Read the diagram into memory up front so identical submissions can be served from the result cache
+    image_bytes = await run_blocking(read_s3_object, image_s3_uri)
+    cache_key = compute_result_cache_key(image_bytes, code_language, model_name, prompt_config_dict, stack_generation_prompt_dict)
+
+    if cache_key and not bypass_cache:
+        cached_artifact = await run_blocking(lookup_cached_artifact, result_bucket_name, cache_key)
+        if cached_artifact:
+            cached_object_key, artifact_name, source_execution_id = cached_artifact
+            final_s3_path, s3_object_key = await run_blocking(copy_cached_artifact, result_bucket_name, cached_object_key, artifact_name)
+            # A later edit of the diagram can name this execution as its previous_execution_id
+            execution_id = current_execution_id()
+            if not (execution_id and source_execution_id and await run_blocking(copy_run_manifest, result_bucket_name, source_execution_id, execution_id, s3_object_key)):
+                log.info("No run manifest for the cached result; an incremental run based on this execution regenerates everything",
+                         source_execution_id=source_execution_id)
+            presigned_url = await run_blocking(generate_presigned_url, result_bucket_name, s3_object_key, expiration=86400)
+            await send_download_notification(presigned_url)
+            return {
+                'message': 'Code generation completed successfully (cached result)',
+                'presigned_url': presigned_url
+            }
+
     # Call main processing function with all configured parameters
-    # Returns path to generated zip file containing the code
-    zipfilepath = await a2c_ai_do_it_all(image_s3_uri, storage_dir, code_language, prompt_config_dict, stack_generation_prompt_dict,api_key,model_name)
+    # The zip is built and uploaded to the results bucket while the code is generated
+    artifact_writer = ArtifactWriter(result_bucket_name)
+    try:
+        final_s3_path = await a2c_ai_do_it_all(image_s3_uri, storage_dir, code_language, prompt_config_dict, stack_generation_prompt_dict,api_key,model_name, image_bytes=image_bytes, artifact_writer=artifact_writer,
+                                             previous_execution_id=event.get('previous_execution_id'))
+    except BaseException:
+        await run_blocking(artifact_writer.abort)
+        raise
+    s3_object_key = artifact_writer.s3_key
 
-    # Upload the generated zip file to S3
-    final_s3_path, s3_object_key = copy_file_to_s3(zipfilepath, result_bucket_name)
+    # Store the result for repeat submissions of the same diagram
+    if cache_key:
+        await run_blocking(store_uploaded_artifact_in_cache, result_bucket_name, s3_object_key, cache_key, current_execution_id())
 
     # Generate a presigned URL for the uploaded file
-    presigned_url = generate_presigned_url(result_bucket_name, s3_object_key, expiration=86400)
+    presigned_url = await run_blocking(generate_presigned_url, result_bucket_name, s3_object_key, expiration=86400)
 
     # Write download URL to DynamoDB for frontend polling
     await send_download_notification(presigned_url)
@@ -90,8 +153,180 @@ async def async_lambda_handler(event, context):
         'presigned_url': presigned_url
     }
 
+
+async def async_lambda_handler(event, context):
+    """
+    AWS Lambda handler function that orchestrates the A2A AI code generation process.
+    Loads configuration from YAML files, sets up prompts and parameters,
+    and calls the a2c_ai_do_it_all function to generate code from an architecture diagram.
+
+    Identical submissions (same image bytes, language, model and prompts) are served
+    from the result cache in the results bucket unless the event sets 'bypass_cache'.
+    A failed run is marked FAILED in the synthesis progress table.
+
+    Args:
+        event (dict): Lambda event data containing S3 URI and code language information,
+            and optionally 'bypass_cache' to force a fresh generation.
+        context (object): Lambda context object.
+
+    Returns:
+        dict: A dictionary containing the path to the generated zip file and a success message.
+    """
+
+    execution_id = event.get('execution_id', '')
+    bypass_cache = str(event.get('bypass_cache', False)).lower() == 'true'
+    
+    # Set execution ID for progress tracking via DynamoDB
+    os.environ['_EXECUTION_ID'] = execution_id
+    # Bypass also skips stage cache reads (fresh responses are still stored)
+    os.environ['_BYPASS_CACHE'] = 'true' if bypass_cache else 'false'
+    log.info("Code generator invoked", event=event)
+
+    try:
+        # Modified section of async_lambda_handler to use secrets
+        api_key = await run_blocking(get_api_key_from_secrets)        # Check whether the required scripts and config files are present in the Lambda environment
+        config = load_generation_config()
+
+        return await generate_code(event, api_key, config)
+    except Exception as e:
+        await send_failure_notification(str(e))
+        raise
+    finally:
+        # Release the execution's progress publisher, also when the run failed before its final write
+        await flush_progress()
+
+
+def normalize_batch_jobs(event):
+    """
+    Expand a batch event into one event per diagram.
+
+    Jobs are given as 'jobs': [{'file_path', 'code_language', 'execution_id', 'bypass_cache',
+    'previous_execution_id'}, ...];
+    'code_language' and 'bypass_cache' default to the batch event's values, and a job without an
+    'execution_id' gets '<batch execution_id>-<index>'.
+    """
+    batch_id = event.get('batch_id') or event.get('execution_id') or f"batch-{uuid.uuid4().hex[:12]}"
+    jobs = []
+    for index, job in enumerate(event['jobs']):
+        if isinstance(job, str):
+            job = {'file_path': job}
+        job = dict(job)
+        job.setdefault('code_language', event.get('code_language', 'python'))
+        job.setdefault('bypass_cache', event.get('bypass_cache', False))
+        job.setdefault('execution_id', f"{batch_id}-{index:04d}")
+        jobs.append(job)
+    return batch_id, jobs
+
+
+async def async_batch_handler(event, context):
+    """
+    Generate code for many diagrams in one invocation.
+
+    Jobs run concurrently (at most BATCH_MAX_CONCURRENT_JOBS at a time) on one event loop and share
+    the API key, prompt configs, HTTP session, AWS clients, model schedulers and stage cache, so the
+    batch is throttled as a whole instead of every job bursting against the model quotas. Each job
+    has its own execution: its own zip, progress record, trace and log transcript. A failed job is
+    marked FAILED in its progress record and does not stop the others. Jobs not started before the
+    invocation is BATCH_TIME_RESERVE_SECONDS from its timeout are returned as 'skipped' for
+    resubmission.
+
+    Args:
+        event (dict): 'jobs' (see normalize_batch_jobs), optionally 'batch_id', 'code_language'
+            and 'bypass_cache' defaults.
+        context (object): Lambda context object (used for the remaining time), may be None.
+
+    Returns:
+        dict: Per-job results and aggregate throughput (jobs, succeeded, failed, skipped,
+            elapsedSeconds, jobsPerMinute, meanJobSeconds).
+    """
+    batch_id, jobs = normalize_batch_jobs(event)
+    log.info("Batch invoked", batch_id=batch_id, jobs=len(jobs))
+
+    api_key = await run_blocking(get_api_key_from_secrets)
+    config = load_generation_config()
+    job_slots = asyncio.Semaphore(int(os.environ.get('BATCH_MAX_CONCURRENT_JOBS', DEFAULT_BATCH_MAX_CONCURRENT_JOBS)))
+    time_reserve_ms = float(os.environ.get('BATCH_TIME_RESERVE_SECONDS', DEFAULT_BATCH_TIME_RESERVE_SECONDS)) * 1000
+    batch_started = time.monotonic()
+
+    async def run_job(job):
+        execution_id = job['execution_id']
+        async with job_slots:
+            if context is not None and context.get_remaining_time_in_millis() < time_reserve_ms:
+                return {'execution_id': execution_id, 'file_path': job['file_path'], 'status': 'skipped'}
+            # gather runs every job in its own task, so the execution is bound to this job only
+            set_execution(execution_id, str(job['bypass_cache']).lower() == 'true')
+            trace = start_trace('code_generation', execution_id=execution_id)
+            job_started = time.monotonic()
+            try:
+                result = await generate_code(job, api_key, config)
+                status = 'succeeded'
+            except Exception as e:
+                trace.status = 'error'
+                log.exception("Batch job failed: %s", e, file_path=job['file_path'])
+                await send_failure_notification(str(e))
+                result = {'error': str(e)}
+                status = 'failed'
+            finally:
+                await flush_transcript(execution_id)
+                await run_blocking(finish_trace, trace)
+            return {'execution_id': execution_id, 'file_path': job['file_path'], 'status': status,
+                    'seconds': round(time.monotonic() - job_started, 2), **result}
+
+    results = await asyncio.gather(*(run_job(job) for job in jobs))
+
+    elapsed = time.monotonic() - batch_started
+    finished = [result for result in results if result['status'] != 'skipped']
+    summary = {
+        'batch_id': batch_id,
+        'jobs': len(jobs),
+        'succeeded': sum(result['status'] == 'succeeded' for result in results),
+        'failed': sum(result['status'] == 'failed' for result in results),
+        'skipped': sum(result['status'] == 'skipped' for result in results),
+        'elapsedSeconds': round(elapsed, 2),
+        'jobsPerMinute': round(len(finished) * 60 / elapsed, 2) if elapsed > 0 else 0,
+        'meanJobSeconds': round(sum(result['seconds'] for result in finished) / len(finished), 2) if finished else 0,
+    }
+    log.info("Batch finished", **summary)
+    return {**summary, 'results': results}
+
+
+def batch_lambda_handler(event, context):
+    """
+    Synchronous entry point for async_batch_handler; lambda_handler delegates to it for events
+    with 'jobs'.
+    """
+    loop = get_persistent_event_loop()
+    try:
+        return loop.run_until_complete(async_batch_handler(event, context))
+    except BaseException:
+        loop.run_until_complete(reset_http_session())
+        raise
+    finally:
+        save_cassette()
+        cancel_pending_tasks(loop)
+
+
 def lambda_handler(event, context):
-    loop = asyncio.get_event_loop()
-    result = loop.run_until_complete(async_lambda_handler(event, context))
+    if 'jobs' in event:
+        return batch_lambda_handler(event, context)
+    # One loop for the lifetime of the container, so the shared HTTP session and its
+    # connections survive between warm invocations
+    loop = get_persistent_event_loop()
+    # Stage timings and token counts go to CloudWatch (EMF) and the execution's progress item
+    trace = start_trace('code_generation', execution_id=event.get('execution_id', ''))
+    try:
+        result = loop.run_until_complete(async_lambda_handler(event, context))
+    except BaseException:
+        trace.status = 'error'
+        # Pooled connections may hold half-read responses from the failed run
+        loop.run_until_complete(reset_http_session())
+        raise
+    finally:
+        # Step outputs (and every payload with LOG_TRANSCRIPTS=s3) are uploaded even when the run failed
+        loop.run_until_complete(flush_transcript(event.get('execution_id', '')))
+        # MODEL_TRANSPORT_MODE=record: keep what this invocation recorded
+        save_cassette()
+        cancel_pending_tasks(loop)
+        finish_trace(trace)
     
     return result
\ No newline at end of file
@@ -1,16 +1,349 @@
 import json
-from code_generator_utils_v2 import *
+from code_generator_utils_v2 import role, get_ai_response, code_generation_do_it_all
 import asyncio
 import os
-import boto3 
-from urllib.parse import urlparse
-import base64
-from utils2_v2 import *
-import aiohttp
-import pprint
+import threading
+from contextlib import aclosing
+from utils2_v2 import get_stack_name, get_module_filename, write_staging_code_to_file, write_resource_spec_to_file, write_reused_file, zip_directory
 import re
+from stage_cache import get_stage_cache, make_stage_cache_key
+from aws_async import get_aws_io_executor, run_blocking
+from staging_template import write_staging_app_file
+from rate_limiter import RetryableModelError, get_scheduler, parse_retry_after, estimate_tokens
+from image_preprocessing import prepare_image
+from image_ingest import InlineImage, read_s3_object, serialize_request_body
+from botocore.exceptions import ClientError
+from aws_clients import get_client
+from progress_publisher import publish_progress
+from http_session import get_http_session
+from tracing import trace_span, traced, record_model_call
+from model_transport import make_transport_key, call_model, stream_model
+from token_budget import STAGE_TOKEN_BUDGETS, plan_tokens, is_truncated
+from run_manifest import IncrementalPlan, load_run_manifest, build_run_manifest, store_run_manifest, read_artifact_files, diff_resource_specs, normalize_module_resources
+from result_cache import hash_prompt_configs
+from execution_context import current_execution_id
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+BEDROCK_MODEL_ID = 'us.anthropic.claude-sonnet-4-5-20250929-v1:0'
+
+# Minimum cacheable prompt prefix of BEDROCK_MODEL_ID, in tokens
+DEFAULT_PROMPT_CACHE_MIN_TOKENS = 1024
+
+# Key of the modules description that maps each module to its resources (not a module itself)
+MODULE_RESOURCES_KEY = 'Module Resources'
+
+# The module description stages restructure the architecture description into JSON. Sampled at
+# the Bedrock default of 1.0, the same diagram gets different resource names and settings in its
+# 'Module Resources' from run to run, and incremental runs then regenerate unchanged modules
+MODULE_DESCRIPTION_TEMPERATURE = 0
+
+# Model calls per module in code_generation_do_it_all, used for module-level progress (70-79%)
+MODULE_GENERATION_STEPS = 4
+
+# Bedrock error codes worth retrying with backoff
+RETRYABLE_BEDROCK_ERRORS = {
+    'ThrottlingException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+    'InternalServerException',
+}
+
+
+def as_retryable_bedrock_error(error):
+    """
+    Convert a throttling/transient botocore ClientError into RetryableModelError, or return None.
+    """
+    if not isinstance(error, ClientError):
+        return None
+    if error.response.get('Error', {}).get('Code') not in RETRYABLE_BEDROCK_ERRORS:
+        return None
+    headers = error.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    return RetryableModelError(str(error), retry_after=parse_retry_after(headers.get('retry-after')))
+
+
+def estimate_request_tokens(request_body):
+    """
+    Tokens-per-minute reservation for a Bedrock request: estimated prompt text plus max_tokens.
+    """
+    prompt_text = ''.join(
+        block.get('text', '')
+        for message in request_body['messages']
+        for block in message['content']
+        if isinstance(block, dict)
+    )
+    return estimate_tokens(prompt_text) + request_body['max_tokens']
+
+
+def record_bedrock_usage(response_body):
+    """
+    Add the input/output tokens from a Bedrock response's usage block to the current trace span,
+    with the prompt-cache reads and writes (input_tokens only counts the uncached rest).
+    """
+    usage = response_body.get('usage') or {}
+    record_model_call(
+        input_tokens=usage.get('input_tokens', 0),
+        output_tokens=usage.get('output_tokens', 0),
+        cache_read_tokens=usage.get('cache_read_input_tokens', 0),
+        cache_write_tokens=usage.get('cache_creation_input_tokens', 0),
+    )
+
+
+def is_prompt_caching_enabled():
+    return os.environ.get('PROMPT_CACHING', 'true').lower() == 'true'
+
 
-bedrock_runtime = boto3.client('bedrock-runtime')
+def get_prompt_cache_min_tokens():
+    # Shortest prefix the model caches: 1024 tokens for Claude Sonnet and Opus, 2048 for Haiku
+    return int(os.environ.get('PROMPT_CACHE_MIN_TOKENS', DEFAULT_PROMPT_CACHE_MIN_TOKENS))
+
+
+def cacheable_prompt_content(static_prompt, variable_text=None):
+    """
+    Message content for a stage prompt: the static instructions first, then the run's variable text.
+    The static block is marked as a prompt-cache checkpoint (cache_control) only when it reaches
+    the model's minimum cacheable length (PROMPT_CACHE_MIN_TOKENS, estimated at ~4 characters per
+    token); Bedrock ignores shorter checkpoints. The shipped stage prompts are all below 1024
+    tokens, so with Claude Sonnet no checkpoint is sent and no prompt is cached until a prompt
+    grows past the minimum. PROMPT_CACHING=false leaves out the checkpoint.
+    """
+    static_block = {"type": "text", "text": static_prompt}
+    if is_prompt_caching_enabled() and estimate_tokens(static_prompt) >= get_prompt_cache_min_tokens():
+        static_block["cache_control"] = {"type": "ephemeral"}
+    content = [static_block]
+    if variable_text:
+        content.append({"type": "text", "text": variable_text})
+    return content
+
+
+def call_bedrock_model(request_body, modelId=BEDROCK_MODEL_ID):
+    """
+    Blocking invoke_model call. Throttling and transient errors are raised as RetryableModelError.
+    Goes through the model transport, so it can be recorded or replayed (MODEL_TRANSPORT_MODE).
+    """
+    def invoke_model():
+        try:
+            response = get_client('bedrock-runtime').invoke_model(modelId=modelId, body=serialize_request_body(request_body))
+        except ClientError as e:
+            raise as_retryable_bedrock_error(e) or e
+        return json.loads(response['body'].read())
+
+    return call_model(make_transport_key('bedrock', modelId, request_body), 'bedrock', modelId, invoke_model)
+
+
+def stage_cache_max_tokens(request_body, budget):
+    """
+    max_tokens value the stage cache keys a request on. With a budget the key uses the stage's
+    ceiling: the cached response is the complete (continued) output whatever max_tokens was
+    reserved, so it is reused across budgets.
+    """
+    return budget.ceiling if budget else request_body['max_tokens']
+
+
+def continuation_request(request_body, partial_text, max_tokens):
+    """
+    Request that continues a response cut off at max_tokens: the partial output is sent back as
+    an assistant prefill, which the model continues. A prefill may not end in whitespace.
+    """
+    messages = request_body['messages'] + [{'role': 'assistant', 'content': [{'type': 'text', 'text': partial_text}]}]
+    return dict(request_body, max_tokens=max_tokens, messages=messages)
+
+
+async def complete_bedrock_response(request_body, invoke, budget):
+    """
+    Run invoke(request_body) and, while the response stops at max_tokens, continue it from the
+    partial text (up to budget.max_continuations times). Returns one response body with the
+    joined text, the last stop_reason and the summed usage.
+    """
+    response_body = await invoke(request_body)
+    record_model_call(reserved_tokens=request_body['max_tokens'])
+    if budget is None:
+        return response_body
+
+    text = response_text(response_body)
+    usage = dict(response_body.get('usage') or {})
+    continuations = 0
+    while is_truncated(response_body.get('stop_reason')) and continuations < budget.max_continuations:
+        continuations += 1
+        text = text.rstrip()
+        max_tokens = budget.continuation_max_tokens(continuations)
+        log.info("Response truncated at max_tokens, continuing", stage=budget.stage, continuation=continuations, max_tokens=max_tokens)
+        response_body = await invoke(continuation_request(request_body, text, max_tokens))
+        record_model_call(reserved_tokens=max_tokens)
+        text += response_text(response_body)
+        for counter, value in (response_body.get('usage') or {}).items():
+            if isinstance(value, int):
+                usage[counter] = usage.get(counter, 0) + value
+    if is_truncated(response_body.get('stop_reason')):
+        log.warning("Response still truncated after continuations", stage=budget.stage, continuations=continuations)
+
+    budget.record(usage.get('output_tokens') or estimate_tokens(text), continuations)
+    return dict(response_body, content=[{'type': 'text', 'text': text}] if text else [], usage=usage)
+
+
+def response_text(response_body):
+    content = response_body.get('content')
+    if isinstance(content, list) and len(content) > 0:
+        return content[0].get('text', '')
+    return ''
+
+
+async def invoke_bedrock_model(request_body, modelId=BEDROCK_MODEL_ID, budget=None):
+    """
+    Invoke a Bedrock model and return the parsed response body.
+
+    Responses are memoized in the stage cache on (provider, model, messages, max_tokens, temperature),
+    so reruns reuse every stage whose inputs did not change. Calls are admitted through the shared
+    'bedrock' scheduler, which bounds concurrency and retries throttling with backoff. With a
+    token budget (see token_budget.plan_tokens) a response cut off at max_tokens is continued.
+    """
+    stage_cache = get_stage_cache()
+    cache_key = make_stage_cache_key('bedrock', modelId, request_body['messages'], stage_cache_max_tokens(request_body, budget), request_body.get('temperature'))
+    cached_response = await run_blocking(stage_cache.get, cache_key)
+    if cached_response is not None:
+        log.info("Stage cache hit for Bedrock call %s", cache_key[:12])
+        record_model_call(cache_hits=1)
+        return json.loads(cached_response)
+
+    async def invoke(body):
+        response_body = await get_scheduler('bedrock').run(
+            lambda: run_blocking(call_bedrock_model, body, modelId),
+            estimated_tokens=estimate_request_tokens(body),
+        )
+        record_bedrock_usage(response_body)
+        return response_body
+
+    response_body = await complete_bedrock_response(request_body, invoke, budget)
+
+    if isinstance(response_body.get('content'), list) and len(response_body['content']) > 0:
+        await run_blocking(stage_cache.put, cache_key, json.dumps(response_body))
+    return response_body
+
+
+def is_streaming_enabled():
+    return os.environ.get('MODEL_STREAMING', 'true').lower() == 'true'
+
+
+async def stream_bedrock_model(request_body, modelId=BEDROCK_MODEL_ID):
+    """
+    Invoke a Bedrock model with invoke_model_with_response_stream and yield its events.
+
+    The blocking botocore event stream is drained on an executor thread and handed to the
+    event loop through a queue. If the consumer stops early (cancelled or failed), the stream is
+    closed and the thread stops at the next event instead of reading the response to its end.
+
+    Yields:
+        dict: Anthropic messages-API stream events (message_start, content_block_delta, message_delta, ...)
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    end_of_stream = object()
+    stopped = threading.Event()
+    event_stream = None
+
+    def put(item):
+        if not stopped.is_set():
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def pump_events():
+        nonlocal event_stream
+        try:
+            response = get_client('bedrock-runtime').invoke_model_with_response_stream(modelId=modelId, body=serialize_request_body(request_body))
+            event_stream = response['body']
+            for event in event_stream:
+                if stopped.is_set():
+                    break
+                if 'chunk' in event:
+                    put(json.loads(event['chunk']['bytes']))
+            put(end_of_stream)
+        except Exception as e:
+            put(as_retryable_bedrock_error(e) or e)
+        finally:
+            if stopped.is_set() and event_stream is not None:
+                event_stream.close()
+
+    pump_future = loop.run_in_executor(get_aws_io_executor(), pump_events)
+    finished = False
+    try:
+        while True:
+            event = await queue.get()
+            if event is end_of_stream:
+                finished = True
+                break
+            if isinstance(event, Exception):
+                finished = True
+                raise event
+            yield event
+    finally:
+        if finished:
+            await pump_future
+        else:
+            stopped.set()
+            if event_stream is not None:
+                # Unblocks a pump waiting for the next event
+                event_stream.close()
+
+
+async def invoke_bedrock_model_streaming(request_body, modelId=BEDROCK_MODEL_ID, on_chunk=None, budget=None):
+    """
+    Streaming counterpart of invoke_bedrock_model.
+
+    Text deltas are passed to on_chunk as they arrive; the assembled response body has the same
+    shape as the non-streaming one and shares its stage cache entries. A throttled request is only
+    retried if it failed before any text was emitted. Continuations of a truncated response
+    stream on to on_chunk.
+    """
+    stage_cache = get_stage_cache()
+    cache_key = make_stage_cache_key('bedrock', modelId, request_body['messages'], stage_cache_max_tokens(request_body, budget), request_body.get('temperature'))
+    cached_response = await run_blocking(stage_cache.get, cache_key)
+    if cached_response is not None:
+        log.info("Stage cache hit for Bedrock call %s", cache_key[:12])
+        record_model_call(cache_hits=1)
+        response_body = json.loads(cached_response)
+        if on_chunk and response_body.get('content'):
+            on_chunk(response_body['content'][0].get('text', ''))
+        return response_body
+
+    async def consume_stream(body):
+        text_chunks = []
+        response_body = {'content': [], 'stop_reason': None, 'usage': {}}
+        try:
+            transport_key = make_transport_key('bedrock', modelId, body, streaming=True)
+            # aclosing stops the stream right away if on_chunk fails
+            async with aclosing(stream_model(transport_key, 'bedrock', modelId, lambda: stream_bedrock_model(body, modelId))) as events:
+                async for event in events:
+                    event_type = event.get('type')
+                    if event_type == 'message_start':
+                        response_body['usage'].update(event.get('message', {}).get('usage', {}))
+                    elif event_type == 'content_block_delta':
+                        text = event.get('delta', {}).get('text', '')
+                        if text:
+                            text_chunks.append(text)
+                            if on_chunk:
+                                on_chunk(text)
+                    elif event_type == 'message_delta':
+                        response_body['stop_reason'] = event.get('delta', {}).get('stop_reason')
+                        response_body['usage'].update(event.get('usage', {}))
+        except RetryableModelError as e:
+            if text_chunks:
+                # Partial output was already emitted; retrying would duplicate it
+                raise RuntimeError(f"Bedrock stream interrupted after partial output: {e}") from e
+            raise
+        if text_chunks:
+            response_body['content'] = [{'type': 'text', 'text': ''.join(text_chunks)}]
+        return response_body
+
+    async def invoke(body):
+        response_body = await get_scheduler('bedrock').run(lambda: consume_stream(body), estimated_tokens=estimate_request_tokens(body))
+        record_bedrock_usage(response_body)
+        return response_body
+
+    response_body = await complete_bedrock_response(request_body, invoke, budget)
+
+    if response_body['content']:
+        await run_blocking(stage_cache.put, cache_key, json.dumps(response_body))
+    return response_body
 
 
 def extract_json_from_response(text):
@@ -28,65 +361,41 @@ def extract_json_from_response(text):
         return json.loads(match.group(1).strip())
     raise json.JSONDecodeError("Could not extract JSON from model response", text, 0)
 
-def download_file_from_s3(s3_uri, local_dir):
-    
+def streamed_progress(start, end, expected_tokens):
     """
-    Download a file from an S3 bucket to a local directory.
-
-    :param s3_uri: str, S3 URI of the file (e.g., 's3://bucket_name/key_name')
-    :param local_dir: str, Local directory path where the file will be saved
-    :return: str, Local file path of the downloaded file
-    
+    on_chunk callback that moves progress from start towards end (exclusive) as the streamed
+    text approaches expected_tokens.
     """
-    
-    try:
-        # Parse the S3 URI
-        parsed_url = urlparse(s3_uri)
-        bucket_name = parsed_url.netloc
-        key_name = parsed_url.path.lstrip('/')
-
-        # Create a boto3 client
-        s3_client = boto3.client('s3')
-
-        # Ensure the local directory exists
-        if not os.path.exists(local_dir):
-            os.makedirs(local_dir)
+    received_chars = 0
+    published = start
 
-        # Define the local file path
-        local_file_path = os.path.join(local_dir, os.path.basename(key_name))
+    def on_chunk(text):
+        nonlocal received_chars, published
+        received_chars += len(text)
+        progress = start + min(end - start - 1, (end - start) * received_chars // (4 * expected_tokens))
+        if progress > published:
+            published = progress
+            publish_progress(progress)
 
-        # Download the file from S3
-        s3_client.download_file(bucket_name, key_name, local_file_path)
-        print("File downloaded")
-
-        return local_file_path
-
-    except Exception as e:
-        
-        print(f"Error downloading file from S3: {e}")
-        return None
-    
-def get_image_data(image_file):
-    
-    with open(image_file, "rb") as imagefile:
-        image_data = base64.b64encode(imagefile.read()).decode("utf-8")
-        print("Image data generated")
-        
-    return image_data
+    return on_chunk
 
 
-def generate_architecture_description(prompt, encoded_image):
+async def generate_architecture_description(prompt, encoded_image, on_chunk=None, media_type="image/png"):
     
     """
-    Generates an architecture description using Amazon Bedrock's Claude 3.5 Sonnet model by analyzing 
-    provided text prompt and image input.
+    Generates an architecture description using the Amazon Bedrock model BEDROCK_MODEL_ID by
+    analyzing provided text prompt and image input.
 
-    This function sends a request to the Claude 3.5 Sonnet model through Amazon Bedrock Runtime, 
-    combining both text and image inputs to generate a descriptive analysis of architectural elements.
+    This function sends a request to the model through Amazon Bedrock Runtime, combining both
+    text and image inputs to generate a descriptive analysis of architectural elements.
 
     Args:
         prompt (str): The text prompt guiding the model's analysis of the architecture.
-        encoded_image (str): A base64-encoded PNG image string of the architecture to be analyzed.
+        encoded_image (str or bytes): The architecture image, either base64-encoded or as raw bytes.
+            Raw bytes are base64-encoded directly into the request payload (see image_ingest).
+        on_chunk (callable, optional): Called with each text delta when streaming is enabled,
+            e.g. streamed_progress.
+        media_type (str, optional): Media type of encoded_image, 'image/png' by default.
 
     Returns:
         dict: A dictionary containing the generated architecture description with the following structure:
@@ -106,33 +415,37 @@ def generate_architecture_description(prompt, encoded_image):
     Example:
         >>> prompt = "Describe the architectural style and key features of this building"
         >>> encoded_image = "base64_encoded_image_string"
-        >>> result = generate_architecture_description(prompt, encoded_image)
+        >>> result = await generate_architecture_description(prompt, encoded_image)
         >>> print(result["architecture_description"])
 
     Notes:
-        - The function uses the Claude 3 Sonnet model (version 20240620-v1:0)
-        - Maximum token limit is set to 2048 tokens
-        - Expects PNG image format
-        - Prints the generated description to stdout in addition to returning it
+        - max_tokens comes from the 'architecture_description' token budget (at most 2048 per
+          request); a description cut off at max_tokens is continued
+        - Accepts PNG, JPEG, GIF or WebP images (see media_type)
+        - Logs the generated description at debug level in addition to returning it
+        - Uses invoke_model_with_response_stream unless MODEL_STREAMING is 'false'
+        - The prompt is sent ahead of the image, as a prompt-cache checkpoint if it is long enough
+          (see cacheable_prompt_content)
     """
     
+    if isinstance(encoded_image, (bytes, bytearray)):
+        encoded_image = InlineImage(encoded_image)
+
+    budget = plan_tokens('architecture_description')
+
     # Prepare the request body
     request_body = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 2048,
+        "max_tokens": budget.max_tokens,
         "messages": [
             {
                 "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt,
-                    },
+                "content": cacheable_prompt_content(prompt) + [
                     {
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/png",
+                            "media_type": media_type,
                             "data": encoded_image,
                         },
                     },
@@ -141,133 +454,150 @@ def generate_architecture_description(prompt, encoded_image):
         ],
     }
 
-    modelId = 'us.anthropic.claude-sonnet-4-5-20250929-v1:0'
+    modelId = BEDROCK_MODEL_ID
     accept = 'application/json'
     contentType = 'application/json'
 
     # Invoke the model and get the response
-    response = bedrock_runtime.invoke_model(modelId=modelId, body=json.dumps(request_body))
-    response_body = json.loads(response['body'].read())
+    if is_streaming_enabled():
+        response_body = await invoke_bedrock_model_streaming(request_body, modelId, on_chunk=on_chunk, budget=budget)
+    else:
+        response_body = await invoke_bedrock_model(request_body, modelId, budget=budget)
 
     # Extract generated text
     if isinstance(response_body['content'], list) and len(response_body['content']) > 0:
         generated_text = response_body['content'][0].get('text', '')
-        print("Architecture Description",generated_text)
+        log.debug("Architecture description", payload=generated_text)
         
         return {"architecture_description": generated_text}
     else:
         return {"architecture_description": "Unexpected response format"}
     
     
-def generate_module_descriptions(architecture_description_dict , modules_description_prompt):
+async def generate_module_descriptions(architecture_description_dict , modules_description_prompt):
 
     architecture_description =architecture_description_dict['architecture_description']
     
     prompt = modules_description_prompt + architecture_description
-    print("MODULE DESCRIPTION PROMPT", prompt )
-    
+    log.debug("Module description prompt", payload=prompt)
     
+    budget = plan_tokens('module_descriptions', architecture_description)
     
     request_body = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 5048,
+        "max_tokens": budget.max_tokens,
+        "temperature": MODULE_DESCRIPTION_TEMPERATURE,
         "messages": [
             {
                 "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt,
-                    },
-                    
-                ],
+                "content": cacheable_prompt_content(modules_description_prompt, architecture_description),
             }
         ],
     }
 
-    modelId = 'us.anthropic.claude-sonnet-4-5-20250929-v1:0'
+    modelId = BEDROCK_MODEL_ID
     accept = 'application/json'
     contentType = 'application/json'
 
     # Invoke the model and get the response
-    response = bedrock_runtime.invoke_model(modelId=modelId, body=json.dumps(request_body))
-    response_body = json.loads(response['body'].read())
+    response_body = await invoke_bedrock_model(request_body, modelId, budget=budget)
 
     # Extract generated text
     if isinstance(response_body['content'], list) and len(response_body['content']) > 0:
         module_descriptions = response_body['content'][0].get('text', '')
-        print("Module Descriptions",module_descriptions)
+        log.debug("Module descriptions", payload=module_descriptions)
         
         return json.dumps(module_descriptions)
     else:
         return {"module_descriptions": "Unexpected response format"}
     
     
-def generate_deployment_sequence(modules_description , deployment_sequence_prompt):
+async def generate_deployment_sequence(modules_description , deployment_sequence_prompt):
 
     #modules_description =modules_description_dict['modules_description']
     
-    prompt = deployment_sequence_prompt + modules_description
-    
     deployment_sequence_dict ={ 'modules_description' : ''}
     
+    budget = plan_tokens('deployment_sequence', modules_description)
     
     request_body = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 10000,
+        "max_tokens": budget.max_tokens,
+        "temperature": MODULE_DESCRIPTION_TEMPERATURE,
         "messages": [
             {
                 "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt,
-                    },
-                    
-                ],
+                "content": cacheable_prompt_content(deployment_sequence_prompt, modules_description),
             }
         ],
     }
 
-    modelId = 'us.anthropic.claude-sonnet-4-5-20250929-v1:0'
+    modelId = BEDROCK_MODEL_ID
     accept = 'application/json'
     contentType = 'application/json'
 
     # Invoke the model and get the response
-    response = bedrock_runtime.invoke_model(modelId=modelId, body=json.dumps(request_body))
-    response_body = json.loads(response['body'].read())
+    response_body = await invoke_bedrock_model(request_body, modelId, budget=budget)
 
     # Extract generated text
     if isinstance(response_body['content'], list) and len(response_body['content']) > 0:
         module_descriptions_with_sequence = response_body['content'][0].get('text', '')
         deployment_sequence_dict['modules_description']=module_descriptions_with_sequence
-        print("DEPLOYMENT SEQUENCE", deployment_sequence_dict)
+        log.debug("Deployment sequence", payload=module_descriptions_with_sequence)
         
         
         
         return deployment_sequence_dict
     
     
-def generate_resource_spec(architecture_description_dict, resource_spec_prompt):
+async def generate_modules_with_deployment_sequence(architecture_description_dict, modules_with_deployment_sequence_prompt):
+    """
+    Single-call replacement for generate_module_descriptions + generate_deployment_sequence.
+
+    Returns the modules, their descriptions and the deployment-ordered 'Module List' as one JSON
+    document, in the {'modules_description': <json text>} shape consumed by generate_module_prompts.
+    """
+    architecture_description = architecture_description_dict['architecture_description']
+    budget = plan_tokens('modules_with_deployment_sequence', architecture_description)
+
+    request_body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": budget.max_tokens,
+        "temperature": MODULE_DESCRIPTION_TEMPERATURE,
+        "messages": [{"role": "user", "content": cacheable_prompt_content(modules_with_deployment_sequence_prompt, architecture_description)}],
+    }
+
+    response_body = await invoke_bedrock_model(request_body, budget=budget)
+
+    if isinstance(response_body['content'], list) and len(response_body['content']) > 0:
+        modules_with_sequence = response_body['content'][0].get('text', '')
+        log.debug("Modules with deployment sequence", payload=modules_with_sequence)
+        return {'modules_description': modules_with_sequence}
+
+    return {'modules_description': 'Unexpected response format'}
+
+
+def use_fused_module_stage(prompt_config_dict):
+    return (os.environ.get('FUSED_MODULE_STAGE', 'false').lower() == 'true'
+            and 'modules_with_deployment_sequence_prompt' in prompt_config_dict)
+
+
+async def generate_resource_spec(architecture_description_dict, resource_spec_prompt):
     """Generate a resource spec JSON from the architecture description using Bedrock."""
     architecture_description = architecture_description_dict['architecture_description']
-    prompt = resource_spec_prompt + architecture_description
+    budget = plan_tokens('resource_spec', architecture_description)
 
     request_body = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 16000,
-        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+        "max_tokens": budget.max_tokens,
+        "messages": [{"role": "user", "content": cacheable_prompt_content(resource_spec_prompt, architecture_description)}],
     }
 
-    response = bedrock_runtime.invoke_model(
-        modelId='us.anthropic.claude-sonnet-4-5-20250929-v1:0',
-        body=json.dumps(request_body),
-    )
-    response_body = json.loads(response['body'].read())
+    response_body = await invoke_bedrock_model(request_body, budget=budget)
 
     if isinstance(response_body['content'], list) and len(response_body['content']) > 0:
         raw_text = response_body['content'][0].get('text', '')
-        print("Resource Spec Response", raw_text)
+        log.debug("Resource spec response", payload=raw_text)
         return extract_json_from_response(raw_text)
 
     return {"resources": []}
@@ -278,24 +608,23 @@ def generate_module_prompts(deployment_sequence_dict, language_name):
     # Parse dictionary
     
     modules_description =deployment_sequence_dict['modules_description']
-    print("Modules Description", modules_description)
     modules_description_dict=extract_json_from_response(modules_description)
+    # The per-module resource inventory is not a module (see extract_module_resources)
+    modules_description_dict.pop(MODULE_RESOURCES_KEY, None)
     
     # Create empty dictionary to store prompts
     module_prompt_dict = {}    
     
     keys = list(modules_description_dict.keys())
-    print(keys)
     
     stack_names = list(modules_description_dict.values())[-1] 
-    print("stack_names" , stack_names)
+    log.info("Modules parsed", modules=keys[1:-1], stack_names=stack_names)
     
     # Skip first and last keys, process only module information
     for key in keys[1:-1]:
         module_name = key
-        print("Module Name", module_name) 
         module_description = modules_description_dict[key]
-        print("Module Description" , module_description)
+        log.debug("Module description", module=module_name, payload=module_description)
         
         # Construct prompt for each module
         prompt = (
@@ -310,6 +639,29 @@ def generate_module_prompts(deployment_sequence_dict, language_name):
     return module_prompt_dict,stack_names
     
     
+def extract_module_resources(deployment_sequence_dict, module_names):
+    """
+    The 'Module Resources' inventory of the modules description, normalized for comparison
+    between executions (see run_manifest.normalize_module_resources).
+
+    Returns:
+        dict: module name -> normalized resources; modules without an inventory are left out.
+    """
+    try:
+        modules_description_dict = extract_json_from_response(deployment_sequence_dict['modules_description'])
+    except json.JSONDecodeError:
+        return {}
+    inventory = modules_description_dict.get(MODULE_RESOURCES_KEY)
+    if not isinstance(inventory, dict):
+        return {}
+    module_resources = {}
+    for module_name in module_names:
+        resources = normalize_module_resources(inventory.get(module_name))
+        if resources:
+            module_resources[module_name] = resources
+    return module_resources
+
+
 def generate_staging_prompt(responses,template: str, stack_names: list, language_name: str):
     
     
@@ -325,41 +677,51 @@ def generate_staging_prompt(responses,template: str, stack_names: list, language
     # Replace the placeholder stack names with the script names from parallel processing
     module_filenames_list = [path.split('/')[-1] for path in responses]
     module_filenames='\n '.join(['-' + module_filename for module_filename in module_filenames_list])
-    print(module_filenames)
     
     stack_names = [name + 'Stack' for name in stack_names]
-    print("StackNames:", stack_names)
     stack_imports = '\n '.join(['-' + stack for stack in stack_names])
-    print("Stackimports:" ,stack_imports)
     
     prompta=template.replace('app.py' ,staging_file_name)
     promptb = prompta.replace('- StackA - StackB - StackC - StackD', stack_imports)
     
     final_staging_prompt=re.sub(r'\b{}\b'.format('stack_a.py - stack_b.py - stack_c.py - stack_d.py'), module_filenames, promptb)
-    print("FINAL STAGING PROMPT")
-    pprint.pprint(final_staging_prompt)
+    log.debug("Staging prompt", module_files=module_filenames_list, stack_names=stack_names, payload=final_staging_prompt)
     
     
     # Prepare the dictionary
     staging_prompt_dict = {'staging_prompt': final_staging_prompt}
     
-    print("STAGING_PROMPT_DICT", staging_prompt_dict)
-    print("DATA TYPE STAGING PROMPT DICT" , type(staging_prompt_dict))
-    
     # Return the final JSON string
     return staging_prompt_dict
     
     
-async def modular_stack_generator_main(module_prompt_dict, code_language, local_dir, stack_dirname, stack_logfiles_dir,stack_generation_prompt_dict, api_key, model_name):
+async def modular_stack_generator_main(module_prompt_dict, code_language, local_dir, stack_dirname, stack_logfiles_dir,stack_generation_prompt_dict, api_key, model_name, artifact_writer=None, progress_callback=None):
     
     
     
     
     # Create concurrent tasks with different prompts for each module 
+    # progress_callback(completed_steps, total_steps) is called as module steps complete across all modules
+    total_steps = MODULE_GENERATION_STEPS * len(module_prompt_dict)
+    completed_steps = 0
+
+    def on_module_step(step):
+        nonlocal completed_steps
+        completed_steps += 1
+        if progress_callback:
+            progress_callback(completed_steps, total_steps)
    
-    async with aiohttp.ClientSession() as session:
-        tasks = [code_generation_do_it_all(session,module_name, module_prompt, local_dir, stack_dirname,code_language,stack_logfiles_dir,stack_generation_prompt_dict,api_key,model_name)for module_name, module_prompt in module_prompt_dict.items()]  
-        responses = await asyncio.gather(*tasks)  # Run tasks concurrently and gather results
+    async def generate_module(session, module_name, module_prompt):
+        with trace_span('module', module=module_name):
+            codefilepath = await code_generation_do_it_all(session,module_name, module_prompt, local_dir, stack_dirname,code_language,stack_logfiles_dir,stack_generation_prompt_dict,api_key,model_name, progress_callback=on_module_step)
+            # Compress each module into the artifact as soon as it is generated
+            if artifact_writer:
+                await run_blocking(artifact_writer.add_file, codefilepath)
+        return codefilepath
+
+    session = await get_http_session()
+    tasks = [generate_module(session, module_name, module_prompt) for module_name, module_prompt in module_prompt_dict.items()]  
+    responses = await asyncio.gather(*tasks)  # Run tasks concurrently and gather results
     
     
     #for module_name, module_prompt in module_prompt_dict.items():
@@ -371,14 +733,18 @@ async def modular_stack_generator_main(module_prompt_dict, code_language, local_
     
     return responses
     
+def use_llm_staging_generator():
+    return os.environ.get('STAGING_GENERATOR', 'template').lower() == 'llm'
+
+
 async def generate_staging_file (staging_prompt_dict, code_language, local_dir, stack_logfiles_dir,stack_dirname, api_key, model_name):
     
     #staging_prompt = staging_prompt_dict[0]['staging_prompt']
     staging_prompt = staging_prompt_dict['staging_prompt']
             
-    async with aiohttp.ClientSession() as session:
-        staging_prompt_response= await get_ai_response(session,api_key, role, staging_prompt, model=model_name, base_url="https://api.perplexity.ai/chat/completions")
-    write_log_to_file(staging_prompt_response, local_dir, stack_logfiles_dir)
+    session = await get_http_session()
+    staging_prompt_response= await get_ai_response(session,api_key, role, staging_prompt, model=model_name, budget=plan_tokens('staging', staging_prompt))
+    log.step_output('staging', 1, staging_prompt_response)
             
     #local_dirpath, codefilepath = write_code_to_file(staging_prompt_response, local_dir,stack_logfiles_dir,code_language)
     #write_staging_code_to_file(code_str, local_dir,stack_dirname, code_language)
@@ -387,66 +753,218 @@ async def generate_staging_file (staging_prompt_dict, code_language, local_dir,
             
     return codefilepath
     
-async def a2c_ai_do_it_all(s3_uri, local_dir,code_language, prompt_config_dict, stack_generation_prompt_dict, api_key, model_name):
-    from utils2_v2 import send_progress_update
-    
-    stack_dirname , stack_logfiles_dir =get_stack_name()
-    print("stack_dirname" , stack_dirname)
+def cancel_background_futures(futures):
+    """
+    Cancel the futures of a failed run that are still pending. The outcome of finished ones is
+    retrieved, so their errors aren't reported as never retrieved.
+    """
+    for future in futures:
+        if not future.done():
+            future.cancel()
+        elif not future.cancelled():
+            future.exception()
 
 
-    arch_prompt=prompt_config_dict['architecture_description_prompt']      # Prompt to generate architecture description
-    modules_description_prompt=prompt_config_dict['modules_description_prompt']       # Prompt to generate modules description
-    staging_prompt_template=prompt_config_dict['staging_prompt_template']        # prompt Template to generate a staging file
-    deployment_sequence_prompt=prompt_config_dict['deployment_sequence_prompt']
-    resource_spec_prompt=prompt_config_dict['resource_spec_prompt']  
+async def a2c_ai_do_it_all(s3_uri, local_dir,code_language, prompt_config_dict, stack_generation_prompt_dict, api_key, model_name, image_bytes=None, artifact_writer=None, previous_execution_id=None):
+    """
+    Run the whole pipeline for one diagram.
 
-    # Step 1: Download Architecture drawing from s3
-    await send_progress_update(10)
-    image_path = download_file_from_s3(s3_uri, local_dir)
-    
-    # Step 2: Get encoded image
-    await send_progress_update(20)
-    encoded_image= get_image_data(image_path)
-    
-    # Step 3: Get Architecture Description
-    await send_progress_update(30)
-    arch_description_dict=generate_architecture_description(arch_prompt, encoded_image)
-    
-    # Step 4: Render JSON with Modular descriptions + Generate resource spec in parallel
-    await send_progress_update(40)
-    loop = asyncio.get_event_loop()
-    resource_spec_future = loop.run_in_executor(None, generate_resource_spec, arch_description_dict, resource_spec_prompt)
-    module_descriptions=generate_module_descriptions(arch_description_dict , modules_description_prompt)
+    Without an artifact_writer the stack directory is zipped to /tmp at the end and the zip path
+    is returned. With an artifact_writer (see artifact_writer.ArtifactWriter) files are added to
+    the archive as they are produced and streamed to S3; the S3 path of the archive is returned,
+    and a run manifest (see run_manifest.py) is stored for the execution.
 
-    # Step 5: Render JSON with Deployment Sequence
-    await send_progress_update(50)
-    module_descriptions=generate_deployment_sequence(module_descriptions, deployment_sequence_prompt)
-    
-    # Step 6: Generate Module prompts
-    await send_progress_update(60)
-    module_prompt_dict,modules_list = generate_module_prompts(module_descriptions, code_language)
-    
-    # Step 7: Generate module level stacks asynchronously
-    await send_progress_update(70)
-    responses=await(modular_stack_generator_main(module_prompt_dict, code_language, local_dir, stack_dirname, stack_logfiles_dir,stack_generation_prompt_dict, api_key, model_name))
-    print("responses from async" , responses)
-    
-    # Step 8: Generate Staging Prompt
-    await send_progress_update(80)
-    staging_prompt_dict=generate_staging_prompt(responses, staging_prompt_template, modules_list, code_language)
-    print(type(staging_prompt_dict))
-    print("STAGING PROMPT DICT" , staging_prompt_dict)
-    
-    # Step 9: Generate Staging File
-    await send_progress_update(90)
-    codefilepath= await (generate_staging_file (staging_prompt_dict, code_language,  local_dir, stack_logfiles_dir,stack_dirname, api_key, model_name))
-    
-    # Step 10: Collect resource spec (started in parallel at Step 4)
-    resource_spec = await resource_spec_future
-    write_resource_spec_to_file(resource_spec, local_dir, stack_dirname)
-    
-    # Step 11: zip the directory
-    await send_progress_update(100)
-    zipfilepath = zip_directory(stack_dirname)
+    With a previous_execution_id (an edited diagram resubmitted) only the modules whose
+    resources changed since that execution are generated (see run_manifest.IncrementalPlan); the
+    other module stacks, and the LLM-generated staging file if the module set is unchanged, are
+    taken from its artifact.
+    """
+    from utils2_v2 import send_progress_update
     
-    return zipfilepath
+    stack_dirname , stack_logfiles_dir =get_stack_name()
+    log.info("Generating stack", stack_dirname=stack_dirname, code_language=code_language)
+    if artifact_writer:
+        await run_blocking(artifact_writer.open, stack_dirname + '.zip')
+
+    # The previous execution's manifest is read while the diagram is described
+    prompts_sha256 = hash_prompt_configs(prompt_config_dict, stack_generation_prompt_dict)
+    # Work started alongside the pipeline; cancelled if the run fails
+    background_futures = []
+    previous_manifest_future = None
+    if previous_execution_id and artifact_writer:
+        previous_manifest_future = asyncio.ensure_future(run_blocking(
+            load_run_manifest, artifact_writer.bucket_name, previous_execution_id, code_language, model_name, prompts_sha256))
+        background_futures.append(previous_manifest_future)
+    elif previous_execution_id:
+        log.warning("Incremental regeneration needs an artifact writer, regenerating everything", previous_execution_id=previous_execution_id)
+
+
+    try:
+        arch_prompt=prompt_config_dict['architecture_description_prompt']      # Prompt to generate architecture description
+        modules_description_prompt=prompt_config_dict['modules_description_prompt']       # Prompt to generate modules description
+        staging_prompt_template=prompt_config_dict['staging_prompt_template']        # prompt Template to generate a staging file
+        deployment_sequence_prompt=prompt_config_dict['deployment_sequence_prompt']
+        resource_spec_prompt=prompt_config_dict['resource_spec_prompt']  
+
+        # Every step is timed as a 'step_<nn>_<name>' trace span (see tracing.py)
+        # Step 1: Read Architecture drawing from s3 into memory (skipped when the caller already read it)
+        await send_progress_update(10)
+        with trace_span('step_01_read_image'):
+            if image_bytes is None:
+                image_bytes = await run_blocking(read_s3_object, s3_uri)
+    
+        # Step 2: Prepare image (downscaled to the model's effective resolution)
+        await send_progress_update(20)
+        with trace_span('step_02_prepare_image'):
+            image_data= await run_blocking(prepare_image, image_bytes)
+            del image_bytes
+    
+        # Step 3: Get Architecture Description
+        await send_progress_update(30)
+        with trace_span('step_03_architecture_description'):
+            # Progress moves through 30-39% as the description streams in
+            arch_description_dict=await generate_architecture_description(arch_prompt, image_data['data'], media_type=image_data['media_type'],
+                                                                          on_chunk=streamed_progress(30, 40, STAGE_TOKEN_BUDGETS['architecture_description']['base']))
+    
+        # Step 4: Render JSON with Modular descriptions + Generate resource spec in parallel
+        # (blocking Bedrock calls run on the AWS I/O pool so the event loop stays responsive)
+        await send_progress_update(40)
+        resource_spec_future = asyncio.ensure_future(traced('resource_spec', generate_resource_spec(arch_description_dict, resource_spec_prompt)))
+        background_futures.append(resource_spec_future)
+        if use_fused_module_stage(prompt_config_dict):
+            # Steps 4 and 5 fused into a single call (FUSED_MODULE_STAGE=true)
+            with trace_span('step_04_modules_with_deployment_sequence'):
+                module_descriptions=await generate_modules_with_deployment_sequence(arch_description_dict, prompt_config_dict['modules_with_deployment_sequence_prompt'])
+            await send_progress_update(50)
+        else:
+            with trace_span('step_04_module_descriptions'):
+                module_descriptions=await generate_module_descriptions(arch_description_dict , modules_description_prompt)
+
+            # Step 5: Render JSON with Deployment Sequence
+            await send_progress_update(50)
+            with trace_span('step_05_deployment_sequence'):
+                module_descriptions=await generate_deployment_sequence(module_descriptions, deployment_sequence_prompt)
+    
+        # Step 6: Generate Module prompts
+        await send_progress_update(60)
+        with trace_span('step_06_module_prompts'):
+            module_prompt_dict,modules_list = generate_module_prompts(module_descriptions, code_language)
+    
+        module_resources = extract_module_resources(module_descriptions, module_prompt_dict)
+    
+        # Modules whose resources are unchanged since the previous execution are taken from its artifact
+        previous_manifest = await previous_manifest_future if previous_manifest_future else None
+        module_filepaths_by_name = {}
+        incremental_plan = None
+        previous_files = {}
+        reused_staging = None
+        if previous_manifest:
+            with trace_span('step_06_reuse_previous_execution'):
+                incremental_plan = IncrementalPlan(previous_manifest, module_prompt_dict, modules_list, module_resources)
+                previous_files = await run_blocking(read_artifact_files, artifact_writer.bucket_name, previous_manifest['artifact_key'], incremental_plan.reusable_files)
+                # A module file missing from the previous artifact is generated again
+                for module_name in [module_name for module_name, file_name in incremental_plan.reused_modules.items() if file_name not in previous_files]:
+                    incremental_plan.invalidate_module(module_name)
+                if not incremental_plan.module_set_changed:
+                    reused_staging = previous_files.get(previous_manifest.get('staging_file'))
+    
+        # Step 7: Generate module level stacks asynchronously (progress moves through 70-79% as module steps complete)
+        await send_progress_update(70)
+    
+        # The staging file is rendered locally from a template unless STAGING_GENERATOR=llm.
+        # The LLM path only needs the module file names, which are known from the module names,
+        # so it runs alongside the module stacks instead of after them
+        staging_file_future = None
+        if use_llm_staging_generator() and reused_staging is not None:
+            # Same module set as the previous execution: its staging file still applies
+            staging_file_future = asyncio.ensure_future(run_blocking(write_reused_file, reused_staging, local_dir, stack_dirname, previous_manifest['staging_file']))
+            background_futures.append(staging_file_future)
+        elif use_llm_staging_generator():
+            # Step 8: Staging Prompt (LLM path only, generated with Step 7)
+            with trace_span('step_08_staging_prompt'):
+                module_filepaths = [os.path.join(local_dir, stack_dirname, get_module_filename(module_name, code_language)) for module_name in module_prompt_dict]
+                staging_prompt_dict=generate_staging_prompt(module_filepaths, staging_prompt_template, modules_list, code_language)
+            staging_file_future = asyncio.ensure_future(traced('staging_file', generate_staging_file (staging_prompt_dict, code_language,  local_dir, stack_logfiles_dir,stack_dirname, api_key, model_name)))
+            background_futures.append(staging_file_future)
+    
+        # Module generation may run in two batches (see below); progress covers the steps of both
+        module_steps = {}
+        def module_progress(batch):
+            def progress_callback(completed, total):
+                module_steps[batch] = (completed, total)
+                publish_progress(70 + (9 * sum(done for done, _ in module_steps.values())) // sum(steps for _, steps in module_steps.values()))
+            return progress_callback
+    
+        def generate_modules(module_names, batch):
+            modules_to_generate = {module_name: module_prompt_dict[module_name] for module_name in module_names}
+            future = asyncio.ensure_future(modular_stack_generator_main(modules_to_generate, code_language, local_dir, stack_dirname, stack_logfiles_dir,stack_generation_prompt_dict, api_key, model_name, artifact_writer=artifact_writer,
+                                                                        progress_callback=module_progress(batch)))
+            background_futures.append(future)
+            return future
+    
+        module_batches = []
+        with trace_span('step_07_module_stacks'):
+            # Changed modules are generated right away; the resource spec is still being generated
+            modules_to_generate = incremental_plan.changed_modules if incremental_plan else list(module_prompt_dict)
+            module_batches.append((list(modules_to_generate), generate_modules(modules_to_generate, 'changed')))
+            if incremental_plan:
+                # A reused module with a resource whose spec changed is generated as well
+                resource_spec_changes = diff_resource_specs(previous_manifest.get('resource_spec'), await resource_spec_future)
+                log.info("Resource spec changes since previous execution", previous_execution_id=previous_execution_id, **resource_spec_changes)
+                invalidated = incremental_plan.invalidate_resources([name for names in resource_spec_changes.values() for name in names])
+                if invalidated:
+                    module_batches.append((invalidated, generate_modules(invalidated, 'invalidated')))
+                for module_name, file_name in incremental_plan.reused_modules.items():
+                    module_filepaths_by_name[module_name] = await run_blocking(write_reused_file, previous_files[file_name], local_dir, stack_dirname, file_name)
+                    await run_blocking(artifact_writer.add_file, module_filepaths_by_name[module_name])
+                log.info("Incremental regeneration", previous_execution_id=previous_execution_id, reused=sorted(incremental_plan.reused_modules),
+                         regenerated=incremental_plan.changed_modules, removed=incremental_plan.removed_modules, module_set_changed=incremental_plan.module_set_changed)
+            for module_names, batch in module_batches:
+                module_filepaths_by_name.update(zip(module_names, await batch))
+        responses = [module_filepaths_by_name[module_name] for module_name in module_prompt_dict]
+        log.info("Module stacks generated", files=responses)
+    
+        # Step 9: Generate Staging File (template) or collect it (LLM path, started with Step 7)
+        with trace_span('step_09_staging_file'):
+            if staging_file_future:
+                codefilepath= await staging_file_future
+            else:
+                codefilepath= await run_blocking(write_staging_app_file, list(module_prompt_dict), responses, modules_list, code_language, local_dir, stack_dirname)
+                if codefilepath is None:
+                    # A stack needs constructor inputs the template cannot wire: fall back to the LLM path
+                    staging_prompt_dict=generate_staging_prompt(responses, staging_prompt_template, modules_list, code_language)
+                    with trace_span('staging_file'):
+                        codefilepath= await generate_staging_file (staging_prompt_dict, code_language,  local_dir, stack_logfiles_dir,stack_dirname, api_key, model_name)
+        
+            if artifact_writer:
+                await run_blocking(artifact_writer.add_file, codefilepath)
+        await send_progress_update(80)
+    
+        # Step 10: Collect resource spec (started in parallel at Step 4)
+        await send_progress_update(90)
+        with trace_span('step_10_resource_spec'):
+            resource_spec = await resource_spec_future
+            resource_spec_filepath = write_resource_spec_to_file(resource_spec, local_dir, stack_dirname)
+            if artifact_writer:
+                await run_blocking(artifact_writer.add_file, resource_spec_filepath)
+    
+        # Step 11: zip the directory, or finish the archive that was built along the way
+        await send_progress_update(100)
+        with trace_span('step_11_package_artifact'):
+            if artifact_writer:
+                final_s3_path, s3_key = await run_blocking(artifact_writer.close)
+                # Lets a later edit of this diagram regenerate only what changed
+                execution_id = current_execution_id()
+                if execution_id:
+                    manifest = build_run_manifest(
+                        execution_id, code_language, model_name, prompts_sha256, s3_key, module_prompt_dict,
+                        {module_name: os.path.basename(filepath) for module_name, filepath in module_filepaths_by_name.items()},
+                        modules_list, os.path.basename(codefilepath), resource_spec, module_resources)
+                    await run_blocking(store_run_manifest, artifact_writer.bucket_name, manifest)
+                return final_s3_path
+            zipfilepath = await run_blocking(zip_directory, stack_dirname)
+    
+        return zipfilepath
+    except BaseException:
+        cancel_background_futures(background_futures)
+        raise
@@ -0,0 +1,178 @@
+import os
+import time
+import zipfile
+import threading
+from aws_clients import get_client
+from utils2_v2 import build_output_key
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_COMPRESSION_LEVEL = 6
+MIN_PART_SIZE = 5 * 1024 * 1024          # S3 minimum for every part but the last
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+def get_compression_level():
+    """
+    zlib level for the artifact zip (ARTIFACT_COMPRESSION_LEVEL, 0-9). 0 stores files uncompressed.
+    """
+    return min(9, max(0, int(os.environ.get('ARTIFACT_COMPRESSION_LEVEL', DEFAULT_COMPRESSION_LEVEL))))
+
+
+class S3MultipartStream:
+    """
+    Write-only, non-seekable file object that uploads to S3 as it is written.
+
+    Data is buffered until a full part is available and then sent with upload_part. Objects that
+    never fill a part are sent with a single put_object on close, so small artifacts cost one request.
+    """
+
+    def __init__(self, s3_client, bucket_name, s3_key, part_size=DEFAULT_PART_SIZE, content_type='application/zip'):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.s3_key = s3_key
+        self.part_size = max(MIN_PART_SIZE, part_size)
+        self.content_type = content_type
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=self.s3_key, ContentType=self.content_type)
+            self.upload_id = response['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name, Key=self.s3_key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(data),
+        )
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.upload_id is None:
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=self.s3_key, Body=bytes(self.buffer), ContentType=self.content_type)
+        else:
+            if self.buffer:
+                self._upload_part(self.buffer)
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=self.s3_key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts},
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.buffer = bytearray()
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.s3_key, UploadId=self.upload_id)
+
+
+class ArtifactWriter:
+    """
+    Builds the generated-code zip while the pipeline runs and streams it to the results bucket.
+
+    Methods are blocking and thread-safe; call them through run_blocking from async code.
+
+    Args:
+        bucket_name (str): Results bucket.
+        compression_level (int, optional): zlib level, defaults to ARTIFACT_COMPRESSION_LEVEL.
+        part_size (int, optional): Multipart part size in bytes (minimum 5 MiB).
+    """
+
+    def __init__(self, bucket_name, compression_level=None, part_size=DEFAULT_PART_SIZE, s3_client=None):
+        self.bucket_name = bucket_name
+        self.compression_level = get_compression_level() if compression_level is None else compression_level
+        self.part_size = part_size
+        self.s3_client = s3_client
+        self.artifact_name = None
+        self.s3_key = None
+        self._stream = None
+        self._zip = None
+        self._names = set()
+        self._lock = threading.Lock()
+
+    @property
+    def final_s3_path(self):
+        return f's3://{self.bucket_name}/{self.s3_key}'
+
+    def open(self, artifact_name, s3_key=None):
+        """
+        Start the archive; the object is uploaded to output/<timestamp>/<artifact_name> by default.
+        """
+        with self._lock:
+            self.artifact_name = artifact_name
+            self.s3_key = s3_key or build_output_key(artifact_name)
+            self._stream = S3MultipartStream(self.s3_client or get_client('s3'), self.bucket_name, self.s3_key, self.part_size)
+            if self.compression_level == 0:
+                self._zip = zipfile.ZipFile(self._stream, 'w', zipfile.ZIP_STORED)
+            else:
+                self._zip = zipfile.ZipFile(self._stream, 'w', zipfile.ZIP_DEFLATED, compresslevel=self.compression_level)
+
+    def add_bytes(self, arcname, data):
+        """
+        Add a file to the archive. A name that was already added is skipped.
+        """
+        with self._lock:
+            if arcname in self._names:
+                log.warning("Artifact already contains %s, skipping", arcname)
+                return
+            self._names.add(arcname)
+            zip_info = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+            zip_info.external_attr = 0o644 << 16
+            self._zip.writestr(zip_info, data, compress_type=self._zip.compression, compresslevel=self._zip.compresslevel)
+        log.debug("Added %s to %s", arcname, self.artifact_name)
+
+    def add_file(self, file_path, arcname=None):
+        """
+        Add a local file to the archive under arcname (its base name by default).
+        """
+        with open(file_path, 'rb') as f:
+            self.add_bytes(arcname or os.path.basename(file_path), f.read())
+
+    def close(self):
+        """
+        Write the central directory and complete the upload.
+
+        :return: tuple (final_s3_path, s3_key), same shape as copy_file_to_s3
+        """
+        with self._lock:
+            self._zip.close()
+            self._stream.close()
+        log.info("Artifact uploaded", path=self.final_s3_path, bytes=self._stream.position, files=len(self._names))
+        return self.final_s3_path, self.s3_key
+
+    def abort(self):
+        """
+        Discard the archive and abort any multipart upload in progress.
+        """
+        with self._lock:
+            if self._stream is not None:
+                self._stream.abort()
@@ -0,0 +1,76 @@
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+# Sized for the module fan-out: every concurrent module may hold a Bedrock stream,
+# a stage cache read and a progress write at the same time.
+DEFAULT_AWS_IO_MAX_WORKERS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_aws_io_executor():
+    """
+    Return the dedicated thread pool for blocking boto3 calls, creating it on first use.
+
+    The pool is separate from the event loop's default executor so that slow AWS calls
+    cannot starve other run_in_executor users. Its size is read from AWS_IO_MAX_WORKERS.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = int(os.environ.get('AWS_IO_MAX_WORKERS', DEFAULT_AWS_IO_MAX_WORKERS))
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='aws-io')
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking (boto3, file system) call on the AWS I/O pool without blocking the event loop.
+
+    Example:
+        >>> response_body = await run_blocking(invoke_bedrock_model, request_body)
+    """
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the caller's context so the call sees its execution (see execution_context)
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_aws_io_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+_event_loop = None
+
+
+def get_persistent_event_loop():
+    """
+    Return the module-level event loop used by lambda_handler, creating it on first use.
+
+    Reusing one loop across warm invocations keeps loop-bound state alive between them,
+    such as the shared aiohttp session (http_session) and its open connections.
+    """
+    global _event_loop
+    if _event_loop is None or _event_loop.is_closed():
+        _event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_event_loop)
+    return _event_loop
+
+
+def cancel_pending_tasks(loop):
+    """
+    Cancel and reap tasks an invocation left behind (e.g. sibling module tasks after a failure)
+    so they do not resume during the next invocation on the same loop.
+    """
+    pending = [task for task in asyncio.all_tasks(loop) if not task.done()]
+    if not pending:
+        return
+    log.warning("Cancelling %d task(s) left by the previous invocation", len(pending))
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
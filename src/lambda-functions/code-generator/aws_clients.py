@@ -0,0 +1,89 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+# Enough pooled connections for every AWS I/O worker (see aws_async) to hold one per service
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+
+# Per-service overrides on top of the shared connection settings
+SERVICE_CONFIG = {
+    # Non-streaming generations with a large max_tokens can take longer than the 60s default
+    'bedrock-runtime': {'read_timeout': 300},
+}
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+_thread_resources = threading.local()
+# Bumped by reset_clients so that every thread drops its resources, not only the caller's
+_generation = 0
+
+
+def _client_config(service_name):
+    return Config(
+        max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', DEFAULT_MAX_POOL_CONNECTIONS)),
+        tcp_keepalive=True,
+        **SERVICE_CONFIG.get(service_name, {}),
+    )
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service_name, region_name=None):
+    """
+    Return the process-wide boto3 client for a service, creating it on first use.
+
+    :param service_name: str, e.g. 's3' or 'bedrock-runtime'
+    :param region_name: str, optional region, defaults to the Lambda region
+    :return: boto3 client
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        # Creating clients from one session is not thread-safe
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _get_session().client(service_name, region_name=region_name, config=_client_config(service_name))
+                _clients[key] = client
+    return client
+
+
+def get_resource(service_name, region_name=None):
+    """
+    Return a boto3 resource for the calling thread, creating it on first use.
+
+    Resources are not thread-safe, so one is kept per thread of the AWS I/O pool.
+
+    :param service_name: str, e.g. 'dynamodb'
+    :param region_name: str, optional region, defaults to the Lambda region
+    :return: boto3 resource
+    """
+    resources = getattr(_thread_resources, 'resources', None)
+    if resources is None or _thread_resources.generation != _generation:
+        resources = _thread_resources.resources = {}
+        _thread_resources.generation = _generation
+    key = (service_name, region_name)
+    resource = resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _get_session().resource(service_name, region_name=region_name, config=_client_config(service_name))
+        resources[key] = resource
+    return resource
+
+
+def reset_clients():
+    """
+    Drop every cached client and resource, e.g. after credentials or endpoints changed.
+    """
+    global _session, _generation
+    with _lock:
+        _session = None
+        _clients.clear()
+        _generation += 1
@@ -0,0 +1,115 @@
+"""
+Per-call overhead of creating a boto3 client/resource for every call versus the aws_clients registry.
+
+Calls go to a local HTTP stand-in for S3 and DynamoDB (via AWS_ENDPOINT_URL), so the numbers
+cover client construction, request signing and connection setup but no network latency. Against
+the real endpoints every new client additionally pays a TLS handshake, which the registry's
+keep-alive pool avoids after the first call.
+
+Usage:
+    python benchmarks/bench_aws_clients.py [--calls 200]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, FUNCTION_DIR)
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import boto3
+import aws_clients
+
+connections = 0
+connections_lock = threading.Lock()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one segment, otherwise delayed ACKs stall keep-alive connections
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def setup(self):
+        global connections
+        with connections_lock:
+            connections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        # S3 HeadObject
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.send_header('Last-Modified', 'Thu, 01 Jan 2026 00:00:00 GMT')
+        self.end_headers()
+
+    def do_POST(self):
+        # DynamoDB UpdateItem
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def head_object(s3_client):
+    s3_client.head_object(Bucket='bench-bucket', Key='diagram.png')
+
+
+def update_item(dynamodb):
+    dynamodb.Table('bench-table').update_item(
+        Key={'executionId': 'bench'},
+        UpdateExpression='SET progress = :p',
+        ExpressionAttributeValues={':p': 50},
+    )
+
+
+SCENARIOS = (
+    ('s3 head_object', lambda: boto3.client('s3'), lambda: aws_clients.get_client('s3'), head_object),
+    ('dynamodb update_item', lambda: boto3.resource('dynamodb'), lambda: aws_clients.get_resource('dynamodb'), update_item),
+)
+
+
+def run(factory, call, calls):
+    global connections
+    connections = 0
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call(factory())
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), statistics.quantiles(timings, n=20)[-1], connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['AWS_ENDPOINT_URL'] = f'http://127.0.0.1:{server.server_address[1]}'
+    aws_clients.reset_clients()
+
+    print(f"{'call':<22} {'client':<13} {'p50 ms':>8} {'p95 ms':>8} {'connections':>12}")
+    for name, per_call_factory, registry_factory, call in SCENARIOS:
+        for label, factory in (('new per call', per_call_factory), ('registry', registry_factory)):
+            p50, p95, opened = run(factory, call, args.calls)
+            print(f"{name:<22} {label:<13} {p50:>8.2f} {p95:>8.2f} {opened:>12}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare the two-call module stage (generate_module_descriptions + generate_deployment_sequence)
+with the fused single call (generate_modules_with_deployment_sequence).
+
+For every diagram under 'architecture diagram samples', the architecture description is generated
+once and then both paths are run --repeats times against Amazon Bedrock. Reports wall time and
+output tokens per path. Needs AWS credentials with Bedrock access in the current region.
+
+Usage:
+    python benchmarks/bench_fused_module_stage.py [--repeats 3] [--samples-dir <dir>]
+"""
+import os
+import sys
+import glob
+import time
+import base64
+import asyncio
+import argparse
+import statistics
+
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+REPO_ROOT = os.path.abspath(os.path.join(FUNCTION_DIR, '..', '..', '..'))
+sys.path.insert(0, FUNCTION_DIR)
+
+# Every call must reach the model, otherwise the second path would be served from the stage cache
+os.environ['STAGE_CACHE_BACKEND'] = 'none'
+os.environ['MODEL_STREAMING'] = 'false'
+
+import a2cai_v2
+from utils2_v2 import load_yaml_data
+
+output_tokens = []
+
+
+def record_usage(call):
+    def wrapper(request_body, modelId=a2cai_v2.BEDROCK_MODEL_ID):
+        response_body = call(request_body, modelId)
+        output_tokens.append(response_body.get('usage', {}).get('output_tokens', 0))
+        return response_body
+    return wrapper
+
+
+a2cai_v2.call_bedrock_model = record_usage(a2cai_v2.call_bedrock_model)
+
+
+async def two_call_path(arch_description_dict, prompts):
+    module_descriptions = await a2cai_v2.generate_module_descriptions(arch_description_dict, prompts['modules_description_prompt'])
+    return await a2cai_v2.generate_deployment_sequence(module_descriptions, prompts['deployment_sequence_prompt'])
+
+
+async def fused_path(arch_description_dict, prompts):
+    return await a2cai_v2.generate_modules_with_deployment_sequence(arch_description_dict, prompts['modules_with_deployment_sequence_prompt'])
+
+
+async def measure(path, arch_description_dict, prompts, code_language):
+    output_tokens.clear()
+    started = time.perf_counter()
+    deployment_sequence_dict = await path(arch_description_dict, prompts)
+    elapsed = time.perf_counter() - started
+    # Both paths must produce something generate_module_prompts can consume
+    module_prompt_dict, _ = a2cai_v2.generate_module_prompts(deployment_sequence_dict, code_language)
+    return elapsed, sum(output_tokens), len(module_prompt_dict)
+
+
+async def main(args):
+    prompts = load_yaml_data(os.path.join(FUNCTION_DIR, 'a2cai_prompts.yaml'))
+    samples = sorted(glob.glob(os.path.join(args.samples_dir, '**', '*.png'), recursive=True))
+    rows = []
+    for sample in samples:
+        with open(sample, 'rb') as f:
+            encoded_image = base64.b64encode(f.read()).decode('utf-8')
+        arch_description_dict = await a2cai_v2.generate_architecture_description(prompts['architecture_description_prompt'], encoded_image)
+        for name, path in (('two-call', two_call_path), ('fused', fused_path)):
+            runs = [await measure(path, arch_description_dict, prompts, 'python') for _ in range(args.repeats)]
+            rows.append((
+                os.path.relpath(sample, args.samples_dir),
+                name,
+                statistics.median(run[0] for run in runs),
+                statistics.median(run[1] for run in runs),
+                runs[-1][2],
+            ))
+
+    print(f"\n{'sample':<90} {'path':<9} {'wall s':>8} {'out tok':>8} {'modules':>8}")
+    for sample, name, wall, tokens, modules in rows:
+        print(f"{sample:<90} {name:<9} {wall:>8.1f} {tokens:>8.0f} {modules:>8}")
+    for name in ('two-call', 'fused'):
+        path_rows = [row for row in rows if row[1] == name]
+        print(f"TOTAL {name:<9} wall {sum(row[2] for row in path_rows):.1f}s  output tokens {sum(row[3] for row in path_rows):.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--samples-dir', default=os.path.join(REPO_ROOT, 'architecture diagram samples'))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,188 @@
+"""
+Measure peak memory of the diagram ingest path, from S3 to the serialized Bedrock request body.
+
+  legacy     download_file to /tmp, read the file, base64 + decode, hash the messages for the
+             stage cache key, json.dumps and encode the body (the pre-image_ingest path)
+  streaming  get_object into a preallocated buffer, InlineImage keyed by digest and base64-encoded
+             straight into the payload by serialize_request_body
+  normalize  streaming plus image_preprocessing.prepare_image (Pillow decode and re-encode)
+
+Each path runs in a fresh interpreter against a local stand-in for S3, so no AWS access is needed.
+Reports the growth of peak RSS over the interpreter baseline and the tracemalloc peak (Python
+allocations only, Pillow's pixel buffers are not included).
+
+Usage:
+    python benchmarks/bench_image_ingest.py [--image <file>] [--megapixels 12]
+"""
+import os
+import sys
+import json
+import base64
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, FUNCTION_DIR)
+
+# Imported up front so module import allocations stay out of the measurements
+os.environ['STAGE_CACHE_BACKEND'] = 'none'
+from stage_cache import make_stage_cache_key
+from image_ingest import InlineImage, read_s3_object, serialize_request_body
+from image_preprocessing import prepare_image
+
+PATHS = ('legacy', 'streaming', 'normalize')
+IMAGE_URI = 's3://bench-bucket/diagram.png'
+
+
+class LocalS3Client:
+    """
+    Serves every key from one local file.
+    """
+
+    def __init__(self, image_file):
+        self.image_file = image_file
+
+    def download_file(self, bucket_name, key_name, local_file_path):
+        shutil.copyfile(self.image_file, local_file_path)
+
+    def get_object(self, Bucket, Key):
+        return {'Body': open(self.image_file, 'rb'), 'ContentLength': os.path.getsize(self.image_file)}
+
+
+def request_body_for(image_data, media_type='image/png'):
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 2048,
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Describe this architecture."},
+                {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_data}},
+            ],
+        }],
+    }
+
+
+def run_legacy(s3_client, work_dir):
+    local_file_path = os.path.join(work_dir, 'diagram.png')
+    s3_client.download_file('bench-bucket', 'diagram.png', local_file_path)
+    with open(local_file_path, 'rb') as imagefile:
+        encoded_image = base64.b64encode(imagefile.read()).decode('utf-8')
+    request_body = request_body_for(encoded_image)
+    make_stage_cache_key('bedrock', 'model', request_body['messages'], request_body['max_tokens'], None)
+    # botocore encodes a str body to UTF-8 before sending it
+    return len(json.dumps(request_body).encode('utf-8'))
+
+
+def run_streaming(s3_client, work_dir, normalize=False):
+    image_bytes = read_s3_object(IMAGE_URI, s3_client=s3_client)
+    media_type = 'image/png'
+    if normalize:
+        image_data = prepare_image(image_bytes)
+        del image_bytes
+        image_bytes, media_type = image_data['data'], image_data['media_type']
+    request_body = request_body_for(InlineImage(image_bytes), media_type)
+    make_stage_cache_key('bedrock', 'model', request_body['messages'], request_body['max_tokens'], None)
+    return len(serialize_request_body(request_body))
+
+
+def current_rss_kb():
+    # ru_maxrss only reports the high-water mark, which module imports may already have set
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(path, image_file):
+    s3_client = LocalS3Client(image_file)
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Reset the high-water mark to the current RSS so only this path's allocations count
+        try:
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            pass
+        baseline_rss_kb = current_rss_kb()
+        tracemalloc.start()
+        if path == 'legacy':
+            payload_bytes = run_legacy(s3_client, work_dir)
+        else:
+            payload_bytes = run_streaming(s3_client, work_dir, normalize=(path == 'normalize'))
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        path_peak_rss_kb = peak_rss_kb()
+    print(json.dumps({
+        'payload_bytes': payload_bytes,
+        'rss_growth_bytes': max(0, path_peak_rss_kb - baseline_rss_kb) * 1024,
+        'traced_peak_bytes': traced_peak,
+    }))
+
+
+def make_sample_image(image_file, megapixels):
+    """
+    Write a diagram-like PNG: flat background, boxes and noisy 'icons' that defeat compression.
+    """
+    from PIL import Image, ImageDraw
+
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for x in range(40, width - 200, 260):
+        for y in range(40, height - 160, 220):
+            draw.rectangle((x, y, x + 200, y + 140), outline=(35, 47, 62), width=3)
+            image.paste(Image.frombytes('RGB', (96, 96), os.urandom(96 * 96 * 3)), (x + 52, y + 22))
+    image.save(image_file, format='PNG')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', help='diagram to ingest; a synthetic PNG is generated if omitted')
+    parser.add_argument('--megapixels', type=float, default=12.0, help='size of the synthetic PNG')
+    parser.add_argument('--measure', choices=PATHS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.image)
+        return
+
+    with tempfile.TemporaryDirectory() as sample_dir:
+        image_file = args.image
+        if not image_file:
+            image_file = os.path.join(sample_dir, 'diagram.png')
+            make_sample_image(image_file, args.megapixels)
+        image_size = os.path.getsize(image_file)
+        print(f"image: {image_file} ({image_size / 2**20:.1f} MiB)\n")
+        print(f"{'path':<10} {'payload MiB':>12} {'peak RSS growth MiB':>20} {'traced peak MiB':>16} {'copies':>7}")
+        for path in PATHS:
+            output = subprocess.run(
+                [sys.executable, __file__, '--measure', path, '--image', image_file],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{path:<10} {result['payload_bytes'] / 2**20:>12.1f} {result['rss_growth_bytes'] / 2**20:>20.1f} "
+                  f"{result['traced_peak_bytes'] / 2**20:>16.1f} {result['traced_peak_bytes'] / image_size:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
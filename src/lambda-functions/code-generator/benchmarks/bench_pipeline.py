@@ -0,0 +1,315 @@
+"""
+End-to-end benchmark of a2c_ai_do_it_all against local stand-ins (see standins.py) for Bedrock,
+the chat-completions endpoint, S3 and DynamoDB. No AWS account or API key is needed.
+
+Every PNG under 'architecture diagram samples/Level1-3' is uploaded to the stand-in S3 bucket and
+run through the whole pipeline --repeats times (after --warmup unmeasured runs), with the zip
+streamed back to the stand-in results bucket as in the Lambda. The stand-in plans
+--modules-per-level modules per diagram level, so Level3 diagrams fan out the widest.
+
+Per sample the report shows p50/p95 wall time, peak resident memory above the pre-run baseline
+(the stand-ins share the process, so their in-memory objects count too), the peak number of
+concurrent requests per service, and the critical path from the tracing spans: the p50 time each
+pipeline step spends on it, plus mean queue wait, retries and model calls per run.
+
+Model latency is simulated: time to first token is lognormal (--*-ttft, --*-sigma), output
+streams at --*-tps tokens/s, and --throttle-rate / --error-rate of the requests fail with 429 or
+503. --time-scale multiplies every simulated delay (and Retry-After), so the defaults model
+realistic latencies while a run takes a tenth of the time. The model schedulers' backoff and
+rate limits (e.g. COMPLETIONS_REQUESTS_PER_MINUTE) are taken from the environment as in the Lambda
+and are not scaled, so with a small time scale wide diagrams queue on the requests-per-minute limit.
+
+The report also shows the output tokens reserved per run (the max_tokens of every model request,
+see token_budget.py) against those actually produced, and how many truncated responses were
+continued. --module-step-tokens sets the size of the simulated module code, e.g. large enough to
+exceed a stage's budget and exercise continuations.
+
+Prompt-cache reads and writes (see standins.PromptCache) are reported per run. The stand-in
+models only cache prefixes of at least --cache-min-tokens tokens (1024, as Claude Sonnet on
+Bedrock); cached prompt tokens skip the simulated prompt processing (--*-prefill-tps). Set
+PROMPT_CACHING=false to compare against requests without cache checkpoints.
+
+With --record the model responses are also written to a cassette (see model_transport.py);
+--replay answers every model call from such a cassette instead, so only the non-model work
+(parsing, file writing, zipping, S3 and progress writes) is measured. --replay-timing original
+reproduces the recorded model latencies.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--repeats 5] [--levels 1 2 3] [--time-scale 0.1]
+        [--throttle-rate 0.05] [--error-rate 0.02] [--language python] [--module-step-tokens 1200]
+        [--cache-min-tokens 1024] [--json results.json]
+        [--record cassette.jsonl.gz | --replay cassette.jsonl.gz [--replay-timing original]]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import statistics
+import contextvars
+from collections import defaultdict
+
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+REPO_ROOT = os.path.abspath(os.path.join(FUNCTION_DIR, '..', '..', '..'))
+sys.path.insert(0, FUNCTION_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+os.environ.setdefault('REGION', os.environ['AWS_DEFAULT_REGION'])
+# Every call must reach the stand-in models, otherwise repeats would be served from the stage cache
+os.environ['STAGE_CACHE_BACKEND'] = 'none'
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('SYNTHESIS_PROGRESS_TABLE', 'benchmark-progress')
+
+from standins import StandInServer, ModelProfile, load_prompts
+
+INPUT_BUCKET = 'benchmark-diagrams'
+RESULTS_BUCKET = 'benchmark-results'
+SERVICES = ('bedrock', 'completions', 's3', 'dynamodb')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def reset_peak_rss():
+    """
+    Reset the kernel's high-water mark of this process (Linux). Returns False where unsupported,
+    in which case peaks are relative to the whole process lifetime.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def current_rss_kib(field='VmRSS'):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def critical_path_breakdown(root):
+    """
+    Seconds each top-level step spends on the critical path of a finished trace.
+    """
+    from tracing import critical_path
+    breakdown = defaultdict(float)
+    for span in critical_path(root):
+        step = span
+        while step.parent is not root:
+            step = step.parent
+        breakdown[step.name] += span.duration
+    return breakdown
+
+
+class PipelineRunner:
+    """
+    Runs the pipeline on one persistent event loop, like warm Lambda invocations.
+    """
+
+    def __init__(self, server, code_language):
+        from utils2_v2 import load_yaml_data, load_model_name, load_stack_generation_prompts
+        from aws_async import get_persistent_event_loop
+        self.server = server
+        self.code_language = code_language
+        self.prompt_config_dict = load_yaml_data(os.path.join(FUNCTION_DIR, 'a2cai_prompts.yaml'))
+        self.model_name = load_model_name(os.path.join(FUNCTION_DIR, 'model_name.yaml'))
+        self.stack_generation_prompt_dict = load_stack_generation_prompts(os.path.join(FUNCTION_DIR, 'stack_gen_prompts.yaml'))
+        self.loop = get_persistent_event_loop()
+        self.work_dir = tempfile.mkdtemp(prefix='bench-pipeline-')
+        self.runs = 0
+
+    async def pipeline(self, s3_uri):
+        from a2cai_v2 import a2c_ai_do_it_all
+        from artifact_writer import ArtifactWriter
+        from progress_publisher import flush_progress
+        artifact_writer = ArtifactWriter(RESULTS_BUCKET)
+        try:
+            return await a2c_ai_do_it_all(s3_uri, self.work_dir, self.code_language, self.prompt_config_dict,
+                                          self.stack_generation_prompt_dict, 'benchmark', self.model_name,
+                                          artifact_writer=artifact_writer)
+        finally:
+            await flush_progress()
+
+    def run(self, s3_uri):
+        """
+        Run the pipeline once under a fresh trace; returns (wall seconds, root span, peak RSS KiB).
+        """
+        from tracing import start_trace
+        from aws_async import cancel_pending_tasks
+
+        self.runs += 1
+        execution_id = f"benchmark-{self.runs}"
+        os.environ['_EXECUTION_ID'] = execution_id
+        os.environ['_BYPASS_CACHE'] = 'true'
+        baseline = current_rss_kib()
+        hwm_reset = reset_peak_rss()
+
+        def scenario():
+            root = start_trace('code_generation', execution_id=execution_id)
+            started = time.perf_counter()
+            try:
+                self.loop.run_until_complete(self.pipeline(s3_uri))
+            except BaseException:
+                root.status = 'error'
+                raise
+            finally:
+                root.end = time.monotonic()
+                cancel_pending_tasks(self.loop)
+            return time.perf_counter() - started, root
+
+        wall, root = contextvars.copy_context().run(scenario)
+        peak = current_rss_kib('VmHWM') if hwm_reset else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Stack directories are named by the second; start each run from an empty work dir
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        return wall, root, max(0, peak - baseline)
+
+    def close(self):
+        from http_session import reset_http_session
+        self.loop.run_until_complete(reset_http_session())
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def benchmark_sample(runner, server, sample, level, args):
+    key = os.path.basename(sample)
+    with open(sample, 'rb') as f:
+        server.put_object(INPUT_BUCKET, key, f.read())
+    s3_uri = f"s3://{INPUT_BUCKET}/{key}"
+    server.module_count = args.modules_per_level * level
+
+    for _ in range(args.warmup):
+        runner.run(s3_uri)
+
+    walls, peaks, breakdowns, totals, errors = [], [], [], defaultdict(float), defaultdict(int)
+    peak_concurrency = defaultdict(int)
+    for _ in range(args.repeats):
+        server.reset_counters()
+        wall, root, peak_kib = runner.run(s3_uri)
+        walls.append(wall)
+        peaks.append(peak_kib)
+        breakdowns.append(critical_path_breakdown(root))
+        for counter, value in root.totals().items():
+            totals[counter] += value / args.repeats
+        for service in SERVICES:
+            peak_concurrency[service] = max(peak_concurrency[service], server.peak_in_flight[service])
+        for error, count in server.injected_errors.items():
+            errors[error] += count
+
+    steps = sorted({step for breakdown in breakdowns for step in breakdown})
+    return {
+        'sample': os.path.relpath(sample, args.samples_dir),
+        'level': level,
+        'modules': server.module_count,
+        'p50_seconds': statistics.median(walls),
+        'p95_seconds': percentile(walls, 0.95),
+        'peak_rss_mib': max(peaks) / 1024,
+        'peak_concurrency': dict(peak_concurrency),
+        'critical_path_p50_seconds': {step: statistics.median(breakdown.get(step, 0.0) for breakdown in breakdowns) for step in steps},
+        'mean_per_run': {counter: round(value, 3) for counter, value in totals.items()},
+        'injected_errors': dict(errors),
+    }
+
+
+def print_report(results, args):
+    print(f"\n{'sample':<70} {'mods':>4} {'p50 s':>7} {'p95 s':>7} {'peak MiB':>8} {'bedrock':>7} {'compl':>5} {'s3':>3} {'ddb':>3}")
+    for result in results:
+        concurrency = result['peak_concurrency']
+        print(f"{result['sample'][:70]:<70} {result['modules']:>4} {result['p50_seconds']:>7.2f} {result['p95_seconds']:>7.2f} "
+              f"{result['peak_rss_mib']:>8.1f} {concurrency['bedrock']:>7} {concurrency['completions']:>5} "
+              f"{concurrency['s3']:>3} {concurrency['dynamodb']:>3}")
+
+    print("\nCritical path, p50 seconds per step (queue wait / retries / model calls are per-run means)")
+    for result in results:
+        per_run = result['mean_per_run']
+        print(f"  {result['sample'][:70]}  queue wait {per_run['queue_wait_seconds']:.2f}s  retries {per_run['retries']:.1f}  "
+              f"model calls {per_run['model_calls']:.1f}  injected {result['injected_errors'] or '-'}")
+        print(f"    tokens reserved {per_run['reserved_tokens']:.0f}  produced {per_run['output_tokens']:.0f}  "
+              f"continuations {per_run['continuations']:.1f}  prompt cache read {per_run['cache_read_tokens']:.0f}  "
+              f"write {per_run['cache_write_tokens']:.0f}  uncached input {per_run['input_tokens']:.0f}")
+        for step, seconds in result['critical_path_p50_seconds'].items():
+            print(f"    {step:<45} {seconds:>7.2f}")
+    print(f"\n(time scale {args.time_scale:g}: multiply model-bound seconds by {1 / args.time_scale:g} for real-world latencies)")
+
+
+def main(args):
+    server = StandInServer(
+        bedrock=ModelProfile(args.bedrock_ttft, args.bedrock_sigma, args.bedrock_tps, args.throttle_rate, args.error_rate, time_scale=args.time_scale,
+                             prefill_tokens_per_second=args.bedrock_prefill_tps, cache_min_tokens=args.cache_min_tokens),
+        completions=ModelProfile(args.completions_ttft, args.completions_sigma, args.completions_tps, args.throttle_rate, args.error_rate, time_scale=args.time_scale,
+                                 prefill_tokens_per_second=args.completions_prefill_tps, cache_min_tokens=args.cache_min_tokens),
+        prompts=load_prompts(os.path.join(FUNCTION_DIR, 'a2cai_prompts.yaml')),
+        code_language=args.language,
+        output_tokens={'module_step': args.module_step_tokens},
+        seed=args.seed,
+    ).start()
+    os.environ.update(server.environment())
+    if args.record or args.replay:
+        os.environ['MODEL_TRANSPORT_MODE'] = 'record' if args.record else 'replay'
+        os.environ['MODEL_CASSETTE'] = args.record or args.replay
+        os.environ['MODEL_REPLAY_TIMING'] = args.replay_timing
+    import aws_clients
+    aws_clients.reset_clients()
+
+    runner = PipelineRunner(server, args.language)
+    results = []
+    try:
+        for level in args.levels:
+            samples = sorted(glob.glob(os.path.join(args.samples_dir, f"Level{level}", '*.png')))
+            for sample in samples:
+                results.append(benchmark_sample(runner, server, sample, level, args))
+                print(f"done {os.path.basename(sample)}: p50 {results[-1]['p50_seconds']:.2f}s", file=sys.stderr)
+    finally:
+        runner.close()
+        server.stop()
+        from model_transport import save_cassette
+        save_cassette()
+
+    print_report(results, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--samples-dir', default=os.path.join(REPO_ROOT, 'architecture diagram samples'))
+    parser.add_argument('--language', choices=('python', 'typescript'), default='python')
+    parser.add_argument('--modules-per-level', type=int, default=2)
+    parser.add_argument('--time-scale', type=float, default=0.1)
+    parser.add_argument('--bedrock-ttft', type=float, default=1.5, help='median seconds to first token')
+    parser.add_argument('--bedrock-sigma', type=float, default=0.4)
+    parser.add_argument('--bedrock-tps', type=float, default=70.0, help='output tokens per second')
+    parser.add_argument('--completions-ttft', type=float, default=0.8)
+    parser.add_argument('--completions-sigma', type=float, default=0.5)
+    parser.add_argument('--completions-tps', type=float, default=120.0)
+    parser.add_argument('--bedrock-prefill-tps', type=float, default=3000.0, help='uncached prompt tokens processed per second')
+    parser.add_argument('--completions-prefill-tps', type=float, default=4000.0)
+    parser.add_argument('--cache-min-tokens', type=int, default=1024, help='shortest prompt prefix the stand-in models cache')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of model requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of model requests answered with 503')
+    parser.add_argument('--module-step-tokens', type=int, default=StandInServer.DEFAULT_OUTPUT_TOKENS['module_step'],
+                        help='simulated output tokens of each module step')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', help='also write the results to this file')
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument('--record', metavar='CASSETTE', help='record the model responses to this cassette')
+    transport.add_argument('--replay', metavar='CASSETTE', help='answer model calls from this cassette')
+    parser.add_argument('--replay-timing', choices=('none', 'original'), default='none')
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+"""
+Import-time profile of the code generator handler module, the bulk of the Lambda Init Duration.
+
+Imports the handler in fresh interpreters with `python -X importtime`. Reports the median total
+import time, self time grouped by top-level package (third-party and stdlib), and the cumulative
+time of every first-party module in this directory.
+
+Usage:
+    python benchmarks/importtime_profile.py [--runs 7] [--top 15] [--module a2cai_code_generator_main]
+"""
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def first_party_modules():
+    return {os.path.splitext(name)[0] for name in os.listdir(FUNCTION_DIR) if name.endswith('.py')}
+
+
+def profile_once(module):
+    """
+    Import `module` in a fresh interpreter and return [(module, self_us, cumulative_us, depth)].
+    """
+    env = dict(os.environ)
+    # The handler must import without AWS access, as it does during Lambda init
+    env.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=FUNCTION_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--module', default='a2cai_code_generator_main')
+    args = parser.parse_args()
+
+    local_modules = first_party_modules()
+    totals = []
+    package_self = defaultdict(list)
+    local_cumulative = defaultdict(list)
+    for _ in range(args.runs):
+        rows = profile_once(args.module)
+        totals.append(next(cumulative for name, _, cumulative, _ in rows if name == args.module))
+        by_package = defaultdict(int)
+        for name, self_us, cumulative_us, _ in rows:
+            top_level = name.split('.')[0]
+            if top_level in local_modules:
+                local_cumulative[name].append(cumulative_us)
+            else:
+                by_package[top_level] += self_us
+        for package, self_us in by_package.items():
+            package_self[package].append(self_us)
+
+    print(f"import {args.module}: median {statistics.median(totals) / 1000:.1f} ms "
+          f"(min {min(totals) / 1000:.1f}, max {max(totals) / 1000:.1f}) over {args.runs} runs\n")
+
+    print(f"{'package (self time)':<32} {'median ms':>10}")
+    ranked = sorted(package_self.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, samples in ranked[:args.top]:
+        print(f"{package:<32} {statistics.median(samples) / 1000:>10.1f}")
+
+    # Cumulative time is charged to the first importer, so a module may look cheap only
+    # because another first-party module already paid for its dependencies
+    print(f"\n{'first-party module (cumulative)':<32} {'median ms':>10}")
+    for name, samples in sorted(local_cumulative.items(), key=lambda item: statistics.median(item[1]), reverse=True):
+        print(f"{name:<32} {statistics.median(samples) / 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,559 @@
+"""
+Local stand-ins for the services the pipeline calls, for offline benchmarks.
+
+One aiohttp server on 127.0.0.1 answers, by route:
+  - Amazon Bedrock runtime: POST /model/<id>/invoke and /model/<id>/invoke-with-response-stream
+    (the stream is sent in the AWS event-stream framing botocore parses)
+  - the chat-completions endpoint: POST /chat/completions, JSON or Server-Sent Events
+  - DynamoDB and Secrets Manager: POST / with an X-Amz-Target header
+  - Amazon S3 (path-style): GET/PUT/HEAD/DELETE objects and multipart uploads, kept in memory
+
+Point boto3 at it with AWS_ENDPOINT_URL and the completions client with COMPLETIONS_BASE_URL
+(see StandInServer.environment). Model latency is simulated per request from a ModelProfile:
+time to first token drawn from a lognormal distribution, then output at a fixed token rate,
+with a share of requests failing with 429 (with Retry-After) or 5xx. Responses longer than the
+request's max_tokens are cut off with the provider's stop reason ('max_tokens' or 'length') and
+can be continued: from an assistant prefill (Bedrock) or an assistant message followed by a
+user message (completions). The server counts requests and tracks in-flight requests per
+service, so callers can report request concurrency.
+
+Both models keep a prompt cache: Bedrock caches the prefix up to each cache_control checkpoint,
+the completions endpoint caches prompt prefixes automatically (in 128-token steps), in both cases
+only from ModelProfile.cache_min_tokens on. Cached prompt tokens are reported in the usage
+fields the real providers use (cache_read_input_tokens / cache_creation_input_tokens and
+prompt_tokens_details.cached_tokens) and skip the simulated prompt processing time.
+"""
+import os
+import re
+import json
+import math
+import zlib
+import random
+import struct
+import time
+import base64
+import hashlib
+import asyncio
+import threading
+from collections import defaultdict, deque
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+import yaml
+
+SERVICES = ('bedrock', 'completions', 's3', 'dynamodb', 'secretsmanager')
+
+# Prompt keys in a2cai_prompts.yaml that the Bedrock stand-in recognizes by prompt prefix
+BEDROCK_PROMPT_KEYS = (
+    'modules_with_deployment_sequence_prompt',
+    'modules_description_prompt',
+    'deployment_sequence_prompt',
+    'resource_spec_prompt',
+)
+
+MODULE_NAMES = (
+    'Networking', 'Data', 'Compute', 'Api', 'Storage', 'Messaging', 'Analytics', 'Monitoring',
+    'Identity', 'Frontend', 'Search', 'Workflow',
+)
+
+# Prompt tokens counted for an image block
+IMAGE_TOKENS = 1600
+
+# Automatic prefix caching of the completions stand-in matches prompts in steps of this many tokens
+PREFIX_CACHE_STEP_TOKENS = 128
+
+FILLER = ("The component is deployed in private subnets across two Availability Zones, encrypts data "
+          "at rest with a customer managed key and grants least-privilege access to its consumers. ")
+
+
+class ModelProfile:
+    """
+    Simulated behaviour of one model endpoint.
+
+    Args:
+        ttft_median (float): Median time to first token in seconds.
+        ttft_sigma (float): Sigma of the lognormal time-to-first-token distribution; 0 is constant.
+        tokens_per_second (float): Output rate once the first token was sent.
+        throttle_rate (float): Share of requests answered with 429 and Retry-After.
+        error_rate (float): Share of requests answered with a 5xx.
+        retry_after (float): Retry-After seconds sent with a 429.
+        time_scale (float): Multiplier applied to every simulated delay, e.g. 0.1 to run 10x faster.
+        prefill_tokens_per_second (float): Rate at which uncached prompt tokens are processed
+            before the first token.
+        cache_min_tokens (int): Shortest prompt prefix the prompt cache stores.
+        cache_ttl (float): Seconds a cached prefix lives after its last use (scaled by time_scale).
+    """
+
+    def __init__(self, ttft_median=1.0, ttft_sigma=0.4, tokens_per_second=80.0, throttle_rate=0.0,
+                 error_rate=0.0, retry_after=1.0, time_scale=1.0, prefill_tokens_per_second=4000.0,
+                 cache_min_tokens=1024, cache_ttl=300.0):
+        self.ttft_median = ttft_median
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_second = tokens_per_second
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.time_scale = time_scale
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_ttl = cache_ttl
+
+    def time_to_first_token(self, rng):
+        if self.ttft_sigma <= 0:
+            return self.ttft_median * self.time_scale
+        return rng.lognormvariate(math.log(self.ttft_median), self.ttft_sigma) * self.time_scale
+
+    def generation_time(self, output_tokens):
+        return output_tokens / self.tokens_per_second * self.time_scale
+
+    def prefill_time(self, uncached_prompt_tokens):
+        return uncached_prompt_tokens / self.prefill_tokens_per_second * self.time_scale
+
+    def injected_error(self, rng):
+        """
+        Return 429, 503 or None for the next request.
+        """
+        draw = rng.random()
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def pad_to_tokens(text, tokens, line_prefix=''):
+    """
+    Append filler lines (each starting with line_prefix) until text is about `tokens` tokens long.
+    """
+    lines = [text]
+    size = len(text)
+    while size < tokens * 4:
+        line = f"{line_prefix}{FILLER}"
+        lines.append(line)
+        size += len(line) + 1
+    return '\n'.join(lines)
+
+
+class PromptCache:
+    """
+    Prompt cache of one stand-in model: prefix hashes with their expiry (monotonic seconds).
+
+    Args:
+        profile (ModelProfile): Supplies the minimum cacheable length and the lifetime.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.expiry = {}
+        self.recent_prompts = deque(maxlen=64)
+
+    def _alive(self, key, now):
+        return self.expiry.get(key, 0.0) > now
+
+    def _touch(self, key, now):
+        self.expiry[key] = now + self.profile.cache_ttl * self.profile.time_scale
+
+    def checkpoints(self, prefixes):
+        """
+        Explicit caching: prefixes are (key, tokens) for the prompt up to each cache_control
+        checkpoint, in order. The longest live prefix is read; the prompt up to the last cacheable
+        checkpoint beyond it is written. Returns (read_tokens, write_tokens).
+        """
+        now = time.monotonic()
+        cacheable = [(key, tokens) for key, tokens in prefixes if tokens >= self.profile.cache_min_tokens]
+        read = max((tokens for key, tokens in cacheable if self._alive(key, now)), default=0)
+        written = max((tokens for _, tokens in cacheable), default=0)
+        for key, _ in cacheable:
+            self._touch(key, now)
+        return read, max(0, written - read)
+
+    def prefix(self, prompt):
+        """
+        Automatic caching: the tokens of the longest prefix `prompt` shares with a recent prompt,
+        rounded down to PREFIX_CACHE_STEP_TOKENS, if at least cache_min_tokens long.
+        """
+        now = time.monotonic()
+        shared = max((len(os.path.commonprefix([prompt, earlier])) for earlier, expires in self.recent_prompts if expires > now), default=0)
+        self.recent_prompts.append((prompt, now + self.profile.cache_ttl * self.profile.time_scale))
+        tokens = shared // 4 // PREFIX_CACHE_STEP_TOKENS * PREFIX_CACHE_STEP_TOKENS
+        return tokens if tokens >= self.profile.cache_min_tokens else 0
+
+
+def content_tokens(content):
+    """
+    Prompt tokens of Anthropic message content blocks.
+    """
+    return sum(IMAGE_TOKENS if block.get('type') == 'image' else estimate_tokens(block.get('text', '')) for block in content)
+
+
+def cache_checkpoints(messages):
+    """
+    (key, tokens) of the prompt up to each block carrying cache_control.
+    """
+    blocks, tokens, prefixes = [], 0, []
+    for message in messages:
+        for block in message['content']:
+            blocks.append(block)
+            tokens += content_tokens([block])
+            if 'cache_control' in block:
+                prefixes.append((hashlib.sha256(json.dumps(blocks, sort_keys=True).encode('utf-8')).hexdigest(), tokens))
+    return prefixes
+
+
+def continue_and_truncate(text, partial_text, max_tokens):
+    """
+    The part of the full response `text` still to send after partial_text (the output of earlier,
+    truncated requests), cut off at max_tokens. Returns (text, truncated).
+    """
+    if partial_text and text.startswith(partial_text):
+        text = text[len(partial_text):]
+    if max_tokens and estimate_tokens(text) > max_tokens:
+        return text[:max_tokens * 4], True
+    return text, False
+
+
+def encode_event_stream_message(payload, event_type='chunk'):
+    """
+    Frame one event in the AWS event-stream encoding used by invoke_model_with_response_stream:
+    prelude (total length, headers length, CRC32), string headers, payload, message CRC32.
+    """
+    headers = b''
+    for name, value in ((':event-type', event_type), (':content-type', 'application/json'), (':message-type', 'event')):
+        name_bytes, value_bytes = name.encode('utf-8'), value.encode('utf-8')
+        # Header value type 7: string
+        headers += struct.pack('>B', len(name_bytes)) + name_bytes + struct.pack('>BH', 7, len(value_bytes)) + value_bytes
+    total_length = 12 + len(headers) + len(payload) + 4
+    prelude = struct.pack('>II', total_length, len(headers))
+    message = prelude + struct.pack('>I', zlib.crc32(prelude)) + headers + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+class StandInServer:
+    """
+    The stand-in services, served from a background thread.
+
+    Args:
+        bedrock (ModelProfile): Profile for Bedrock calls.
+        completions (ModelProfile): Profile for chat-completions calls.
+        prompts (dict): Contents of a2cai_prompts.yaml, used to recognize the Bedrock stage of a prompt.
+        code_language (str): 'python' or 'typescript', the language of generated module stacks.
+        module_count (int): Number of modules in the generated module list.
+        output_tokens (dict, optional): Simulated response sizes per stage, see DEFAULT_OUTPUT_TOKENS.
+        seed (int, optional): Seed for latency and error draws.
+    """
+
+    DEFAULT_OUTPUT_TOKENS = {
+        'architecture_description': 900,
+        'modules_description_prompt': 500,
+        'deployment_sequence_prompt': 550,
+        'modules_with_deployment_sequence_prompt': 550,
+        'resource_spec_prompt': 1500,
+        'module_step': 1200,
+    }
+
+    def __init__(self, bedrock, completions, prompts, code_language='python', module_count=4, output_tokens=None, seed=None):
+        self.profiles = {'bedrock': bedrock, 'completions': completions}
+        self.prompt_caches = {service: PromptCache(profile) for service, profile in self.profiles.items()}
+        self.prompt_prefixes = {key: str(prompts[key])[:200] for key in BEDROCK_PROMPT_KEYS if key in prompts}
+        self.code_language = code_language
+        self.module_count = module_count
+        self.output_tokens = dict(self.DEFAULT_OUTPUT_TOKENS, **(output_tokens or {}))
+        self.rng = random.Random(seed)
+        self.objects = {}
+        self.uploads = {}
+        self.requests = defaultdict(int)
+        self.injected_errors = defaultdict(int)
+        self.in_flight = defaultdict(int)
+        self.peak_in_flight = defaultdict(int)
+        self.port = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    # -- lifecycle -----------------------------------------------------------------------------
+
+    def start(self):
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            app = web.Application(client_max_size=64 * 1024 * 1024)
+            app.router.add_route('*', '/{tail:.*}', self.dispatch)
+            self._runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, name='standins', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def environment(self):
+        """
+        Environment variables that route the pipeline's AWS and completions calls here.
+        """
+        return {
+            'AWS_ENDPOINT_URL': self.url,
+            'AWS_ACCESS_KEY_ID': 'benchmark',
+            'AWS_SECRET_ACCESS_KEY': 'benchmark',
+            'COMPLETIONS_BASE_URL': f"{self.url}/chat/completions",
+        }
+
+    def reset_counters(self):
+        self.requests.clear()
+        self.injected_errors.clear()
+        self.peak_in_flight.clear()
+        self.peak_in_flight.update(self.in_flight)
+
+    def put_object(self, bucket, key, body):
+        self.objects[(bucket, key)] = bytes(body)
+
+    # -- routing -------------------------------------------------------------------------------
+
+    async def dispatch(self, request):
+        if request.path.startswith('/model/'):
+            service = 'bedrock'
+        elif request.path == '/chat/completions':
+            service = 'completions'
+        elif request.headers.get('X-Amz-Target', '').startswith('secretsmanager'):
+            service = 'secretsmanager'
+        elif 'X-Amz-Target' in request.headers:
+            service = 'dynamodb'
+        else:
+            service = 's3'
+        handler = getattr(self, f"handle_{service}")
+        self.requests[service] += 1
+        self.in_flight[service] += 1
+        self.peak_in_flight[service] = max(self.peak_in_flight[service], self.in_flight[service])
+        try:
+            return await handler(request)
+        finally:
+            self.in_flight[service] -= 1
+
+    def error_response(self, service, status, retry_after, json_error=True):
+        self.injected_errors[f"{service}_{status}"] += 1
+        error_type = 'ThrottlingException' if status == 429 else 'ServiceUnavailableException'
+        headers = {'x-amzn-ErrorType': error_type}
+        if status == 429:
+            headers['Retry-After'] = f"{retry_after:.3f}"
+        body = {'message': f"Injected {status} from the benchmark stand-in"}
+        if not json_error:
+            body = {'error': body}
+        return web.json_response(body, status=status, headers=headers)
+
+    # -- Bedrock -------------------------------------------------------------------------------
+
+    def bedrock_response_text(self, request_body):
+        content = request_body['messages'][0]['content']
+        if any(part.get('type') == 'image' for part in content):
+            return pad_to_tokens("The diagram shows a serverless web application with the following components.",
+                                 self.output_tokens['architecture_description'])
+        text = ''.join(part.get('text', '') for part in content if part.get('type') == 'text')
+        stage = next((key for key, prefix in self.prompt_prefixes.items() if text.startswith(prefix)), None)
+        if stage == 'resource_spec_prompt':
+            resources = [{'type': 'AWS::S3::Bucket', 'name': f"bucket-{index}", 'notes': FILLER}
+                         for index in range(max(1, self.output_tokens[stage] // 60))]
+            return '```json\n' + json.dumps({'resources': resources}, indent=1) + '\n```'
+        modules = {'use case description': 'Offline benchmark architecture'}
+        for name in MODULE_NAMES[:self.module_count]:
+            modules[f"{name} Module"] = pad_to_tokens(f"{name} resources.", self.output_tokens.get(stage, 500) // (self.module_count + 1))
+        if stage in ('deployment_sequence_prompt', 'modules_with_deployment_sequence_prompt'):
+            modules['Module List'] = [f"{name} Stack" for name in MODULE_NAMES[:self.module_count]]
+        else:
+            modules['Module List'] = [f"{name} Module" for name in MODULE_NAMES[:self.module_count]]
+        return '```json\n' + json.dumps(modules, indent=2) + '\n```'
+
+    async def handle_bedrock(self, request):
+        profile = self.profiles['bedrock']
+        status = profile.injected_error(self.rng)
+        if status:
+            await asyncio.sleep(profile.time_scale * 0.05)
+            return self.error_response('bedrock', status, profile.retry_after * profile.time_scale)
+        request_body = json.loads(await request.read())
+        messages = request_body['messages']
+        prefill = ''.join(part.get('text', '') for part in messages[-1]['content']) if messages[-1]['role'] == 'assistant' else ''
+        text, truncated = continue_and_truncate(self.bedrock_response_text(request_body), prefill, request_body.get('max_tokens'))
+        stop_reason = 'max_tokens' if truncated else 'end_turn'
+        prompt_tokens = sum(content_tokens(message['content']) for message in messages)
+        cache_read, cache_write = self.prompt_caches['bedrock'].checkpoints(cache_checkpoints(messages))
+        output_tokens = estimate_tokens(text)
+        usage = {
+            'input_tokens': prompt_tokens - cache_read - cache_write,
+            'cache_read_input_tokens': cache_read,
+            'cache_creation_input_tokens': cache_write,
+        }
+        await asyncio.sleep(profile.time_to_first_token(self.rng) + profile.prefill_time(prompt_tokens - cache_read))
+
+        if not request.path.endswith('/invoke-with-response-stream'):
+            await asyncio.sleep(profile.generation_time(output_tokens))
+            return web.json_response({
+                'content': [{'type': 'text', 'text': text}],
+                'stop_reason': stop_reason,
+                'usage': dict(usage, output_tokens=output_tokens),
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/vnd.amazon.eventstream'})
+        await response.prepare(request)
+
+        async def send(event):
+            payload = json.dumps({'bytes': base64.b64encode(json.dumps(event).encode('utf-8')).decode('ascii')})
+            await response.write(encode_event_stream_message(payload.encode('utf-8')))
+
+        await send({'type': 'message_start', 'message': {'usage': dict(usage, output_tokens=1)}})
+        for chunk, delay in self.chunks(text, profile):
+            await asyncio.sleep(delay)
+            await send({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': chunk}})
+        await send({'type': 'message_delta', 'delta': {'stop_reason': stop_reason}, 'usage': {'output_tokens': output_tokens}})
+        await send({'type': 'message_stop'})
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def chunks(text, profile, chunk_tokens=20):
+        size = chunk_tokens * 4
+        for start in range(0, len(text), size):
+            chunk = text[start:start + size]
+            yield chunk, profile.generation_time(estimate_tokens(chunk))
+
+    # -- chat completions ----------------------------------------------------------------------
+
+    def completion_text(self, prompt):
+        match = re.search(r"module name '([^']+)'", prompt)
+        if match:
+            class_name = match.group(1).replace(' Module', '').replace(' ', '') + 'Stack'
+        else:
+            match = re.search(r"class (\w+)", prompt)
+            class_name = match.group(1) if match else 'AppStack'
+        if self.code_language == 'typescript':
+            code = f"import {{ Stack }} from 'aws-cdk-lib';\nexport class {class_name} extends Stack {{\n}}"
+            return '```typescript\n' + pad_to_tokens(code, self.output_tokens['module_step'], '// ') + '\n```'
+        code = f"from aws_cdk import Stack\n\nclass {class_name}(Stack):\n    pass"
+        return '```python\n' + pad_to_tokens(code, self.output_tokens['module_step'], '# ') + '\n```'
+
+    async def handle_completions(self, request):
+        profile = self.profiles['completions']
+        status = profile.injected_error(self.rng)
+        if status:
+            await asyncio.sleep(profile.time_scale * 0.05)
+            return self.error_response('completions', status, profile.retry_after * profile.time_scale, json_error=False)
+        body = await request.json()
+        prompt = next(message['content'] for message in body['messages'] if message['role'] == 'user')
+        partial_text = ''.join(message['content'] for message in body['messages'] if message['role'] == 'assistant')
+        text, truncated = continue_and_truncate(self.completion_text(prompt), partial_text, body.get('max_tokens'))
+        finish_reason = 'length' if truncated else 'stop'
+        serialized_prompt = ''.join(f"<{message['role']}>{message['content']}" for message in body['messages'])
+        cached_tokens = self.prompt_caches['completions'].prefix(serialized_prompt)
+        usage = {
+            'prompt_tokens': estimate_tokens(serialized_prompt),
+            'completion_tokens': estimate_tokens(text),
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        }
+        await asyncio.sleep(profile.time_to_first_token(self.rng) + profile.prefill_time(usage['prompt_tokens'] - cached_tokens))
+
+        if not body.get('stream'):
+            await asyncio.sleep(profile.generation_time(usage['completion_tokens']))
+            return web.json_response({'choices': [{'message': {'content': text}, 'finish_reason': finish_reason}], 'usage': usage})
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for chunk, delay in self.chunks(text, profile):
+            await asyncio.sleep(delay)
+            event = {'choices': [{'delta': {'content': chunk}, 'finish_reason': None}]}
+            await response.write(b'data: ' + json.dumps(event).encode('utf-8') + b'\n\n')
+        event = {'choices': [{'delta': {}, 'finish_reason': finish_reason}], 'usage': usage}
+        await response.write(b'data: ' + json.dumps(event).encode('utf-8') + b'\n\n')
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    # -- DynamoDB and Secrets Manager ------------------------------------------------------------
+
+    async def handle_dynamodb(self, request):
+        await request.read()
+        return web.json_response({}, content_type='application/x-amz-json-1.0')
+
+    async def handle_secretsmanager(self, request):
+        await request.read()
+        return web.json_response({'SecretString': json.dumps({'A2A_API_KEY': 'benchmark'})}, content_type='application/x-amz-json-1.1')
+
+    # -- S3 ------------------------------------------------------------------------------------
+
+    async def handle_s3(self, request):
+        bucket, _, key = request.path.lstrip('/').partition('/')
+        query = request.query
+        body = await read_s3_body(request)
+        if request.method == 'PUT' and 'uploadId' in query:
+            self.uploads[query['uploadId']][int(query['partNumber'])] = body
+            return web.Response(headers={'ETag': f'"{zlib.crc32(body):08x}"'})
+        if request.method == 'PUT':
+            self.objects[(bucket, key)] = body
+            return web.Response(headers={'ETag': f'"{zlib.crc32(body):08x}"'})
+        if request.method == 'POST' and 'uploads' in query:
+            upload_id = f"upload-{len(self.uploads) + 1}"
+            self.uploads[upload_id] = {}
+            return s3_xml('InitiateMultipartUploadResult', Bucket=bucket, Key=key, UploadId=upload_id)
+        if request.method == 'POST' and 'uploadId' in query:
+            parts = self.uploads.pop(query['uploadId'])
+            self.objects[(bucket, key)] = b''.join(parts[number] for number in sorted(parts))
+            return s3_xml('CompleteMultipartUploadResult', Bucket=bucket, Key=key, ETag='"complete"')
+        if request.method == 'DELETE':
+            if 'uploadId' in query:
+                self.uploads.pop(query['uploadId'], None)
+            else:
+                self.objects.pop((bucket, key), None)
+            return web.Response(status=204)
+        if (bucket, key) not in self.objects:
+            if request.method == 'HEAD':
+                return web.Response(status=404)
+            return s3_xml('Error', status=404, Code='NoSuchKey', Message='The specified key does not exist.', Key=key)
+        data = self.objects[(bucket, key)]
+        headers = {'Content-Length': str(len(data)), 'ETag': f'"{zlib.crc32(data):08x}"', 'Last-Modified': 'Thu, 01 Jan 2026 00:00:00 GMT'}
+        if request.method == 'HEAD':
+            return web.Response(headers=headers)
+        return web.Response(body=data, headers=headers)
+
+
+async def read_s3_body(request):
+    body = await request.read()
+    if 'aws-chunked' not in request.headers.get('Content-Encoding', ''):
+        return body
+    # Streaming uploads with flexible checksums arrive as "<hex size>[;ext]\r\n<data>\r\n" chunks
+    data, position = bytearray(), 0
+    while True:
+        line_end = body.index(b'\r\n', position)
+        size = int(body[position:line_end].split(b';')[0], 16)
+        if size == 0:
+            return bytes(data)
+        data += body[line_end + 2:line_end + 2 + size]
+        position = line_end + 2 + size + 2
+
+
+def s3_xml(root, status=200, **fields):
+    elements = ''.join(f"<{name}>{escape(str(value))}</{name}>" for name, value in fields.items())
+    return web.Response(status=status, content_type='application/xml',
+                        text=f'<?xml version="1.0" encoding="UTF-8"?><{root}>{elements}</{root}>')
+
+
+def load_prompts(path):
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
@@ -1,18 +1,47 @@
 import os
+import re
 import json
-import time
-import datetime
+from contextlib import aclosing
 from datetime import datetime
-from utils2_v2 import *
-import yaml
-from a2cai_v2 import *
-import pprint 
-from pprint import pprint
-import asyncio
-import aiohttp
+from typing import TYPE_CHECKING
+from utils2_v2 import write_code_to_file, get_module_filename, IncrementalCodeWriter
+from stage_cache import get_stage_cache, make_stage_cache_key
+from aws_async import run_blocking
+from rate_limiter import RetryableModelError, get_scheduler, parse_retry_after, estimate_tokens
+from warm_state import get_language_prompts
+from tracing import trace_span, record_model_call
+from model_transport import make_transport_key, call_model_async, stream_model
+from token_budget import STAGE_TOKEN_BUDGETS, plan_tokens, is_truncated
+from structured_logging import get_logger
+
+if TYPE_CHECKING:
+    # aiohttp is imported by http_session when the first session is created
+    import aiohttp
+
+log = get_logger(__name__)
 
 role = "You are an expert in the latest version of AWS CDK and understanding of AWS services"
 
+IAM_ROLES_HEADER = '\n' + "##IAM Roles and policies to be included##" + '\n'
+
+DEFAULT_COMPLETIONS_BASE_URL = "https://api.perplexity.ai/chat/completions"
+
+# max_tokens of a completion requested without a token budget
+DEFAULT_COMPLETION_MAX_TOKENS = STAGE_TOKEN_BUDGETS['completion']['ceiling']
+
+# Follow-up user message asking the model to continue a completion cut off at max_tokens
+CONTINUATION_PROMPT = ("Your previous answer was cut off. Continue exactly where it stopped, without repeating "
+                       "any of it and without any introduction.")
+# A code fence the model re-opens at the start of a continuation, despite CONTINUATION_PROMPT
+REOPENED_FENCE_PATTERN = re.compile(r'\s*```[\w+-]*[ \t]*\n')
+
+
+def get_completions_base_url():
+    """
+    Chat-completions endpoint: COMPLETIONS_BASE_URL, defaulting to the Perplexity API.
+    """
+    return os.environ.get('COMPLETIONS_BASE_URL') or DEFAULT_COMPLETIONS_BASE_URL
+
 
 def generate_step2_prompt(step_1_response , code_language, stack_generation_prompt_dict):
     
@@ -20,11 +49,8 @@ def generate_step2_prompt(step_1_response , code_language, stack_generation_prom
     Generate prompt for a subsequent step in the reasoning path based on  the response of a previous step
     """
 
-    step_2_prompt = stack_generation_prompt_dict['step_2']
-    step_1_response_dict={'initial_cdk_stack' : step_1_response}
-    initial_cdk_stack_string=step_1_response_dict['initial_cdk_stack']
-    step_2_prompt=step_2_prompt + '\n' + initial_cdk_stack_string
-    print("TYPE" , type(step_2_prompt))
+    initial_cdk_stack_string=step_1_response
+    step_2_prompt=get_language_prompts(stack_generation_prompt_dict, code_language)['step_2_prefix'] + initial_cdk_stack_string
     
     return step_2_prompt,initial_cdk_stack_string
 
@@ -43,17 +69,8 @@ def generate_step3_prompt(step_2_response, code_language, initial_cdk_stack_stri
              including the CDK stack details and IAM roles/policies
     """
 
-    pprint(initial_cdk_stack_string)
-    step_3_prompt_str = stack_generation_prompt_dict['step_3']
-    
-    print("STEP 3 PROMPT STR" , step_3_prompt_str)
-    step_3_prompt= step_3_prompt_str.replace('{code_language}' , code_language)
-    print("STEP 3 PROMPT" , step_3_prompt)
-    step_2_response_dict= {'roles_list' : step_2_response}
-    roles_list= step_2_response_dict['roles_list']
-    step_3_prompt=step_3_prompt + '\n'  +  initial_cdk_stack_string +'\n' + "##IAM Roles and policies to be included##" + '\n' + roles_list
-    print("FINAL")
-    print(step_3_prompt)
+    step_3_prefix = get_language_prompts(stack_generation_prompt_dict, code_language)['step_3_prefix']
+    step_3_prompt=''.join((step_3_prefix, initial_cdk_stack_string, IAM_ROLES_HEADER, step_2_response))
     return step_3_prompt
 
 
@@ -66,94 +83,350 @@ def generate_step4_prompt(step_3_response,  code_language,stack_generation_promp
 
     """
 
-    step_4_prompt_str = stack_generation_prompt_dict['step_4']
-    step_4_prompt= step_4_prompt_str.replace('{code_language}' , code_language)
-    step_3_response_dict={'cdk_stack_with_roles' : step_3_response}
-    cdk_stack_with_roles=step_3_response_dict['cdk_stack_with_roles']
-    step_4_prompt=step_4_prompt + '\n'  + cdk_stack_with_roles
-    pprint(step_4_prompt)
+    step_4_prompt=get_language_prompts(stack_generation_prompt_dict, code_language)['step_4_prefix'] + step_3_response
     return step_4_prompt
 
 
-async def get_ai_response( session: aiohttp.ClientSession , api_key, role, prompt: str,model, base_url="https://api.perplexity.ai/chat/completions") -> dict:
+class ModelAuthError(Exception):
+    """
+    Raised by a completions call whose API key was rejected (401/403).
+    """
+
+
+# RefreshAheadValue holding the completions API key, see set_api_key_source
+_api_key_source = None
+
+
+def set_api_key_source(source):
+    """
+    Register the RefreshAheadValue the completions API key is loaded from. A key rejected with
+    401/403 is then invalidated and the call retried once with the reloaded key.
+    """
+    global _api_key_source
+    _api_key_source = source
+
+
+async def raise_for_model_status(response):
+    """
+    Raise for a non-200 completions response. Throttling (429) and server errors (5xx) raise
+    RetryableModelError, carrying Retry-After, so the scheduler can back off and retry; a
+    rejected API key (401/403) raises ModelAuthError.
+    """
+    if response.status == 200:
+        return
+    error_text = await response.text()
+    log.warning("Completions error response", status=response.status, payload=error_text)
+    if response.status in (401, 403):
+        raise ModelAuthError(f"HTTP {response.status}: {error_text[:200]}")
+    if response.status == 429 or response.status >= 500:
+        raise RetryableModelError(f"HTTP {response.status}: {error_text[:200]}", retry_after=parse_retry_after(response.headers.get('Retry-After')))
+    response.raise_for_status()
+
+
+def strip_reopened_fence(partial_text, continuation):
+    """
+    Drop a code fence re-opened at the start of a continuation when partial_text was cut off
+    inside a code block, so the joined completion keeps a single block.
+    """
+    if partial_text.count('```') % 2 == 0:
+        return continuation
+    match = REOPENED_FENCE_PATTERN.match(continuation)
+    return continuation[match.end():] if match else continuation
+
+
+def _fence_decidable(text):
+    # True once the start of a continuation either cannot be a fence or holds the fence's whole line
+    stripped = text.lstrip()
+    return bool(stripped) and (not '```'.startswith(stripped[:3]) or '\n' in stripped)
+
+
+def completion_messages(role, prompt, partial_text=None):
+    """
+    Chat messages for a prompt. With partial_text (a completion cut off at max_tokens) the
+    partial answer and CONTINUATION_PROMPT follow, so the model continues it.
+
+    Step prompts put their static template before the variable text (see get_language_prompts),
+    so the system message and template form a prefix shared by every module's call of a step,
+    which providers with prompt prefix caching reuse.
+    """
+    messages = [
+        {"role": "system", "content": role},
+        {"role": "user", "content": prompt}
+    ]
+    if partial_text:
+        messages += [
+            {"role": "assistant", "content": partial_text},
+            {"role": "user", "content": CONTINUATION_PROMPT}
+        ]
+    return messages
+
+
+async def stream_ai_response(session: 'aiohttp.ClientSession', api_key, role, prompt: str, model, base_url=None,
+                             max_tokens=DEFAULT_COMPLETION_MAX_TOKENS, partial_text=None, outcome=None):
+    """
+    Stream a chat completion over Server-Sent Events, through the model transport
+    (MODEL_TRANSPORT_MODE) so the stream can be recorded or replayed.
+
+    Token usage reported with the stream is recorded on the current trace span. If an outcome
+    dict is given, the stream's 'finish_reason' and 'usage' are stored in it.
 
+    Yields:
+        str: content deltas in the order they are received
+    """
     headers = {
         "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
     }
     
     payload = {
         "model": model,
-        "messages": [
-            {"role": "system", "content": role},
-            {"role": "user", "content": prompt}
-        ],
-        "max_tokens": 20000,
-        "temperature": 0.2
+        "messages": completion_messages(role, prompt, partial_text),
+        "max_tokens": max_tokens,
+        "temperature": 0.2,
+        "stream": True
     }
     
-    async with session.post(base_url, json=payload, headers=headers) as response:
-        if response.status != 200:
-            error_text = await response.text()
-            print(f"Error response: {error_text}")
-        response.raise_for_status()
-        response_json= await response.json()
-        response_with_line_breaks=response_json['choices'][0]['message']['content'].replace('\\n', '\n')
-        return response_with_line_breaks
+    async def server_sent_events():
+        async with session.post(base_url or get_completions_base_url(), json=payload, headers=headers) as response:
+            await raise_for_model_status(response)
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                yield json.loads(data)
+
+    usage = None
+    finish_reason = None
+    transport_key = make_transport_key('completions', model, payload, streaming=True)
+    async for event in stream_model(transport_key, 'completions', model, server_sent_events):
+        # Cumulative usage; the last event carries the final counts
+        usage = event.get('usage') or usage
+        choices = event.get('choices') or []
+        if choices:
+            finish_reason = choices[0].get('finish_reason') or finish_reason
+            delta = (choices[0].get('delta') or {}).get('content')
+            if delta:
+                yield delta
+    record_completion_usage(usage)
+    if outcome is not None:
+        outcome.update(finish_reason=finish_reason, usage=usage)
 
-async def code_generation_do_it_all(session,module_name, module_prompt, local_dir, stack_dirname , code_language, stack_logfiles_dir,stack_generation_prompt_dict, api_key,model_name):
+
+def record_completion_usage(usage):
     """
+    Add prompt/completion tokens from a completions 'usage' field to the current trace span.
+    Prompt tokens served from the provider's prefix cache ('prompt_tokens_details.cached_tokens',
+    where reported) are counted as cache reads instead of input tokens, as for Bedrock.
     """
-    print("STARTING STACK GENERATION FOR MODULE NAME:" , module_name)
-    print(f"Task {module_name} started at {datetime.now()}")
+    if usage:
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        record_model_call(
+            input_tokens=usage.get('prompt_tokens', 0) - cached_tokens,
+            output_tokens=usage.get('completion_tokens', 0),
+            cache_read_tokens=cached_tokens,
+        )
+
+
+async def get_ai_response( session: 'aiohttp.ClientSession' , api_key, role, prompt: str,model, base_url=None, on_chunk=None, budget=None) -> dict:
+    """
+    Get a chat completion for a prompt.
+
+    Unless MODEL_STREAMING is 'false' the completion is streamed and each content delta is passed
+    to on_chunk as soon as it arrives; the complete text is returned either way. Requests are
+    admitted through the shared 'completions' scheduler (concurrency, RPM/TPM limits, backoff).
+
+    max_tokens comes from budget (see token_budget.plan_tokens), by default the 'completion'
+    stage's. A completion cut off at max_tokens (finish_reason 'length') is continued, up to
+    budget.max_continuations times, and the parts are joined.
+    """
+
+    budget = budget or plan_tokens('completion', prompt)
     
-    step_1_prompt= module_prompt + '\n' + stack_generation_prompt_dict['module_prompt_suffix']
+    base_url = base_url or get_completions_base_url()
+    # Memoize on (provider, model, prompt, max_tokens, temperature); the budget's ceiling stands
+    # in for max_tokens because the cached text is the complete, continued completion
+    stage_cache = get_stage_cache()
+    cache_key = make_stage_cache_key(base_url, model, completion_messages(role, prompt), budget.ceiling, 0.2)
+    cached_response = await run_blocking(stage_cache.get, cache_key)
+    if cached_response is not None:
+        log.info("Stage cache hit for completions call %s", cache_key[:12])
+        record_model_call(cache_hits=1)
+        if on_chunk:
+            on_chunk(cached_response)
+        return cached_response
     
-    # Step 1: Perplexity step 1
+    async def streamed_completion(max_tokens, partial_text):
+        chunks = []
+        outcome = {}
+
+        def emit(chunk):
+            if chunk:
+                chunks.append(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+
+        # The start of a continuation is held back until a re-opened fence can be stripped
+        held = '' if partial_text else None
+        try:
+            async with aclosing(stream_ai_response(session, api_key, role, prompt, model, base_url, max_tokens, partial_text, outcome)) as stream:
+                async for chunk in stream:
+                    if held is None:
+                        emit(chunk)
+                        continue
+                    held += chunk
+                    if _fence_decidable(held):
+                        emit(strip_reopened_fence(partial_text, held))
+                        held = None
+        except RetryableModelError as e:
+            if chunks:
+                # Partial output was already emitted; retrying would duplicate it
+                raise RuntimeError(f"Completion stream interrupted after partial output: {e}") from e
+            raise
+        if held:
+            emit(strip_reopened_fence(partial_text, held))
+        return ''.join(chunks), outcome.get('finish_reason'), outcome.get('usage')
+    
+    async def completion(max_tokens, partial_text):
+        payload = {
+            "model": model,
+            "messages": completion_messages(role, prompt, partial_text),
+            "max_tokens": max_tokens,
+            "temperature": 0.2
+        }
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+        async def post_completion():
+            async with session.post(base_url, json=payload, headers=headers) as response:
+                await raise_for_model_status(response)
+                return await response.json()
+
+        response_json = await call_model_async(make_transport_key('completions', model, payload), 'completions', model, post_completion)
+        record_completion_usage(response_json.get('usage'))
+        choice = response_json['choices'][0]
+        content = choice['message']['content']
+        if partial_text:
+            content = strip_reopened_fence(partial_text, content)
+        return content, choice.get('finish_reason'), response_json.get('usage')
+    
+    streaming = os.environ.get('MODEL_STREAMING', 'true').lower() == 'true'
+    request = streamed_completion if streaming else completion
+
+    async def generate(max_tokens, partial_text):
+        nonlocal api_key
+        try:
+            return await request(max_tokens, partial_text)
+        except ModelAuthError:
+            if _api_key_source is None:
+                raise
+            # The key was probably rotated since it was cached; another call may have reloaded it already
+            log.warning("Completions API key rejected, reloading it and retrying once")
+            current_key = await run_blocking(_api_key_source.get)
+            if current_key == api_key:
+                _api_key_source.invalidate()
+                current_key = await run_blocking(_api_key_source.get)
+            api_key = current_key
+            return await request(max_tokens, partial_text)
+    scheduler = get_scheduler('completions')
+    prompt_tokens = estimate_tokens(role) + estimate_tokens(prompt)
+
+    max_tokens = budget.max_tokens
+    content, finish_reason, usage = await scheduler.run(lambda: generate(max_tokens, None), estimated_tokens=prompt_tokens + max_tokens)
+    record_model_call(reserved_tokens=max_tokens)
+    output_tokens = (usage or {}).get('completion_tokens', 0)
+    continuations = 0
+    while is_truncated(finish_reason) and continuations < budget.max_continuations:
+        continuations += 1
+        max_tokens = budget.continuation_max_tokens(continuations)
+        log.info("Completion truncated at max_tokens, continuing", stage=budget.stage, continuation=continuations, max_tokens=max_tokens)
+        partial_text = content
+        more, finish_reason, usage = await scheduler.run(
+            lambda: generate(max_tokens, partial_text),
+            estimated_tokens=prompt_tokens + estimate_tokens(partial_text) + max_tokens,
+        )
+        record_model_call(reserved_tokens=max_tokens)
+        output_tokens += (usage or {}).get('completion_tokens', 0)
+        content += more
+    if is_truncated(finish_reason):
+        log.warning("Completion still truncated after continuations", stage=budget.stage, continuations=continuations)
+    budget.record(output_tokens or estimate_tokens(content), continuations)
+
+    response_with_line_breaks=content.replace('\\n', '\n')
+    await run_blocking(stage_cache.put, cache_key, response_with_line_breaks)
+    return response_with_line_breaks
+
+async def code_generation_do_it_all(session,module_name, module_prompt, local_dir, stack_dirname , code_language, stack_logfiles_dir,stack_generation_prompt_dict, api_key,model_name, progress_callback=None):
+    """
+    Generate one module's stack file in four model steps, each timed as a 'module_step_<n>' trace span.
+
+    progress_callback, if given, is called with the step number (1-4) after each step completes.
+    """
+    log.info("Module stack generation started", module=module_name)
     
-    print("-----------------STEP 1 PROMPT---------------")
-    pprint( step_1_prompt)
+    step_1_prompt= get_language_prompts(stack_generation_prompt_dict, code_language)['step_1_prefix'] + module_prompt
     
-    step_1_response= await get_ai_response(session,api_key, role, step_1_prompt,  model=model_name, base_url="https://api.perplexity.ai/chat/completions")
+    # Step 1: Perplexity step 1
+    
+    log.debug("Step prompt", module=module_name, step=1, payload=step_1_prompt)
     
-    write_log_to_file(step_1_response, local_dir, stack_logfiles_dir)
-    print("-----------------STEP 1 RESPONSE---------------")
-    pprint( step_1_response)
+    with trace_span('module_step_1'):
+        step_1_response= await get_ai_response(session,api_key, role, step_1_prompt,  model=model_name, budget=plan_tokens('module_step_1', module_prompt))
+    if progress_callback:
+        progress_callback(1)
+    log.step_output(module_name, 1, step_1_response)
     
     # Step 2: Perplexity Step 2
-    pprint("-----------------STEP 2 PROMPT---------------")
     step_2_prompt,initial_cdk_stack_string= generate_step2_prompt(step_1_response,  code_language, stack_generation_prompt_dict)
-    pprint(step_2_prompt)
+    log.debug("Step prompt", module=module_name, step=2, payload=step_2_prompt)
     
-    print("-----------------STEP 2 RESPONSE---------------")
-    step_2_response= await get_ai_response(session,api_key, role, step_2_prompt,  model=model_name, base_url="https://api.perplexity.ai/chat/completions")
-    
-    write_log_to_file(step_2_response,local_dir, stack_logfiles_dir)
-    pprint(step_2_response)
+    with trace_span('module_step_2'):
+        step_2_response= await get_ai_response(session,api_key, role, step_2_prompt,  model=model_name, budget=plan_tokens('module_step_2', step_1_response))
+    if progress_callback:
+        progress_callback(2)
+    log.step_output(module_name, 2, step_2_response)
     
     # Step 3: Perplexity Step 3
-    print("-----------------STEP 3 PROMPT---------------")
     step_3_prompt = generate_step3_prompt(step_2_response,  code_language,initial_cdk_stack_string, stack_generation_prompt_dict)
-    print("step 3 prompt", step_3_prompt)
-    
-    print("-----------------STEP 3 RESPONSE---------------")
-    step_3_response= await get_ai_response(session,api_key, role, step_3_prompt,  model=model_name, base_url="https://api.perplexity.ai/chat/completions")
+    log.debug("Step prompt", module=module_name, step=3, payload=step_3_prompt)
     
-    write_log_to_file(step_3_response, local_dir, stack_logfiles_dir)
-    pprint( step_3_response)
+    with trace_span('module_step_3'):
+        step_3_response= await get_ai_response(session,api_key, role, step_3_prompt,  model=model_name, budget=plan_tokens('module_step_3', initial_cdk_stack_string + step_2_response))
+    if progress_callback:
+        progress_callback(3)
+    log.step_output(module_name, 3, step_3_response)
     
     # Step 4: Perplexity Step 4
     step_4_prompt = generate_step4_prompt(step_3_response, code_language, stack_generation_prompt_dict)
-    print("step 4 prompt" , step_4_prompt)
+    log.debug("Step prompt", module=module_name, step=4, payload=step_4_prompt)
     
-    step_4_response= await get_ai_response(session,api_key, role, step_4_prompt, model=model_name, base_url="https://api.perplexity.ai/chat/completions")
+    # Stream the final code straight into the module's stack file while it is generated
+    step_4_started_at = datetime.now()
+    code_writer = IncrementalCodeWriter(os.path.join(local_dir, stack_dirname, get_module_filename(module_name, code_language)), code_language)
+    try:
+        with trace_span('module_step_4'):
+            step_4_response= await get_ai_response(session,api_key, role, step_4_prompt, model=model_name, on_chunk=code_writer.feed, budget=plan_tokens('module_step_4', step_3_response))
+    finally:
+        code_writer.close()
+    if code_writer.first_output_at:
+        log.info("First code emitted", module=module_name, seconds=round((code_writer.first_output_at - step_4_started_at).total_seconds(), 2))
     
-    pprint(step_4_response)
+    log.step_output(module_name, 4, step_4_response)
     
-    # Step 5: Write final code to file
-    codefilepath = write_code_to_file(step_4_response, local_dir,stack_dirname,code_language, module_name)
+    # Step 5: Write final code to file, unless the streamed code block was already written whole
+    if code_writer.completed:
+        codefilepath = code_writer.code_file_path
+    else:
+        codefilepath = write_code_to_file(step_4_response, local_dir,stack_dirname,code_language, module_name)
+    if progress_callback:
+        progress_callback(4)
     
-    print(f"Task {module_name} ended at {datetime.now()}")
+    log.info("Module stack generation finished", module=module_name, file=codefilepath)
 
     return  codefilepath
 
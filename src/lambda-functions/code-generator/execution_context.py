@@ -0,0 +1,31 @@
+import os
+from contextvars import ContextVar
+
+# (execution_id, bypass_cache) of the diagram being generated in the current context
+_execution = ContextVar('execution', default=None)
+
+
+def set_execution(execution_id, bypass_cache=False):
+    """
+    Bind an execution to the current context.
+
+    Without a bound execution the _EXECUTION_ID and _BYPASS_CACHE environment variables apply.
+    """
+    _execution.set((execution_id, bypass_cache))
+
+
+def current_execution_id():
+    execution = _execution.get()
+    if execution is not None:
+        return execution[0]
+    return os.environ.get('_EXECUTION_ID', '')
+
+
+def cache_bypassed():
+    """
+    Whether the current execution asked to skip cached results ('bypass_cache').
+    """
+    execution = _execution.get()
+    if execution is not None:
+        return execution[1]
+    return os.environ.get('_BYPASS_CACHE', 'false') == 'true'
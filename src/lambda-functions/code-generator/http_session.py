@@ -0,0 +1,60 @@
+import os
+import asyncio
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_HTTP_MAX_CONNECTIONS = 32
+# Every concurrent module may hold a streaming completion while another starts
+DEFAULT_HTTP_LIMIT_PER_HOST = 16
+DEFAULT_HTTP_KEEPALIVE_SECONDS = 60
+DNS_CACHE_TTL_SECONDS = 300
+
+_session = None
+_session_loop = None
+
+
+def _create_session():
+    # Imported on first use: aiohttp builds its TLS contexts at import time, which a cold start
+    # served from the result cache never needs
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(
+        limit=int(os.environ.get('HTTP_MAX_CONNECTIONS', DEFAULT_HTTP_MAX_CONNECTIONS)),
+        limit_per_host=int(os.environ.get('HTTP_LIMIT_PER_HOST', DEFAULT_HTTP_LIMIT_PER_HOST)),
+        keepalive_timeout=float(os.environ.get('HTTP_KEEPALIVE_SECONDS', DEFAULT_HTTP_KEEPALIVE_SECONDS)),
+        use_dns_cache=True,
+        ttl_dns_cache=DNS_CACHE_TTL_SECONDS,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def get_http_session():
+    """
+    Return the shared aiohttp session for model endpoints, creating it on first use.
+
+    A session that was closed or belongs to another loop is replaced. Do not close the
+    returned session; use reset_http_session instead.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        if _session is not None and not _session.closed and _session_loop is not None and not _session_loop.is_closed():
+            log.warning("HTTP session belongs to another event loop, replacing it")
+        _session = _create_session()
+        _session_loop = loop
+    return _session
+
+
+async def reset_http_session():
+    """
+    Close and drop the shared session, e.g. after a failed invocation that may have left
+    half-read responses on pooled connections. The next get_http_session opens a fresh one.
+    """
+    global _session, _session_loop
+    session, _session, _session_loop = _session, None, None
+    if session is not None and not session.closed:
+        try:
+            await session.close()
+        except Exception as e:
+            log.error("Error closing HTTP session: %s", e)
@@ -0,0 +1,112 @@
+import json
+import uuid
+import hashlib
+import binascii
+from urllib.parse import urlparse
+from aws_clients import get_client
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+READ_CHUNK_BYTES = 1024 * 1024
+# Multiple of 3 so every chunk except the last encodes to base64 without padding
+ENCODE_CHUNK_BYTES = 3 * 256 * 1024
+
+
+def read_s3_object(s3_uri, s3_client=None):
+    """
+    Read an S3 object into memory without staging it on /tmp.
+
+    :param s3_uri: str, S3 URI of the object (e.g., 's3://bucket_name/key_name')
+    :param s3_client: optional boto3 S3 client
+    :return: bytearray, object contents
+    """
+    parsed_url = urlparse(s3_uri)
+    bucket_name = parsed_url.netloc
+    key_name = parsed_url.path.lstrip('/')
+
+    s3_client = s3_client or get_client('s3')
+    response = s3_client.get_object(Bucket=bucket_name, Key=key_name)
+    body = response['Body']
+    buffer = bytearray(response['ContentLength'])
+    view = memoryview(buffer)
+    offset = 0
+    try:
+        while offset < len(buffer):
+            chunk = body.read(min(READ_CHUNK_BYTES, len(buffer) - offset))
+            if not chunk:
+                raise IOError(f"S3 object {s3_uri} ended after {offset} of {len(buffer)} bytes")
+            view[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+    finally:
+        view.release()
+        body.close()
+    log.info("Read object", bytes=len(buffer), s3_uri=s3_uri)
+    return buffer
+
+
+class InlineImage:
+    """
+    Raw image bytes placed in a Bedrock request body instead of a base64 string.
+
+    serialize_request_body base64-encodes the bytes straight into the request payload, and the
+    stage cache keys the image by its SHA-256 instead of hashing the encoded text.
+    """
+
+    def __init__(self, data, sha256=None):
+        self.data = data
+        self.sha256 = sha256 or hashlib.sha256(data).hexdigest()
+
+    def encoded_length(self):
+        return 4 * ((len(self.data) + 2) // 3)
+
+    def cache_token(self):
+        return f'sha256:{self.sha256}'
+
+
+def _replace_inline_images(value, placeholders):
+    if isinstance(value, InlineImage):
+        placeholder = f'inline-image-{uuid.uuid4().hex}'
+        placeholders[placeholder] = value
+        return placeholder
+    if isinstance(value, dict):
+        return {key: _replace_inline_images(item, placeholders) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_replace_inline_images(item, placeholders) for item in value]
+    return value
+
+
+def serialize_request_body(request_body):
+    """
+    Serialize a request body to JSON bytes, base64-encoding InlineImage values in place.
+
+    :param request_body: dict, Bedrock request body that may contain InlineImage values
+    :return: bytearray, UTF-8 JSON payload
+    """
+    placeholders = {}
+    skeleton = json.dumps(_replace_inline_images(request_body, placeholders)).encode('utf-8')
+
+    # Split the small JSON skeleton around each "<placeholder>" string
+    pieces = []
+    position = 0
+    for placeholder, image in placeholders.items():
+        start = skeleton.index(placeholder.encode('utf-8'), position)
+        pieces.append(skeleton[position:start])
+        pieces.append(image)
+        position = start + len(placeholder)
+    pieces.append(skeleton[position:])
+
+    payload = bytearray(sum(piece.encoded_length() if isinstance(piece, InlineImage) else len(piece) for piece in pieces))
+    offset = 0
+    for piece in pieces:
+        if isinstance(piece, InlineImage):
+            source = memoryview(piece.data)
+            for start in range(0, len(source), ENCODE_CHUNK_BYTES):
+                encoded = binascii.b2a_base64(source[start:start + ENCODE_CHUNK_BYTES], newline=False)
+                payload[offset:offset + len(encoded)] = encoded
+                offset += len(encoded)
+            source.release()
+        else:
+            payload[offset:offset + len(piece)] = piece
+            offset += len(piece)
+    return payload
@@ -0,0 +1,171 @@
+import io
+import os
+import json
+import math
+import base64
+import hashlib
+from stage_cache import get_stage_cache, make_stage_cache_key
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+# Claude downsizes anything larger server-side, so larger uploads only add request bytes and latency
+DEFAULT_MAX_LONG_EDGE = 1568
+DEFAULT_MAX_PIXELS = 1_150_000
+DEFAULT_ENCODINGS = 'png,webp,jpeg'
+# Bedrock rejects larger images; lossy encodings are only tried for images that need resizing or
+# whose lossless encodings exceed this
+DEFAULT_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+def detect_media_type(image_bytes):
+    """
+    Detect the image format from its magic bytes.
+
+    :param image_bytes: bytes, raw image
+    :return: str, media type accepted by the Anthropic messages API, defaults to 'image/png'
+    """
+    for signature, media_type in SIGNATURES:
+        if image_bytes.startswith(signature):
+            return media_type
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/png'
+
+
+def _target_size(width, height, max_long_edge, max_pixels):
+    scale = min(1.0, max_long_edge / max(width, height), math.sqrt(max_pixels / (width * height)))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode_candidates(image, encodings, lossy):
+    from PIL import Image
+
+    candidates = []
+    for encoding in encodings:
+        buffer = io.BytesIO()
+        if encoding == 'png':
+            if lossy:
+                # Diagrams use few colours, so a 256-colour palette is usually visually lossless
+                image.quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(buffer, format='PNG', optimize=True)
+            else:
+                image.save(buffer, format='PNG', optimize=True)
+            candidates.append((buffer.getvalue(), 'image/png'))
+        elif encoding == 'webp':
+            image.save(buffer, format='WEBP', lossless=True, method=0)
+            candidates.append((buffer.getvalue(), 'image/webp'))
+        elif encoding == 'jpeg' and lossy:
+            image.save(buffer, format='JPEG', quality=90, optimize=True)
+            candidates.append((buffer.getvalue(), 'image/jpeg'))
+    return candidates
+
+
+def normalize_image(image_bytes, max_long_edge=None, max_pixels=None, encodings=None, max_image_bytes=None):
+    """
+    Downscale an architecture diagram to the model's effective resolution and re-encode it compactly.
+
+    Transparent backgrounds are flattened onto white. Every configured encoding is tried and the
+    smallest result is kept; the original bytes are kept if nothing beats them without resizing.
+    Images that are not resized are only re-encoded losslessly, unless that stays above
+    IMAGE_MAX_BYTES. Without Pillow, or for input Pillow cannot decode, the image is passed
+    through with its detected media type.
+
+    :param image_bytes: bytes, raw uploaded image
+    :return: dict with 'data' (bytes), 'media_type', 'original_bytes', 'encoded_bytes',
+             'original_size' and 'size' ((width, height) or None)
+    """
+    max_long_edge = max_long_edge or int(os.environ.get('IMAGE_MAX_LONG_EDGE', DEFAULT_MAX_LONG_EDGE))
+    max_pixels = max_pixels or int(os.environ.get('IMAGE_MAX_PIXELS', DEFAULT_MAX_PIXELS))
+    encodings = [encoding.strip().lower() for encoding in (encodings or os.environ.get('IMAGE_ENCODINGS', DEFAULT_ENCODINGS).split(','))]
+    max_image_bytes = max_image_bytes or int(os.environ.get('IMAGE_MAX_BYTES', DEFAULT_MAX_IMAGE_BYTES))
+
+    result = {
+        'data': image_bytes,
+        'media_type': detect_media_type(image_bytes),
+        'original_bytes': len(image_bytes),
+        'encoded_bytes': len(image_bytes),
+        'original_size': None,
+        'size': None,
+    }
+    try:
+        from PIL import Image
+    except ImportError:
+        log.warning("Pillow not installed, sending the image unmodified")
+        return result
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.load()
+            original_size = image.size
+            target_size = _target_size(image.width, image.height, max_long_edge, max_pixels)
+            resized = target_size != image.size
+
+            if resized and image.mode in ('RGB', 'RGBA', 'L', 'LA'):
+                # Resize first so the colour conversion below touches the small image only
+                image = image.resize(target_size, Image.Resampling.LANCZOS)
+                resized_first = True
+            else:
+                resized_first = False
+
+            if image.mode in ('RGBA', 'LA', 'P'):
+                rgba = image if image.mode == 'RGBA' else image.convert('RGBA')
+                flattened = Image.new('RGB', rgba.size, (255, 255, 255))
+                flattened.paste(rgba, mask=rgba.getchannel('A'))
+            else:
+                flattened = image if image.mode == 'RGB' else image.convert('RGB')
+            if resized and not resized_first:
+                flattened = flattened.resize(target_size, Image.Resampling.LANCZOS)
+    except (OSError, Image.DecompressionBombError) as e:
+        log.warning("Image could not be decoded, sending it unmodified: %s", e)
+        return result
+    result['original_size'] = result['size'] = original_size
+
+    candidates = _encode_candidates(flattened, encodings, lossy=resized)
+    if not resized:
+        candidates.append((image_bytes, result['media_type']))
+    data, media_type = min(candidates, key=lambda candidate: len(candidate[0]))
+    if len(data) > max_image_bytes and not resized:
+        data, media_type = min(_encode_candidates(flattened, encodings, lossy=True) + [(data, media_type)], key=lambda candidate: len(candidate[0]))
+
+    result.update(data=data, media_type=media_type, encoded_bytes=len(data), size=flattened.size)
+    return result
+
+
+def prepare_image(image_bytes):
+    """
+    Normalize an image for the Bedrock request.
+
+    The result is memoized in the stage cache under the SHA-256 of the original bytes and the
+    normalization settings, so any cache keyed on the image reuses it.
+
+    :param image_bytes: bytes or bytearray, raw uploaded image
+    :return: dict with 'data' (bytes, base64-encoded later by image_ingest.serialize_request_body),
+             'media_type', 'sha256' and the size statistics
+    """
+    image_sha256 = hashlib.sha256(image_bytes).hexdigest()
+    settings = [
+        os.environ.get('IMAGE_MAX_LONG_EDGE', DEFAULT_MAX_LONG_EDGE),
+        os.environ.get('IMAGE_MAX_PIXELS', DEFAULT_MAX_PIXELS),
+        os.environ.get('IMAGE_ENCODINGS', DEFAULT_ENCODINGS),
+        os.environ.get('IMAGE_MAX_BYTES', DEFAULT_MAX_IMAGE_BYTES),
+    ]
+    stage_cache = get_stage_cache()
+    cache_key = make_stage_cache_key('image-preprocessing', '', image_sha256, None, settings)
+    cached = stage_cache.get(cache_key)
+    if cached is not None:
+        prepared = json.loads(cached)
+        prepared['data'] = base64.b64decode(prepared['data'])
+        return prepared
+
+    prepared = {'sha256': image_sha256, **normalize_image(image_bytes)}
+    log.info("Image normalized", original_bytes=prepared['original_bytes'], encoded_bytes=prepared['encoded_bytes'],
+             original_size=prepared['original_size'], size=prepared['size'], media_type=prepared['media_type'])
+    stage_cache.put(cache_key, json.dumps({**prepared, 'data': base64.b64encode(prepared['data']).decode('utf-8')}))
+    return prepared
@@ -0,0 +1,206 @@
+import os
+import json
+import gzip
+import time
+import asyncio
+import threading
+from contextlib import aclosing
+from collections import defaultdict
+from datetime import datetime
+from stage_cache import make_stage_cache_key
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+# MODEL_TRANSPORT_MODE: 'live' calls the models, 'record' calls them and keeps every response in
+# the cassette, 'replay' answers from the cassette without any model call
+DEFAULT_TRANSPORT_MODE = 'live'
+DEFAULT_CASSETTE_PATH = '/tmp/model-cassette.jsonl.gz'
+
+
+class CassetteMissError(LookupError):
+    """
+    Raised in replay mode for a request that has no recorded response.
+    """
+
+
+def get_transport_mode():
+    mode = os.environ.get('MODEL_TRANSPORT_MODE', DEFAULT_TRANSPORT_MODE).lower()
+    return mode if mode in ('record', 'replay') else DEFAULT_TRANSPORT_MODE
+
+
+def emulate_timing():
+    """
+    Whether replay reproduces the recorded latencies (MODEL_REPLAY_TIMING=original) instead of
+    answering immediately.
+    """
+    return os.environ.get('MODEL_REPLAY_TIMING', 'none').lower() == 'original'
+
+
+def make_transport_key(provider, model, request_body, streaming=False):
+    """
+    Key of a model request in the cassette: the stage cache inputs with the provider name
+    instead of the endpoint URL, and without max_tokens (see token_budget). Streamed and
+    complete responses are recorded separately.
+    """
+    provider_key = f"{provider}:stream" if streaming else provider
+    return make_stage_cache_key(provider_key, model, request_body['messages'], None, request_body.get('temperature'))
+
+
+class Cassette:
+    """
+    Recorded model interactions, stored as gzipped JSON lines.
+
+    Identical requests recorded more than once are replayed in recorded order. Thread-safe.
+
+    Args:
+        path (str): Cassette file; loaded if it exists, written by save().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._interactions = defaultdict(list)
+        self._positions = defaultdict(int)
+        self._dirty = False
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    interaction = json.loads(line)
+                    self._interactions[interaction['key']].append(interaction)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(interactions) for interactions in self._interactions.values())
+
+    def add(self, interaction):
+        with self._lock:
+            self._interactions[interaction['key']].append(interaction)
+            self._dirty = True
+
+    def next(self, key, provider):
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                raise CassetteMissError(f"No recorded {provider} response for request {key[:12]} in {self.path}")
+            position = self._positions[key]
+            self._positions[key] = position + 1
+            return interactions[position % len(interactions)]
+
+    def save(self):
+        """
+        Write the cassette if anything was recorded since the last save. Blocking.
+        """
+        with self._lock:
+            if not self._dirty:
+                return False
+            lines = [json.dumps(interaction) for interactions in self._interactions.values() for interaction in interactions]
+            self._dirty = False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Written to a temporary file first so an interrupted save never truncates the cassette
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with gzip.open(temporary_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temporary_path, self.path)
+        log.info("Model cassette saved", path=self.path, interactions=len(lines))
+        return True
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette():
+    """
+    Return the cassette at MODEL_CASSETTE, loading it on first use.
+    """
+    global _cassette
+    path = os.environ.get('MODEL_CASSETTE', DEFAULT_CASSETTE_PATH)
+    with _cassette_lock:
+        if _cassette is None or _cassette.path != path:
+            _cassette = Cassette(path)
+        return _cassette
+
+
+def save_cassette():
+    """
+    In record mode, write what was recorded to MODEL_CASSETTE. Errors are logged, never raised.
+    """
+    if get_transport_mode() != 'record':
+        return
+    try:
+        get_cassette().save()
+    except Exception as e:
+        log.error("Error saving model cassette: %s", e)
+
+
+def _interaction(key, provider, model, **fields):
+    return {'key': key, 'provider': provider, 'model': model, 'recordedAt': datetime.now().isoformat(timespec='seconds'), **fields}
+
+
+def call_model(key, provider, model, live_call):
+    """
+    Blocking model call through the transport; live_call() performs the request and returns the
+    parsed response.
+    """
+    mode = get_transport_mode()
+    if mode == 'replay':
+        interaction = get_cassette().next(key, provider)
+        if emulate_timing():
+            time.sleep(interaction['seconds'])
+        return interaction['response']
+
+    started = time.monotonic()
+    response = live_call()
+    if mode == 'record':
+        get_cassette().add(_interaction(key, provider, model, seconds=round(time.monotonic() - started, 4), response=response))
+    return response
+
+
+async def call_model_async(key, provider, model, live_call):
+    """
+    Async counterpart of call_model; live_call() returns an awaitable of the parsed response.
+    """
+    mode = get_transport_mode()
+    if mode == 'replay':
+        interaction = get_cassette().next(key, provider)
+        if emulate_timing():
+            await asyncio.sleep(interaction['seconds'])
+        return interaction['response']
+
+    started = time.monotonic()
+    response = await live_call()
+    if mode == 'record':
+        get_cassette().add(_interaction(key, provider, model, seconds=round(time.monotonic() - started, 4), response=response))
+    return response
+
+
+async def stream_model(key, provider, model, live_stream):
+    """
+    Stream model events through the transport; live_stream() returns an async iterator of
+    JSON-serializable events. A stream is only recorded once it completed.
+    """
+    mode = get_transport_mode()
+    if mode == 'replay':
+        interaction = get_cassette().next(key, provider)
+        timed = emulate_timing()
+        started = time.monotonic()
+        for offset, event in interaction['events']:
+            if timed:
+                delay = offset - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield event
+        return
+
+    started = time.monotonic()
+    events = []
+    async with aclosing(live_stream()) as live_events:
+        async for event in live_events:
+            if mode == 'record':
+                events.append((round(time.monotonic() - started, 4), event))
+            yield event
+    if mode == 'record':
+        get_cassette().add(_interaction(key, provider, model, seconds=round(time.monotonic() - started, 4), events=events))
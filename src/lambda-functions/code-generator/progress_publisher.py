@@ -0,0 +1,155 @@
+import os
+import time
+import asyncio
+import threading
+from botocore.exceptions import ClientError
+from aws_async import run_blocking
+from aws_clients import get_resource
+from execution_context import current_execution_id
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_PROGRESS_INTERVAL_SECONDS = 1.0
+PROGRESS_TTL_SECONDS = 86400  # 24 hour TTL
+
+# Only move progress forward: a late or reordered write must never overwrite a newer value
+MONOTONIC_PROGRESS_CONDITION = 'attribute_not_exists(progress) OR progress < :p'
+
+
+def update_progress_item(table_name, **update_kwargs):
+    """
+    Blocking update_item on the synthesis progress table. Call through run_blocking from async code.
+    """
+    dynamodb = get_resource('dynamodb', region_name=os.environ.get('REGION', 'us-west-2'))
+    table = dynamodb.Table(table_name)
+    return table.update_item(**update_kwargs)
+
+
+class ProgressPublisher:
+    """
+    Background writer for one execution's row in the synthesis progress table.
+
+    Updates within PROGRESS_UPDATE_INTERVAL_SECONDS are coalesced into one write of the latest
+    value; flush() writes whatever is pending.
+
+    Args:
+        table_name (str): Synthesis progress table.
+        execution_id (str): Partition key of the execution's row.
+        interval (float, optional): Coalescing window in seconds.
+    """
+
+    def __init__(self, table_name, execution_id, interval=None):
+        self.table_name = table_name
+        self.execution_id = execution_id
+        if interval is None:
+            interval = float(os.environ.get('PROGRESS_UPDATE_INTERVAL_SECONDS', DEFAULT_PROGRESS_INTERVAL_SECONDS))
+        self.interval = interval
+        self.latest = None
+        self.written = None
+        self._last_write_at = float('-inf')
+        self._task = None
+        self._flush_requested = asyncio.Event()
+
+    def publish(self, progress):
+        """
+        Queue a progress value. Values not above the latest queued one are dropped.
+        Must be called from the event loop thread.
+        """
+        if self.latest is not None and progress <= self.latest:
+            return
+        self.latest = progress
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        while self.written != self.latest:
+            wait = self._last_write_at + self.interval - time.monotonic()
+            if wait > 0 and not self._flush_requested.is_set():
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            progress = self.latest
+            self._last_write_at = time.monotonic()
+            await self._write(progress)
+            self.written = progress
+
+    async def _write(self, progress):
+        now = int(time.time())
+        try:
+            await run_blocking(
+                update_progress_item,
+                self.table_name,
+                Key={'executionId': self.execution_id},
+                UpdateExpression='SET progress = :p, #s = :s, updatedAt = :u, #t = :ttl',
+                ConditionExpression=MONOTONIC_PROGRESS_CONDITION,
+                ExpressionAttributeValues={
+                    ':p': progress,
+                    ':s': 'RUNNING' if progress < 100 else 'SUCCEEDED',
+                    ':u': now,
+                    ':ttl': now + PROGRESS_TTL_SECONDS,
+                },
+                ExpressionAttributeNames={'#s': 'status', '#t': 'ttl'},
+            )
+            log.debug("Progress updated", progress=progress, execution=self.execution_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                log.debug("Progress not newer than the stored value, skipped", progress=progress, execution=self.execution_id)
+            else:
+                log.error("Error writing progress to DynamoDB: %s", e)
+        except Exception as e:
+            log.error("Error writing progress to DynamoDB: %s", e)
+
+    async def flush(self):
+        """
+        Write any pending progress now and wait until it is stored.
+        """
+        self._flush_requested.set()
+        try:
+            if self._task is not None:
+                await self._task
+        finally:
+            self._flush_requested.clear()
+
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_progress_publisher():
+    """
+    Return the publisher for the current execution (see execution_context), or None when no
+    SYNTHESIS_PROGRESS_TABLE is configured.
+    """
+    table_name = os.environ.get('SYNTHESIS_PROGRESS_TABLE')
+    if not table_name:
+        return None
+    key = (table_name, current_execution_id() or 'unknown')
+    with _publishers_lock:
+        if key not in _publishers:
+            _publishers[key] = ProgressPublisher(*key)
+        return _publishers[key]
+
+
+def publish_progress(progress):
+    """
+    Queue a progress update for the current execution without waiting for DynamoDB.
+    """
+    publisher = get_progress_publisher()
+    if publisher is None:
+        log.info("Code synthesis progress (no table configured)", progress=progress)
+        return
+    publisher.publish(progress)
+
+
+async def flush_progress():
+    """
+    Flush and release the current execution's publisher. Call before the final write of the run.
+    """
+    publisher = get_progress_publisher()
+    if publisher is None:
+        return
+    with _publishers_lock:
+        _publishers.pop((publisher.table_name, publisher.execution_id), None)
+    await publisher.flush()
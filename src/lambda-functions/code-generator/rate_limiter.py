@@ -0,0 +1,193 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from tracing import record_model_call
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+# Defaults per provider; every value can be overridden with <PROVIDER>_<SETTING> environment variables,
+# e.g. COMPLETIONS_MAX_IN_FLIGHT=6 or BEDROCK_TOKENS_PER_MINUTE=400000. A rate of 0 disables that bucket.
+SCHEDULER_DEFAULTS = {
+    'completions': {
+        'MAX_IN_FLIGHT': 4,
+        'REQUESTS_PER_MINUTE': 50,
+        'TOKENS_PER_MINUTE': 0,
+        'MAX_RETRIES': 6,
+    },
+    'bedrock': {
+        'MAX_IN_FLIGHT': 4,
+        'REQUESTS_PER_MINUTE': 0,
+        'TOKENS_PER_MINUTE': 0,
+        'MAX_RETRIES': 6,
+    },
+}
+
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+
+class RetryableModelError(Exception):
+    """
+    Raised by a model call that failed with a throttling (429) or transient server (5xx) error.
+
+    Args:
+        message (str): Error description.
+        retry_after (float, optional): Seconds the provider asked us to wait (Retry-After header).
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header given in seconds. HTTP-date values are ignored (None).
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(text):
+    """
+    Rough token estimate (~4 characters per token) used for tokens-per-minute accounting.
+    """
+    return len(text) // 4 if text else 0
+
+
+class TokenBucket:
+    """
+    Continuously refilling token bucket. Capacity equals one minute of budget.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.refill_per_second = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        """
+        Wait until `amount` tokens are available and take them. Requests larger than the
+        capacity are clamped so that they can still proceed once the bucket is full.
+        """
+        amount = min(float(amount), self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.refill_per_second)
+
+
+class ModelRequestScheduler:
+    """
+    Shared admission control for one model provider.
+
+    Bounds in-flight requests, paces them with requests- and tokens-per-minute buckets and
+    retries RetryableModelError with jittered backoff. A Retry-After pauses every caller.
+    """
+
+    def __init__(self, name, max_in_flight, requests_per_minute=0, tokens_per_minute=0, max_retries=6):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._cooldown_until = 0.0
+        self._loop = None
+        self._semaphore = None
+
+    def _bind_to_running_loop(self):
+        # asyncio primitives belong to one event loop; recreate them if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    def _backoff_delay(self, attempt, retry_after):
+        if retry_after is not None:
+            return retry_after + random.uniform(0, BASE_BACKOFF_SECONDS)
+        return random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt)))
+
+    async def run(self, call, estimated_tokens=0):
+        """
+        Run `call` (a zero-argument coroutine function) under the scheduler's limits.
+
+        Returns:
+            The result of `call`.
+
+        Raises:
+            RetryableModelError: When the provider is still throttling after max_retries retries.
+        """
+        self._bind_to_running_loop()
+        attempt = 0
+        started_at = time.monotonic()
+        call_seconds = 0.0
+        try:
+            while True:
+                cooldown = self._cooldown_until - time.monotonic()
+                if cooldown > 0:
+                    await asyncio.sleep(cooldown)
+
+                async with self._semaphore:
+                    if self.request_bucket:
+                        await self.request_bucket.acquire(1)
+                    if self.token_bucket and estimated_tokens:
+                        await self.token_bucket.acquire(estimated_tokens)
+                    call_started_at = time.monotonic()
+                    try:
+                        return await call()
+                    except RetryableModelError as e:
+                        if attempt >= self.max_retries:
+                            raise
+                        delay = self._backoff_delay(attempt, e.retry_after)
+                        if e.retry_after is not None:
+                            self._cooldown_until = max(self._cooldown_until, time.monotonic() + e.retry_after)
+                        log.warning("%s request throttled (%s); retry %d/%d in %.1fs", self.name, e, attempt + 1, self.max_retries, delay)
+                    finally:
+                        call_seconds += time.monotonic() - call_started_at
+
+                attempt += 1
+                await asyncio.sleep(delay)
+        finally:
+            record_model_call(
+                model_calls=1,
+                retries=attempt,
+                model_seconds=call_seconds,
+                queue_wait_seconds=time.monotonic() - started_at - call_seconds,
+            )
+
+
+def _setting(provider, name):
+    return int(os.environ.get(f'{provider.upper()}_{name}', SCHEDULER_DEFAULTS[provider][name]))
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider):
+    """
+    Return the process-wide scheduler for 'completions' or 'bedrock', creating it on first use.
+    """
+    with _schedulers_lock:
+        if provider not in _schedulers:
+            _schedulers[provider] = ModelRequestScheduler(
+                provider,
+                max_in_flight=_setting(provider, 'MAX_IN_FLIGHT'),
+                requests_per_minute=_setting(provider, 'REQUESTS_PER_MINUTE'),
+                tokens_per_minute=_setting(provider, 'TOKENS_PER_MINUTE'),
+                max_retries=_setting(provider, 'MAX_RETRIES'),
+            )
+        return _schedulers[provider]
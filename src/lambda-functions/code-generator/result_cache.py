@@ -0,0 +1,212 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from aws_clients import get_client
+from botocore.exceptions import ClientError
+from utils2_v2 import build_output_key
+from token_budget import DEFAULT_TOKEN_BUDGET_MODE
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+# Bump when a pipeline change makes previously cached artifacts stale
+CACHE_SCHEMA_VERSION = 1
+
+CACHE_PREFIX = 'cache/'
+DEFAULT_CACHE_TTL_SECONDS = 7 * 86400        # 7 days
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GiB
+
+# Deployment flags that switch the pipeline producing the artifact, with the defaults their readers use
+PIPELINE_FLAG_DEFAULTS = {
+    'FUSED_MODULE_STAGE': 'false',
+    'STAGING_GENERATOR': 'template',
+    'PROMPT_CACHING': 'true',
+    'TOKEN_BUDGET_MODE': DEFAULT_TOKEN_BUDGET_MODE,
+}
+
+
+def get_cache_ttl_seconds():
+    return int(os.environ.get('RESULT_CACHE_TTL_SECONDS', DEFAULT_CACHE_TTL_SECONDS))
+
+
+def get_cache_max_bytes():
+    return int(os.environ.get('RESULT_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES))
+
+
+def hash_prompt_configs(*prompt_dicts):
+    """
+    Hash the loaded prompt configurations so that any prompt edit invalidates the cache.
+    """
+    digest = hashlib.sha256()
+    for prompt_dict in prompt_dicts:
+        digest.update(json.dumps(prompt_dict or {}, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_pipeline_flags():
+    return {name: os.environ.get(name, default).strip().lower() for name, default in PIPELINE_FLAG_DEFAULTS.items()}
+
+
+def compute_result_cache_key(image_bytes, code_language, model_name, prompt_config_dict, stack_generation_prompt_dict):
+    """
+    Compute the content address of a code generation run. The pipeline deployment flags are part of
+    the key, so flipping one never serves an artifact built by the other pipeline.
+
+    :param image_bytes: bytes, raw bytes of the uploaded architecture diagram
+    :param code_language: str, target CDK language
+    :param model_name: str, model name loaded from model_name.yaml
+    :param prompt_config_dict: dict, prompts loaded from a2cai_prompts.yaml
+    :param stack_generation_prompt_dict: dict, prompts loaded from stack_gen_prompts.yaml
+    :return: str, hex SHA-256 cache key
+    """
+    key_material = {
+        'version': CACHE_SCHEMA_VERSION,
+        'image_sha256': hashlib.sha256(image_bytes).hexdigest(),
+        'code_language': code_language.lower(),
+        'model_name': (model_name or '').strip(),
+        'prompts_sha256': hash_prompt_configs(prompt_config_dict, stack_generation_prompt_dict),
+        'pipeline_flags': get_pipeline_flags(),
+    }
+    return hashlib.sha256(json.dumps(key_material, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _cache_object_key(cache_key):
+    return f'{CACHE_PREFIX}{cache_key}.zip'
+
+
+def _is_expired(last_modified, ttl_seconds):
+    age = (datetime.now(timezone.utc) - last_modified).total_seconds()
+    return age > ttl_seconds
+
+
+def lookup_cached_artifact(bucket_name, cache_key):
+    """
+    Look up a cached artifact in the results bucket.
+
+    Expired entries are deleted and reported as a miss. A hit is copied onto itself to refresh its
+    LastModified, so both the TTL and the size eviction count from the last use of an entry.
+
+    :param bucket_name: str, results bucket name
+    :param cache_key: str, key returned by compute_result_cache_key
+    :return: tuple (s3_key, artifact_name, execution_id) of the cached zip, or None on a miss;
+        execution_id is the run that produced it, None for entries stored without it
+    """
+    s3_client = get_client('s3')
+    object_key = _cache_object_key(cache_key)
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            log.error("Error reading result cache entry %s: %s", object_key, e)
+        return None
+
+    if _is_expired(head['LastModified'], get_cache_ttl_seconds()):
+        log.info("Result cache entry %s expired", object_key)
+        try:
+            s3_client.delete_object(Bucket=bucket_name, Key=object_key)
+        except ClientError as e:
+            log.error("Error deleting expired result cache entry %s: %s", object_key, e)
+        return None
+
+    metadata = head.get('Metadata', {})
+    artifact_name = metadata.get('artifact-name', os.path.basename(object_key))
+    log.info("Result cache hit: %s", object_key)
+    touch_cache_entry(bucket_name, object_key, metadata)
+    return object_key, artifact_name, metadata.get('execution-id')
+
+
+def touch_cache_entry(bucket_name, object_key, metadata):
+    """
+    Server-side copy of a cache entry onto itself, keeping its metadata, to mark it as recently used.
+    """
+    try:
+        get_client('s3').copy_object(
+            Bucket=bucket_name,
+            Key=object_key,
+            CopySource={'Bucket': bucket_name, 'Key': object_key},
+            Metadata=metadata,
+            MetadataDirective='REPLACE',
+        )
+    except ClientError as e:
+        log.error("Error refreshing result cache entry %s: %s", object_key, e)
+
+
+def copy_cached_artifact(bucket_name, cached_object_key, artifact_name):
+    """
+    Server-side copy of a cached artifact to a fresh output location.
+
+    :return: tuple (final_s3_path, s3_key), same shape as copy_file_to_s3
+    """
+    s3_key = build_output_key(artifact_name)
+    s3_client = get_client('s3')
+    s3_client.copy_object(
+        Bucket=bucket_name,
+        Key=s3_key,
+        CopySource={'Bucket': bucket_name, 'Key': cached_object_key},
+    )
+    final_s3_path = f's3://{bucket_name}/{s3_key}'
+    return final_s3_path, s3_key
+
+
+def store_uploaded_artifact_in_cache(bucket_name, s3_key, cache_key, execution_id=None):
+    """
+    Server-side copy of an artifact already uploaded to the results bucket into the result cache,
+    then evict entries over the TTL/size limits. The execution_id that produced the artifact is
+    kept with the entry, so a cache hit can take over its run manifest.
+    """
+    object_key = _cache_object_key(cache_key)
+    metadata = {'artifact-name': os.path.basename(s3_key)}
+    if execution_id:
+        metadata['execution-id'] = execution_id
+    try:
+        s3_client = get_client('s3')
+        s3_client.copy_object(
+            Bucket=bucket_name,
+            Key=object_key,
+            CopySource={'Bucket': bucket_name, 'Key': s3_key},
+            Metadata=metadata,
+            MetadataDirective='REPLACE',
+        )
+        log.info("Result cache entry stored: %s", object_key)
+        evict_cache_entries(bucket_name)
+    except ClientError as e:
+        log.error("Error storing result cache entry %s: %s", object_key, e)
+
+
+def evict_cache_entries(bucket_name, ttl_seconds=None, max_bytes=None):
+    """
+    Delete expired cache entries, then the least recently used entries until the cache fits in max_bytes.
+
+    :return: int, number of deleted entries
+    """
+    ttl_seconds = get_cache_ttl_seconds() if ttl_seconds is None else ttl_seconds
+    max_bytes = get_cache_max_bytes() if max_bytes is None else max_bytes
+
+    s3_client = get_client('s3')
+    paginator = s3_client.get_paginator('list_objects_v2')
+    entries = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=CACHE_PREFIX):
+        entries.extend(page.get('Contents', []))
+
+    to_delete = [entry for entry in entries if _is_expired(entry['LastModified'], ttl_seconds)]
+    remaining = sorted(
+        (entry for entry in entries if entry not in to_delete),
+        key=lambda entry: entry['LastModified'],
+    )
+    total_bytes = sum(entry['Size'] for entry in remaining)
+    while remaining and total_bytes > max_bytes:
+        oldest = remaining.pop(0)
+        total_bytes -= oldest['Size']
+        to_delete.append(oldest)
+
+    # delete_objects accepts at most 1000 keys per request
+    for i in range(0, len(to_delete), 1000):
+        batch = to_delete[i:i + 1000]
+        s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': entry['Key']} for entry in batch], 'Quiet': True},
+        )
+    if to_delete:
+        log.info("Evicted %d result cache entries", len(to_delete))
+    return len(to_delete)
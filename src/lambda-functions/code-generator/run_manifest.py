@@ -0,0 +1,287 @@
+import io
+import re
+import json
+import hashlib
+import zipfile
+from aws_clients import get_client
+from botocore.exceptions import ClientError
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+# Bump when the manifest layout changes; manifests of another version are not reused
+MANIFEST_SCHEMA_VERSION = 3
+
+MANIFEST_PREFIX = 'manifests/'
+
+# Execution ids become part of an S3 key
+EXECUTION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+
+def hash_module_prompt(module_prompt):
+    """
+    Hash of a module's prompt, which carries its name, description and target language.
+    """
+    return hashlib.sha256(module_prompt.encode('utf-8')).hexdigest()
+
+
+def _resource_name_key(name):
+    # Resource names are matched ignoring case and punctuation ("Orders Table" == "orders-table")
+    return re.sub(r'[^a-z0-9]', '', str(name).lower())
+
+
+def _normalize_setting(value):
+    # Settings are matched ignoring case, spacing and JSON type ("2" == 2) and, in lists, order
+    if isinstance(value, dict):
+        return {_resource_name_key(key): _normalize_setting(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return sorted((_normalize_setting(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+    return ' '.join(str(value).lower().split())
+
+
+def normalize_module_resources(resources):
+    """
+    Turn a module's 'Module Resources' entry into a sorted list of resources, so that the same
+    inventory compares equal whatever its order, case or spacing.
+
+    :param resources: list, {'type', 'name', 'configuration', 'connections'} objects as returned
+        by the modules description stage
+    :return: list, {'type', 'name', 'configuration', 'connections'} dicts; empty if the entry is
+        missing or malformed
+    """
+    if not isinstance(resources, list):
+        return []
+    normalized = {}
+    for resource in resources:
+        if not isinstance(resource, dict):
+            continue
+        configuration = resource.get('configuration')
+        connections = resource.get('connections')
+        entry = {
+            'type': str(resource.get('type', '')).strip().lower(),
+            'name': _resource_name_key(resource.get('name', '')),
+            'configuration': _normalize_setting(configuration) if isinstance(configuration, dict) else {},
+            'connections': sorted({_resource_name_key(name) for name in connections} if isinstance(connections, list) else set()),
+        }
+        if entry['type'] or entry['name']:
+            normalized[json.dumps(entry, sort_keys=True)] = entry
+    return [normalized[key] for key in sorted(normalized)]
+
+
+def _manifest_object_key(execution_id):
+    return f'{MANIFEST_PREFIX}{execution_id}.json'
+
+
+def build_run_manifest(execution_id, code_language, model_name, prompts_sha256, artifact_key, module_prompt_dict, module_files, stack_names, staging_file, resource_spec, module_resources=None):
+    """
+    Describe a finished execution so a later one can regenerate only what changed.
+
+    :param execution_id: str, the execution
+    :param code_language: str, target CDK language
+    :param model_name: str, completions model used for the module stacks
+    :param prompts_sha256: str, result_cache.hash_prompt_configs of the prompt configurations
+    :param artifact_key: str, results bucket key of the execution's zip
+    :param module_prompt_dict: dict, module name -> module prompt (generate_module_prompts)
+    :param module_files: dict, module name -> file name of its stack in the zip
+    :param stack_names: list, the deployment-ordered 'Module List'
+    :param staging_file: str, file name of the staging file in the zip
+    :param resource_spec: dict, the resource spec written to resource_spec.json
+    :param module_resources: dict, module name -> normalize_module_resources of its resources
+    :return: dict, the manifest
+    """
+    module_resources = module_resources or {}
+    return {
+        'version': MANIFEST_SCHEMA_VERSION,
+        'execution_id': execution_id,
+        'code_language': code_language.lower(),
+        'model_name': (model_name or '').strip(),
+        'prompts_sha256': prompts_sha256,
+        'artifact_key': artifact_key,
+        'modules': {
+            module_name: {
+                'description_sha256': hash_module_prompt(module_prompt),
+                'resources': module_resources.get(module_name, []),
+                'file': module_files[module_name],
+            }
+            for module_name, module_prompt in module_prompt_dict.items()
+        },
+        'stack_names': list(stack_names),
+        'staging_file': staging_file,
+        'resource_spec': resource_spec,
+    }
+
+
+def store_run_manifest(bucket_name, manifest):
+    """
+    Write the manifest to manifests/<execution_id>.json in the results bucket. Errors are logged.
+    """
+    object_key = _manifest_object_key(manifest['execution_id'])
+    try:
+        get_client('s3').put_object(Bucket=bucket_name, Key=object_key, Body=json.dumps(manifest).encode('utf-8'), ContentType='application/json')
+        log.info("Run manifest stored: %s", object_key)
+    except ClientError as e:
+        log.error("Error storing run manifest %s: %s", object_key, e)
+
+
+def copy_run_manifest(bucket_name, source_execution_id, execution_id, artifact_key):
+    """
+    Store the manifest of source_execution_id again for execution_id, whose artifact is a copy of
+    the source's at artifact_key (a result cache hit). Errors are logged.
+
+    :return: bool, whether the manifest was copied
+    """
+    source_key = _manifest_object_key(source_execution_id)
+    try:
+        response = get_client('s3').get_object(Bucket=bucket_name, Key=source_key)
+        manifest = json.loads(response['Body'].read())
+    except ClientError as e:
+        log.warning("No run manifest to copy from %s: %s", source_key, e)
+        return False
+    store_run_manifest(bucket_name, {**manifest, 'execution_id': execution_id, 'artifact_key': artifact_key})
+    return True
+
+
+def load_run_manifest(bucket_name, execution_id, code_language, model_name, prompts_sha256):
+    """
+    Load the manifest of a previous execution, if it can be reused by a run with these settings.
+
+    :return: dict, the manifest, or None if it is missing, unreadable or was produced with another
+        language, model, prompt configuration or manifest version
+    """
+    if not EXECUTION_ID_PATTERN.match(execution_id or ''):
+        log.warning("Ignoring invalid previous execution id", previous_execution_id=execution_id)
+        return None
+    object_key = _manifest_object_key(execution_id)
+    try:
+        response = get_client('s3').get_object(Bucket=bucket_name, Key=object_key)
+        manifest = json.loads(response['Body'].read())
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            log.error("Error reading run manifest %s: %s", object_key, e)
+        else:
+            log.info("No run manifest for previous execution", previous_execution_id=execution_id)
+        return None
+
+    expected = {
+        'version': MANIFEST_SCHEMA_VERSION,
+        'code_language': code_language.lower(),
+        'model_name': (model_name or '').strip(),
+        'prompts_sha256': prompts_sha256,
+    }
+    mismatched = sorted(field for field, value in expected.items() if manifest.get(field) != value)
+    if mismatched:
+        log.info("Previous execution was generated with different settings, regenerating everything",
+                 previous_execution_id=execution_id, mismatched=mismatched)
+        return None
+    return manifest
+
+
+class IncrementalPlan:
+    """
+    What a run can take over from a previous execution.
+
+    A module is reused when its resources, with their type, name, configuration and connections,
+    are the same in both runs. The model rewords module descriptions from one diagram to the next,
+    so the description is only compared for modules without a resource inventory. The resource
+    spec is not needed to plan, so changed modules can be generated while it is; reused modules
+    with a resource whose spec changed are moved to the changed ones with invalidate_resources().
+
+    Args:
+        manifest (dict): The previous execution's manifest.
+        module_prompt_dict (dict): Module name -> module prompt of the current run.
+        stack_names (list): The current run's deployment-ordered 'Module List'.
+        module_resources (dict, optional): Module name -> normalize_module_resources of the
+            current run.
+    """
+
+    def __init__(self, manifest, module_prompt_dict, stack_names, module_resources=None):
+        self.manifest = manifest
+        self.module_resources = module_resources or {}
+        previous_modules = manifest['modules']
+        # Module name -> file name in the previous artifact, for modules that are unchanged
+        self.reused_modules = {
+            module_name: previous_modules[module_name]['file']
+            for module_name, module_prompt in module_prompt_dict.items()
+            if module_name in previous_modules and self._unchanged(previous_modules[module_name], module_name, module_prompt)
+        }
+        self.changed_modules = [module_name for module_name in module_prompt_dict if module_name not in self.reused_modules]
+        self.removed_modules = [module_name for module_name in previous_modules if module_name not in module_prompt_dict]
+        self.module_set_changed = set(module_prompt_dict) != set(previous_modules) or list(stack_names) != manifest['stack_names']
+
+    def _unchanged(self, previous_module, module_name, module_prompt):
+        resources = self.module_resources.get(module_name)
+        if resources and previous_module.get('resources'):
+            return resources == previous_module['resources']
+        return previous_module['description_sha256'] == hash_module_prompt(module_prompt)
+
+    def invalidate_module(self, module_name):
+        """
+        Generate a reused module again after all.
+        """
+        del self.reused_modules[module_name]
+        self.changed_modules.append(module_name)
+
+    def invalidate_resources(self, changed_resources):
+        """
+        Generate again the reused modules that have one of the given resources.
+
+        :param changed_resources: list, names of resources added, removed or changed in the
+            resource spec since the previous execution (see diff_resource_specs)
+        :return: list, names of the invalidated modules
+        """
+        changed_resources = {_resource_name_key(name) for name in changed_resources}
+        invalidated = [
+            module_name for module_name in self.reused_modules
+            if any(resource['name'] in changed_resources for resource in self.module_resources.get(module_name, []))
+        ]
+        for module_name in invalidated:
+            self.invalidate_module(module_name)
+        return invalidated
+
+    @property
+    def reusable_files(self):
+        """
+        File names to copy out of the previous artifact: reused module stacks, plus the staging
+        file when the module set is unchanged.
+        """
+        files = list(self.reused_modules.values())
+        if not self.module_set_changed and self.manifest.get('staging_file'):
+            files.append(self.manifest['staging_file'])
+        return files
+
+
+def read_artifact_files(bucket_name, artifact_key, file_names):
+    """
+    Read files out of a previous execution's zip.
+
+    :return: dict, file name -> bytes for the files found in the archive; empty if the archive
+        cannot be read, in which case everything is regenerated
+    """
+    if not file_names:
+        return {}
+    try:
+        response = get_client('s3').get_object(Bucket=bucket_name, Key=artifact_key)
+        with zipfile.ZipFile(io.BytesIO(response['Body'].read())) as archive:
+            names = set(archive.namelist())
+            return {file_name: archive.read(file_name) for file_name in file_names if file_name in names}
+    except (ClientError, zipfile.BadZipFile) as e:
+        log.error("Error reading previous artifact %s: %s", artifact_key, e)
+        return {}
+
+
+def diff_resource_specs(previous_spec, resource_spec):
+    """
+    Compare two resource specs by resource (type, name).
+
+    :return: dict, 'added', 'removed' and 'changed' lists of resource names
+    """
+    def by_identity(spec):
+        resources = (spec or {}).get('resources') or []
+        return {(resource.get('type'), resource.get('name')): resource for resource in resources if isinstance(resource, dict)}
+
+    previous, current = by_identity(previous_spec), by_identity(resource_spec)
+    return {
+        'added': sorted(str(name) for _, name in current.keys() - previous.keys()),
+        'removed': sorted(str(name) for _, name in previous.keys() - current.keys()),
+        'changed': sorted(str(key[1]) for key, resource in current.items() if key in previous and previous[key] != resource),
+    }
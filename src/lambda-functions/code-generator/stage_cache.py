@@ -0,0 +1,236 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from aws_clients import get_client
+from botocore.exceptions import ClientError
+from execution_context import cache_bypassed
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_MEMORY_MAX_BYTES = 64 * 1024 * 1024      # 64 MiB of a 1024 MB Lambda
+DEFAULT_LOCAL_MAX_BYTES = 256 * 1024 * 1024      # half of the default /tmp
+DEFAULT_S3_MAX_BYTES = 1024 * 1024 * 1024        # 1 GiB
+DEFAULT_LOCAL_DIR = '/tmp/stage-cache'
+DEFAULT_S3_PREFIX = 'stage-cache/'
+
+
+def _key_token(value):
+    # Objects such as image_ingest.InlineImage stand in for large payloads with a digest
+    cache_token = getattr(value, 'cache_token', None)
+    if cache_token is None:
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    return cache_token()
+
+
+def make_stage_cache_key(provider, model, prompt, max_tokens, temperature):
+    """
+    Hash the inputs that determine a model response.
+
+    :param provider: str, model provider or endpoint (e.g. 'bedrock' or the completions URL)
+    :param model: str, model identifier
+    :param prompt: str, list or dict, full prompt / messages sent to the model
+    :param max_tokens: int, output token ceiling
+    :param temperature: float or None, sampling temperature
+    :return: str, hex SHA-256 key
+    """
+    key_material = json.dumps([provider, (model or '').strip(), prompt, max_tokens, temperature], sort_keys=True, default=_key_token)
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+
+class MemoryStageCacheBackend:
+    """
+    In-process LRU backend. Survives across warm Lambda invocations of the same container.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= len(previous)
+            self._entries[key] = value
+            self._total_bytes += len(value)
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+
+class LocalDirStageCacheBackend:
+    """
+    Local directory backend, one file per entry. Least recently read files are evicted first.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_LOCAL_DIR, max_bytes=DEFAULT_LOCAL_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+
+
+class S3StageCacheBackend:
+    """
+    S3 prefix backend, shared by every container. Oldest objects are evicted every evict_every writes.
+    """
+
+    def __init__(self, bucket_name, prefix=DEFAULT_S3_PREFIX, max_bytes=DEFAULT_S3_MAX_BYTES, evict_every=16):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        s3_client = get_client('s3')
+        try:
+            response = s3_client.get_object(Bucket=self.bucket_name, Key=self.prefix + key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                log.error("Error reading stage cache entry %s: %s", key, e)
+            return None
+        return response['Body'].read()
+
+    def put(self, key, value):
+        s3_client = get_client('s3')
+        s3_client.put_object(Bucket=self.bucket_name, Key=self.prefix + key, Body=value)
+        with self._lock:
+            self._puts += 1
+            should_evict = (self._puts - 1) % self.evict_every == 0
+        if should_evict:
+            self._evict(s3_client)
+
+    def _evict(self, s3_client):
+        paginator = s3_client.get_paginator('list_objects_v2')
+        entries = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.prefix):
+            entries.extend(page.get('Contents', []))
+        total_bytes = sum(entry['Size'] for entry in entries)
+        to_delete = []
+        for entry in sorted(entries, key=lambda entry: entry['LastModified']):
+            if total_bytes <= self.max_bytes:
+                break
+            to_delete.append({'Key': entry['Key']})
+            total_bytes -= entry['Size']
+        for i in range(0, len(to_delete), 1000):
+            s3_client.delete_objects(Bucket=self.bucket_name, Delete={'Objects': to_delete[i:i + 1000], 'Quiet': True})
+
+
+class StageCache:
+    """
+    Memoizes individual model calls. Reads are skipped on a cache bypass; writes are not.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, key):
+        if self.backend is None or cache_bypassed():
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            log.error("Error reading stage cache: %s", e)
+            return None
+        return value.decode('utf-8') if value is not None else None
+
+    def put(self, key, value):
+        if self.backend is None:
+            return
+        try:
+            self.backend.put(key, value.encode('utf-8'))
+        except Exception as e:
+            log.error("Error writing stage cache: %s", e)
+
+
+def create_stage_cache_backend():
+    """
+    Build the backend selected by STAGE_CACHE_BACKEND: 'memory' (default), 'local', 's3' or 'none'.
+    """
+    backend_name = os.environ.get('STAGE_CACHE_BACKEND', 'memory').lower()
+    max_bytes = os.environ.get('STAGE_CACHE_MAX_BYTES')
+
+    if backend_name == 'none':
+        return None
+    if backend_name == 'memory':
+        return MemoryStageCacheBackend(int(max_bytes or DEFAULT_MEMORY_MAX_BYTES))
+    if backend_name == 'local':
+        return LocalDirStageCacheBackend(os.environ.get('STAGE_CACHE_DIR', DEFAULT_LOCAL_DIR), int(max_bytes or DEFAULT_LOCAL_MAX_BYTES))
+    if backend_name == 's3':
+        s3_uri = os.environ.get('STAGE_CACHE_S3_URI') or f"s3://{os.environ['RESULTS_BUCKET_NAME']}/{DEFAULT_S3_PREFIX}"
+        parsed_url = urlparse(s3_uri)
+        prefix = parsed_url.path.lstrip('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        return S3StageCacheBackend(parsed_url.netloc, prefix, int(max_bytes or DEFAULT_S3_MAX_BYTES))
+    raise ValueError(f"Unsupported STAGE_CACHE_BACKEND '{backend_name}'. Use 'memory', 'local', 's3' or 'none'.")
+
+
+_stage_cache = None
+_stage_cache_lock = threading.Lock()
+
+
+def get_stage_cache():
+    """
+    Return the process-wide stage cache, creating it on first use.
+    """
+    global _stage_cache
+    if _stage_cache is None:
+        with _stage_cache_lock:
+            if _stage_cache is None:
+                _stage_cache = StageCache(create_stage_cache_backend())
+    return _stage_cache
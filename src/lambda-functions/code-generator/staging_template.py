@@ -0,0 +1,216 @@
+import os
+import re
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+PYTHON_STACK_CLASS_PATTERN = re.compile(r'^class\s+(\w+)\s*\(\s*(?:\w+\.)*Stack\s*\)', re.MULTILINE)
+TYPESCRIPT_STACK_CLASS_PATTERN = re.compile(r'export\s+class\s+(\w+)\s+extends\s+(?:\w+\.)*Stack\b')
+PYTHON_CONSTRUCTOR_PATTERN = re.compile(r'def\s+__init__\s*\((.*?)\)\s*(?:->[^:]*)?:', re.DOTALL)
+TYPESCRIPT_CONSTRUCTOR_PATTERN = re.compile(r'constructor\s*\((.*?)\)\s*\{', re.DOTALL)
+
+
+def derive_stack_class_name(module_name):
+    """
+    Stack class name the module prompt asks for, e.g. 'Web UI Module' -> 'WebUIStack'
+    """
+    words = re.sub(r'\bmodule\b', '', module_name, flags=re.IGNORECASE).split()
+    return ''.join(word[:1].upper() + word[1:] for word in re.findall(r'[A-Za-z0-9]+', ' '.join(words))) + 'Stack'
+
+
+def _split_parameters(parameters):
+    # Split on top-level commas only; annotations such as Dict[str, str] contain commas too
+    parts, depth, current = [], 0, ''
+    for char in parameters:
+        if char in '([{<':
+            depth += 1
+        elif char in ')]}>':
+            depth -= 1
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    parts.append(current.strip())
+    return [part for part in parts if part]
+
+
+def _requires_inputs(source, class_start, code_language):
+    """
+    Whether the stack class starting at class_start has constructor parameters without a default
+    beyond (scope, id), which the template cannot provide, or a constructor that can't take the
+    env the template passes.
+    """
+    if code_language.lower() == 'python':
+        match = PYTHON_CONSTRUCTOR_PATTERN.search(source, class_start)
+        if not match:
+            return False
+        extra = [parameter for parameter in _split_parameters(match.group(1))[3:] if parameter not in ('*', '/')]
+        accepts_env = any(parameter.startswith('**') or re.match(r'env\b', parameter) for parameter in extra)
+        return not accepts_env or any('=' not in parameter and not parameter.startswith('*') for parameter in extra)
+    match = TYPESCRIPT_CONSTRUCTOR_PATTERN.search(source, class_start)
+    if not match:
+        return False
+    extra = _split_parameters(match.group(1))[2:]
+    return not extra or any('=' not in parameter and '?' not in parameter.split(':')[0] for parameter in extra)
+
+
+def find_stack_class(code_file_path, code_language):
+    """
+    Read the CDK stack class of a generated module file.
+
+    Returns:
+        tuple: (class name or None if it can't be found, whether its constructor needs inputs
+        beyond scope and id)
+    """
+    pattern = PYTHON_STACK_CLASS_PATTERN if code_language.lower() == 'python' else TYPESCRIPT_STACK_CLASS_PATTERN
+    try:
+        with open(code_file_path, 'r') as f:
+            source = f.read()
+    except FileNotFoundError:
+        return None, False
+    match = pattern.search(source)
+    if not match:
+        return None, False
+    return match.group(1), _requires_inputs(source, match.end(), code_language)
+
+
+def _normalize_module_name(name):
+    name = re.sub(r'\b(module|stack)\b', '', name.lower())
+    return re.sub(r'[^a-z0-9]', '', name)
+
+
+def order_by_deployment_sequence(module_names, deployment_sequence):
+    """
+    Order module names by the deployment sequence ('Module List' with 'Module' replaced by 'Stack').
+    Modules missing from the sequence keep their original relative order at the end.
+    """
+    positions = {_normalize_module_name(name): index for index, name in enumerate(deployment_sequence)}
+    return sorted(module_names, key=lambda name: positions.get(_normalize_module_name(name), len(positions)))
+
+
+def _variable_name(class_name, code_language):
+    if code_language.lower() == 'python':
+        return re.sub(r'(?<!^)(?=[A-Z][a-z])', '_', class_name).lower()
+    return class_name[:1].lower() + class_name[1:]
+
+
+def render_staging_app(stacks, code_language):
+    """
+    Render the CDK app entry point for the given stacks.
+
+    Args:
+        stacks (list): (module file name without extension, stack class name) tuples in deployment order.
+            Class names defined by more than one module are imported under a numbered alias.
+        code_language (str): 'python' or 'typescript'.
+
+    Returns:
+        str: Source of app.py / app.ts. Stacks are instantiated in deployment order; no
+        dependencies are declared between them.
+    """
+    imports = []
+    seen = {}
+    for module_file, class_name in stacks:
+        seen[class_name] = seen.get(class_name, 0) + 1
+        alias = class_name if seen[class_name] == 1 else f'{class_name}{seen[class_name]}'
+        imports.append((module_file, class_name, alias))
+
+    if code_language.lower() == 'python':
+        lines = [
+            '#!/usr/bin/env python3',
+            'import os',
+            '',
+            'import aws_cdk as cdk',
+            '',
+        ]
+        lines += [
+            f'from {module_file} import {class_name}' + (f' as {alias}' if alias != class_name else '')
+            for module_file, class_name, alias in imports
+        ]
+        lines += [
+            '',
+            'app = cdk.App()',
+            '',
+            'env = cdk.Environment(',
+            '    account=os.environ.get("CDK_DEFAULT_ACCOUNT"),',
+            '    region=os.environ.get("CDK_DEFAULT_REGION"),',
+            ')',
+            '',
+            '# Stacks are instantiated in deployment order',
+        ]
+        for _, _, alias in imports:
+            lines.append(f'{_variable_name(alias, code_language)} = {alias}(app, "{alias}", env=env)')
+        lines += [
+            '',
+            'app.synth()',
+            '',
+        ]
+    elif code_language.lower() == 'typescript':
+        lines = [
+            '#!/usr/bin/env node',
+            "import * as cdk from 'aws-cdk-lib';",
+        ]
+        lines += [
+            f"import {{ {class_name}{f' as {alias}' if alias != class_name else ''} }} from './{module_file}';"
+            for module_file, class_name, alias in imports
+        ]
+        lines += [
+            '',
+            'const app = new cdk.App();',
+            '',
+            'const env = {',
+            '  account: process.env.CDK_DEFAULT_ACCOUNT,',
+            '  region: process.env.CDK_DEFAULT_REGION,',
+            '};',
+            '',
+            '// Stacks are instantiated in deployment order',
+        ]
+        for _, _, alias in imports:
+            lines.append(f"const {_variable_name(alias, code_language)} = new {alias}(app, '{alias}', {{ env }});")
+        lines += [
+            '',
+            'app.synth();',
+            '',
+        ]
+    else:
+        raise ValueError("Unsupported language. Use 'python' or 'typescript'.")
+    return '\n'.join(lines)
+
+
+def write_staging_app_file(module_names, module_filepaths, deployment_sequence, code_language, local_dir, stack_dirname):
+    """
+    Generate app.py / app.ts locally from the generated module files, without a model call.
+
+    Args:
+        module_names (list): Module names, in the same order as module_filepaths.
+        module_filepaths (list): Paths of the generated module stack files.
+        deployment_sequence (list): 'Module List' from the deployment sequence stage.
+        code_language (str): 'python' or 'typescript'.
+        local_dir (str): Working directory.
+        stack_dirname (str): Name of the generated stack directory.
+
+    Returns:
+        str: Path of the written staging file, or None if a stack's constructor needs inputs
+        (props, other stacks) the template cannot provide; use the LLM staging path then.
+    """
+    filepath_by_module = dict(zip(module_names, module_filepaths))
+    stacks = []
+    for module_name in order_by_deployment_sequence(module_names, deployment_sequence):
+        code_file_path = filepath_by_module[module_name]
+        class_name, requires_inputs = find_stack_class(code_file_path, code_language)
+        if requires_inputs:
+            log.info("Stack constructor needs inputs, staging file is not rendered from the template", module=module_name, stack=class_name)
+            return None
+        stacks.append((os.path.splitext(os.path.basename(code_file_path))[0], class_name or derive_stack_class_name(module_name)))
+
+    staging_code = render_staging_app(stacks, code_language)
+
+    makedirpath = os.path.join(local_dir, stack_dirname)
+    os.makedirs(makedirpath, exist_ok=True)
+    filename = 'app.py' if code_language.lower() == 'python' else 'app.ts'
+    code_file_path = os.path.join(makedirpath, filename)
+    with open(code_file_path, 'w') as f:
+        f.write(staging_code)
+
+    log.debug("Staging file written", path=code_file_path)
+    return code_file_path
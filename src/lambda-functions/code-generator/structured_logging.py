@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import gzip
+import zlib
+import logging
+import threading
+from datetime import datetime
+from execution_context import current_execution_id
+
+DEFAULT_LOG_LEVEL = 'INFO'
+# Prompts and model responses run to tens of KB; stdout only gets the head of each
+DEFAULT_MAX_PAYLOAD_CHARS = 1000
+DEFAULT_PAYLOAD_SAMPLE_RATE = 1.0
+# Transcripts are uploaded in parts so a long run never holds more than this in memory
+DEFAULT_TRANSCRIPT_PART_BYTES = 4 * 1024 * 1024
+TRANSCRIPT_PREFIX = 'transcripts/'
+# 'steps' keeps the model step outputs of every execution, 's3' every payload, 'off' nothing
+DEFAULT_LOG_TRANSCRIPTS = 'steps'
+
+ROOT_LOGGER_NAME = 'a2c'
+
+
+def payload_text(payload):
+    return payload if isinstance(payload, str) else json.dumps(payload, default=str)
+
+
+def truncate_payload(text, limit):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+def payload_sampled(execution_id):
+    """
+    Whether stdout records of this execution carry payloads (LOG_PAYLOAD_SAMPLE_RATE).
+
+    Decided per execution rather than per record, so a sampled execution has complete logs.
+    """
+    rate = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', DEFAULT_PAYLOAD_SAMPLE_RATE))
+    if rate >= 1:
+        return True
+    return zlib.crc32(execution_id.encode('utf-8')) % 10000 < rate * 10000
+
+
+class JsonLineFormatter(logging.Formatter):
+    """
+    One JSON object per record: timestamp, level, logger, message, executionId, structured
+    fields and, if present, the payload truncated to LOG_MAX_PAYLOAD_CHARS.
+    """
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        execution_id = getattr(record, 'execution_id', '')
+        if execution_id:
+            entry['executionId'] = execution_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if hasattr(record, 'payload'):
+            text = payload_text(record.payload)
+            entry['payloadChars'] = len(text)
+            entry['payload'] = truncate_payload(text, int(os.environ.get('LOG_MAX_PAYLOAD_CHARS', DEFAULT_MAX_PAYLOAD_CHARS)))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _StdoutHandler(logging.StreamHandler):
+    # Always write to the current sys.stdout, which tests and harnesses may redirect
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def _configure_root_logger():
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    if not root.handlers:
+        handler = _StdoutHandler()
+        handler.setFormatter(JsonLineFormatter())
+        root.addHandler(handler)
+        # The Lambda runtime's own root handler would print every record a second time
+        root.propagate = False
+    level = os.environ.get('LOG_LEVEL') or os.environ.get('AWS_LAMBDA_LOG_LEVEL') or DEFAULT_LOG_LEVEL
+    root.setLevel(level.upper())
+    return root
+
+
+class StructuredLogger:
+    """
+    Leveled logger writing JSON lines to stdout.
+
+    Messages are %-formatted only if the level is enabled, so pass values as arguments instead of
+    building f-strings: log.debug("Module %s done", name). Keyword arguments become fields of the
+    record. Large text (prompts, model responses) goes in `payload`, which is truncated on stdout
+    and, with LOG_TRANSCRIPTS=s3, written in full to the execution's transcript in S3. Model step
+    outputs logged with step_output() are kept in the transcript unless LOG_TRANSCRIPTS is 'off'.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._logger = logging.getLogger(name)
+
+    def is_enabled_for(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def debug(self, message, *args, **fields):
+        self._log(logging.DEBUG, message, args, **fields)
+
+    def info(self, message, *args, **fields):
+        self._log(logging.INFO, message, args, **fields)
+
+    def warning(self, message, *args, **fields):
+        self._log(logging.WARNING, message, args, **fields)
+
+    def error(self, message, *args, **fields):
+        self._log(logging.ERROR, message, args, **fields)
+
+    def exception(self, message, *args, **fields):
+        self._log(logging.ERROR, message, args, exc_info=True, **fields)
+
+    def step_output(self, module, step, text, **fields):
+        """
+        Log the output of a model step at debug level, keyed by module name and step number, and
+        keep it in the execution's transcript for replay and debugging.
+        """
+        self._log(logging.DEBUG, "Step response", (), payload=text, step_output=True, module=module, step=step, **fields)
+
+    def _log(self, level, message, args, payload=None, exc_info=None, step_output=False, **fields):
+        execution_id = current_execution_id()
+        if payload is not None:
+            transcript = get_transcript(execution_id, step_output)
+            if transcript is not None:
+                transcript.append(self.name, message % args if args else message, payload, fields)
+        if not self._logger.isEnabledFor(level):
+            return
+        extra = {'fields': fields, 'execution_id': execution_id}
+        if payload is not None and payload_sampled(execution_id):
+            extra['payload'] = payload
+        self._logger.log(level, message, *args, exc_info=exc_info, extra=extra)
+
+
+def get_logger(name):
+    """
+    Return the structured logger for a module, e.g. log = get_logger(__name__).
+    """
+    return StructuredLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+class TranscriptBuffer:
+    """
+    Full payloads of one execution, gzipped JSONL in the results bucket under
+    transcripts/<execution_id>/.
+
+    Records are kept in memory; whenever LOG_TRANSCRIPT_PART_BYTES accumulate, a part is
+    compressed and uploaded on the AWS I/O executor while the pipeline continues. close()
+    uploads the rest and waits for all parts.
+    """
+
+    def __init__(self, bucket_name, execution_id, part_bytes=None):
+        self.bucket_name = bucket_name
+        self.execution_id = execution_id or 'unknown'
+        self.part_bytes = part_bytes or int(os.environ.get('LOG_TRANSCRIPT_PART_BYTES', DEFAULT_TRANSCRIPT_PART_BYTES))
+        self.started = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self._lock = threading.Lock()
+        self._lines = []
+        self._size = 0
+        self._parts = 0
+        self._uploads = []
+
+    def append(self, logger_name, message, payload, fields):
+        line = json.dumps({
+            'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+            'logger': logger_name,
+            'message': message,
+            **fields,
+            'payload': payload,
+        }, default=str)
+        with self._lock:
+            self._lines.append(line)
+            self._size += len(line) + 1
+            if self._size < self.part_bytes:
+                return
+            lines, part = self._take_part()
+        from aws_async import get_aws_io_executor
+        upload = get_aws_io_executor().submit(self._upload, lines, part)
+        with self._lock:
+            self._uploads.append(upload)
+
+    def _take_part(self):
+        lines, self._lines, self._size = self._lines, [], 0
+        self._parts += 1
+        return lines, self._parts
+
+    def _upload(self, lines, part):
+        from aws_clients import get_client
+        body = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), compresslevel=6)
+        key = f"{TRANSCRIPT_PREFIX}{self.execution_id}/{self.started}-part-{part:04d}.jsonl.gz"
+        get_client('s3').put_object(Bucket=self.bucket_name, Key=key, Body=body, ContentType='application/x-ndjson', ContentEncoding='gzip')
+        return key
+
+    def close(self):
+        """
+        Upload the remaining records and wait for every part. Blocking; returns the uploaded keys.
+        """
+        with self._lock:
+            uploads = list(self._uploads)
+            remaining = self._take_part() if self._lines else None
+        keys = [upload.result() for upload in uploads]
+        if remaining:
+            keys.append(self._upload(*remaining))
+        return keys
+
+
+_transcripts = {}
+_transcripts_lock = threading.Lock()
+
+
+def get_transcript(execution_id, step_output=False):
+    """
+    Return the execution's transcript buffer, or None if LOG_TRANSCRIPTS doesn't keep the record:
+    'steps' (the default) keeps step outputs only, 's3' every payload. The bucket is
+    LOG_TRANSCRIPT_BUCKET, defaulting to the results bucket.
+    """
+    mode = os.environ.get('LOG_TRANSCRIPTS', DEFAULT_LOG_TRANSCRIPTS).lower()
+    if mode != 's3' and not (mode == 'steps' and step_output):
+        return None
+    bucket_name = os.environ.get('LOG_TRANSCRIPT_BUCKET') or os.environ.get('RESULTS_BUCKET_NAME')
+    if not bucket_name:
+        return None
+    with _transcripts_lock:
+        transcript = _transcripts.get(execution_id)
+        if transcript is None:
+            transcript = _transcripts[execution_id] = TranscriptBuffer(bucket_name, execution_id)
+        return transcript
+
+
+async def flush_transcript(execution_id=None):
+    """
+    Finish the execution's transcript: upload what is buffered and wait for all parts.
+    Errors are logged, never raised.
+    """
+    from aws_async import run_blocking
+    execution_id = current_execution_id() if execution_id is None else execution_id
+    with _transcripts_lock:
+        transcript = _transcripts.pop(execution_id, None)
+    if transcript is None:
+        return []
+    try:
+        keys = await run_blocking(transcript.close)
+        log.info("Transcript uploaded", parts=len(keys), bucket=transcript.bucket_name, keys=keys)
+        return keys
+    except Exception as e:
+        log.error("Error uploading transcript: %s", e)
+        return []
+
+
+_configure_root_logger()
+log = get_logger(__name__)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The Lambda modules live flat in the function directory (see Dockerfile)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
@@ -0,0 +1,100 @@
+import asyncio
+import io
+import os
+import zipfile
+
+import pytest
+
+import a2cai_code_generator_main as main
+import artifact_writer
+from artifact_writer import ArtifactWriter
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.calls.append('put_object')
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.calls.append('create_multipart_upload')
+        upload_id = f'upload-{len(self.uploads) + 1}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append('upload_part')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append('complete_multipart_upload')
+        parts = self.uploads.pop(UploadId)
+        assert [part['PartNumber'] for part in MultipartUpload['Parts']] == sorted(parts)
+        self.objects[Key] = b''.join(parts[number] for number in sorted(parts))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append('abort_multipart_upload')
+        del self.uploads[UploadId]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    # Small parts so a few files span several of them
+    monkeypatch.setattr(artifact_writer, 'MIN_PART_SIZE', 1024)
+    return FakeS3()
+
+
+def test_parts_reassemble_into_a_valid_zip(s3):
+    files = {f'stack/module_{index}.py': os.urandom(1500) for index in range(4)}
+    writer = ArtifactWriter('results', compression_level=0, part_size=1024, s3_client=s3)
+    writer.open('stack.zip', s3_key='output/stack.zip')
+    for arcname, data in files.items():
+        writer.add_bytes(arcname, data)
+    writer.add_bytes('stack/module_0.py', b'duplicate')
+
+    assert writer.close() == ('s3://results/output/stack.zip', 'output/stack.zip')
+    assert s3.calls.count('upload_part') > 4
+    with zipfile.ZipFile(io.BytesIO(s3.objects['output/stack.zip'])) as archive:
+        assert archive.testzip() is None
+        assert {name: archive.read(name) for name in archive.namelist()} == files
+
+    small = ArtifactWriter('results', part_size=1024, s3_client=s3)
+    small.open('small.zip', s3_key='output/small.zip')
+    small.add_bytes('app.py', b'app = App()')
+    small.close()
+    assert s3.calls[-1] == 'put_object'
+    assert zipfile.ZipFile(io.BytesIO(s3.objects['output/small.zip'])).read('app.py') == b'app = App()'
+
+
+def test_failed_generation_aborts_the_upload(s3, monkeypatch):
+    writers = []
+
+    class Writer(ArtifactWriter):
+        def __init__(self, bucket_name):
+            super().__init__(bucket_name, compression_level=0, part_size=1024, s3_client=s3)
+            writers.append(self)
+
+    async def a2c_ai_do_it_all(*args, artifact_writer, **kwargs):
+        artifact_writer.open('stack.zip', s3_key='output/stack.zip')
+        artifact_writer.add_bytes('stack/module.py', os.urandom(4096))
+        raise RuntimeError('model unavailable')
+
+    monkeypatch.setenv('RESULTS_BUCKET_NAME', 'results')
+    monkeypatch.setattr(main, 'read_s3_object', lambda s3_uri: b'diagram')
+    monkeypatch.setattr(main, 'compute_result_cache_key', lambda *args: None)
+    monkeypatch.setattr(main, 'ArtifactWriter', Writer)
+    monkeypatch.setattr(main, 'a2c_ai_do_it_all', a2c_ai_do_it_all)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.generate_code({'file_path': 's3://diagrams/a.png', 'code_language': 'python'}, 'key', ({}, {}, 'model')))
+
+    assert s3.calls[-1] == 'abort_multipart_upload'
+    assert s3.uploads == {} and s3.objects == {}
+    # Aborting again (or after close) is a no-op
+    writers[0].abort()
+    assert s3.calls.count('abort_multipart_upload') == 1
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import progress_publisher
+import utils2_v2
+from aws_async import run_blocking
+
+SLOW_CALL_SECONDS = 0.5
+TICK_SECONDS = 0.01
+# Generous bound for a loaded CI host; a blocked loop would stall for the full slow call
+MAX_ALLOWED_STALL_SECONDS = 0.2
+
+
+async def measure_max_stall(awaitable):
+    """
+    Await `awaitable` while a ticker coroutine records the longest gap between its wake-ups.
+    """
+    max_stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal max_stall
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(TICK_SECONDS)
+            now = time.perf_counter()
+            max_stall = max(max_stall, now - last - TICK_SECONDS)
+            last = now
+
+    ticker_task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0)
+    try:
+        result = await awaitable
+    finally:
+        done = True
+        await ticker_task
+    return result, max_stall
+
+
+def test_run_blocking_keeps_event_loop_responsive():
+    def slow_call(value):
+        time.sleep(SLOW_CALL_SECONDS)
+        return value * 2
+
+    result, max_stall = asyncio.run(measure_max_stall(run_blocking(slow_call, 21)))
+
+    assert result == 42
+    assert max_stall < MAX_ALLOWED_STALL_SECONDS
+
+
+def test_run_blocking_propagates_exceptions():
+    def failing_call():
+        raise RuntimeError('boom')
+
+    async def scenario():
+        try:
+            await run_blocking(failing_call)
+        except RuntimeError as e:
+            return str(e)
+
+    assert asyncio.run(scenario()) == 'boom'
+
+
+def test_send_progress_update_does_not_block_event_loop(monkeypatch):
+    updates = []
+
+    class SlowTable:
+        def update_item(self, **kwargs):
+            time.sleep(SLOW_CALL_SECONDS)
+            updates.append(kwargs)
+
+    class SlowDynamoDB:
+        def Table(self, name):
+            return SlowTable()
+
+    monkeypatch.setenv('SYNTHESIS_PROGRESS_TABLE', 'progress-table')
+    monkeypatch.setenv('_EXECUTION_ID', 'execution-1')
+    monkeypatch.setattr(progress_publisher, 'get_resource', lambda *args, **kwargs: SlowDynamoDB())
+
+    async def scenario():
+        await utils2_v2.send_progress_update(40)
+        await progress_publisher.flush_progress()
+
+    _, max_stall = asyncio.run(measure_max_stall(scenario()))
+
+    assert max_stall < MAX_ALLOWED_STALL_SECONDS
+    assert updates[0]['Key'] == {'executionId': 'execution-1'}
+    assert updates[0]['ExpressionAttributeValues'][':p'] == 40
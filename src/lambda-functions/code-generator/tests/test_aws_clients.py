@@ -0,0 +1,42 @@
+import threading
+
+import aws_clients
+
+
+def test_get_client_reuses_one_client_per_service_and_region():
+    aws_clients.reset_clients()
+
+    s3_client = aws_clients.get_client('s3')
+
+    assert aws_clients.get_client('s3') is s3_client
+    assert aws_clients.get_client('s3', region_name='eu-west-1') is not s3_client
+    assert s3_client.meta.config.tcp_keepalive is True
+    assert s3_client.meta.config.max_pool_connections == aws_clients.DEFAULT_MAX_POOL_CONNECTIONS
+
+
+def test_get_resource_keeps_one_resource_per_thread():
+    aws_clients.reset_clients()
+    resources = []
+
+    def create_resources():
+        resources.append((aws_clients.get_resource('dynamodb'), aws_clients.get_resource('dynamodb')))
+
+    threads = [threading.Thread(target=create_resources) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    (first, first_again), (second, _) = resources
+    assert first is first_again
+    assert first is not second
+
+
+def test_reset_clients_drops_cached_clients():
+    s3_client = aws_clients.get_client('s3')
+    dynamodb = aws_clients.get_resource('dynamodb')
+
+    aws_clients.reset_clients()
+
+    assert aws_clients.get_client('s3') is not s3_client
+    assert aws_clients.get_resource('dynamodb') is not dynamodb
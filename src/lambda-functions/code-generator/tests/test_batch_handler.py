@@ -0,0 +1,73 @@
+import asyncio
+
+import a2cai_code_generator_main as main
+from aws_async import run_blocking
+from execution_context import current_execution_id, cache_bypassed
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def run_batch(monkeypatch, event, generate_code, context=None):
+    failures = []
+
+    async def send_failure_notification(message):
+        failures.append((current_execution_id(), message))
+
+    async def no_transcript(execution_id=None):
+        return []
+
+    monkeypatch.setattr(main, 'get_api_key_from_secrets', lambda: 'key')
+    monkeypatch.setattr(main, 'load_generation_config', lambda: ({}, {}, 'model'))
+    monkeypatch.setattr(main, 'generate_code', generate_code)
+    monkeypatch.setattr(main, 'send_failure_notification', send_failure_notification)
+    monkeypatch.setattr(main, 'flush_transcript', no_transcript)
+    monkeypatch.setattr(main, 'finish_trace', lambda trace: None)
+    return asyncio.run(main.async_batch_handler(event, context)), failures
+
+
+def test_jobs_run_concurrently_each_in_its_own_execution(monkeypatch):
+    monkeypatch.setenv('BATCH_MAX_CONCURRENT_JOBS', '2')
+    running, seen = [], []
+
+    async def generate_code(job, api_key, config):
+        running.append(job['execution_id'])
+        await asyncio.sleep(0.02)
+        # Still this job's execution after other jobs ran, also on the AWS I/O threads
+        seen.append((job['execution_id'], current_execution_id(), await run_blocking(current_execution_id), cache_bypassed()))
+        max_running.append(len(running))
+        running.remove(job['execution_id'])
+        if job['file_path'].endswith('broken.png'):
+            raise ValueError('unreadable diagram')
+        return {'presigned_url': f"https://results/{job['execution_id']}.zip"}
+
+    max_running = []
+    event = {
+        'execution_id': 'batch-1',
+        'bypass_cache': True,
+        'jobs': ['s3://diagrams/a.png', {'file_path': 's3://diagrams/b.png', 'code_language': 'typescript'}, 's3://diagrams/broken.png'],
+    }
+    summary, failures = run_batch(monkeypatch, event, generate_code)
+
+    assert [(result['execution_id'], result['status']) for result in summary['results']] == [
+        ('batch-1-0000', 'succeeded'), ('batch-1-0001', 'succeeded'), ('batch-1-0002', 'failed')]
+    assert all(job == bound == threaded and bypass for job, bound, threaded, bypass in seen)
+    assert max(max_running) == 2
+    assert failures == [('batch-1-0002', 'unreadable diagram')]
+    assert (summary['jobs'], summary['succeeded'], summary['failed'], summary['skipped']) == (3, 2, 1, 0)
+    assert summary['jobsPerMinute'] > 0
+
+
+def test_jobs_are_skipped_close_to_the_timeout(monkeypatch):
+    async def generate_code(job, api_key, config):
+        raise AssertionError('no job should start')
+
+    summary, _ = run_batch(monkeypatch, {'jobs': ['s3://diagrams/a.png']}, generate_code, context=Context(remaining_ms=1000))
+
+    assert summary['skipped'] == 1
+    assert summary['results'][0]['status'] == 'skipped'
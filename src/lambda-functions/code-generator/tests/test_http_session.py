@@ -0,0 +1,58 @@
+import asyncio
+
+import http_session
+from aws_async import cancel_pending_tasks, get_persistent_event_loop
+
+
+def test_session_is_shared_across_runs_on_the_persistent_loop():
+    loop = get_persistent_event_loop()
+
+    first = loop.run_until_complete(http_session.get_http_session())
+    second = loop.run_until_complete(http_session.get_http_session())
+
+    assert get_persistent_event_loop() is loop
+    assert first is second
+    loop.run_until_complete(http_session.reset_http_session())
+
+
+def test_reset_replaces_a_broken_session():
+    loop = get_persistent_event_loop()
+    session = loop.run_until_complete(http_session.get_http_session())
+
+    loop.run_until_complete(http_session.reset_http_session())
+    replacement = loop.run_until_complete(http_session.get_http_session())
+
+    assert session.closed
+    assert replacement is not session
+    loop.run_until_complete(http_session.reset_http_session())
+
+
+def test_session_from_another_loop_is_not_reused():
+    loop = get_persistent_event_loop()
+    session = loop.run_until_complete(http_session.get_http_session())
+
+    other_loop = asyncio.new_event_loop()
+    try:
+        other_session = other_loop.run_until_complete(http_session.get_http_session())
+        assert other_session is not session
+        other_loop.run_until_complete(http_session.reset_http_session())
+    finally:
+        other_loop.close()
+    loop.run_until_complete(session.close())
+
+
+def test_cancel_pending_tasks_reaps_leftovers_of_a_failed_run():
+    loop = get_persistent_event_loop()
+    leftover = loop.create_task(asyncio.sleep(60))
+
+    async def failing_invocation():
+        await asyncio.sleep(0)
+        raise RuntimeError('boom')
+
+    try:
+        loop.run_until_complete(failing_invocation())
+    except RuntimeError:
+        pass
+    cancel_pending_tasks(loop)
+
+    assert leftover.cancelled()
@@ -0,0 +1,28 @@
+import base64
+import json
+
+import image_ingest
+from image_ingest import InlineImage, serialize_request_body
+
+
+def request_body(image):
+    return {
+        'anthropic_version': 'bedrock-2023-05-31',
+        'max_tokens': 2048,
+        'messages': [{'role': 'user', 'content': [
+            {'type': 'image', 'source': {'type': 'base64', 'media_type': 'image/png', 'data': image}},
+            {'type': 'text', 'text': 'Describe the "diagram" → in detail'},
+        ]}],
+    }
+
+
+def test_inline_images_serialize_byte_identical_to_a_base64_string(monkeypatch):
+    # Small chunks so the image is encoded across several chunk boundaries
+    monkeypatch.setattr(image_ingest, 'ENCODE_CHUNK_BYTES', 3 * 4)
+    for size in (0, 1, 2, 3, 50, 1001):
+        image_bytes = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+        expected = json.dumps(request_body(base64.b64encode(image_bytes).decode('utf-8'))).encode('utf-8')
+
+        assert bytes(serialize_request_body(request_body(InlineImage(image_bytes)))) == expected
+
+    assert InlineImage(b'12345').encoded_length() == len(base64.b64encode(b'12345'))
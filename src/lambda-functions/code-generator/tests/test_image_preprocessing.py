@@ -0,0 +1,58 @@
+import io
+import random
+
+from PIL import Image
+
+from image_preprocessing import normalize_image
+
+
+def encode(image, format='PNG'):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def noisy_image(size, seed=1):
+    # More colours than a 256-colour palette can hold
+    rng = random.Random(seed)
+    image = Image.new('RGB', size)
+    image.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(size[0] * size[1])])
+    return image
+
+
+def decode(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return image.convert('RGB')
+
+
+def test_large_diagrams_are_resized_to_the_long_edge_and_pixel_limits():
+    wide = normalize_image(encode(Image.new('RGB', (4000, 1000), 'white')), max_long_edge=1568, max_pixels=1_150_000)
+    square = normalize_image(encode(Image.new('RGBA', (2000, 2000), (0, 0, 0, 0))), max_long_edge=1568, max_pixels=1_150_000)
+
+    assert (wide['original_size'], wide['size']) == ((4000, 1000), (1568, 392))
+    assert square['size'] == (1072, 1072)
+    assert decode(square['data']).getpixel((0, 0)) == (255, 255, 255)
+
+
+def test_images_within_the_limits_are_only_re_encoded_losslessly():
+    image = noisy_image((64, 64))
+    original = encode(image)
+
+    result = normalize_image(original, encodings=['png', 'webp', 'jpeg'])
+
+    assert result['size'] == (64, 64)
+    assert result['media_type'] in ('image/png', 'image/webp')
+    assert decode(result['data']).tobytes() == image.tobytes()
+
+    # Lossy encodings are used once the lossless ones exceed the size limit
+    limited = normalize_image(original, encodings=['png', 'jpeg'], max_image_bytes=len(original) // 2)
+    assert limited['encoded_bytes'] < len(original)
+
+
+def test_undecodable_input_is_passed_through_unmodified():
+    for data in (b'not an image', b'\x89PNG\r\n\x1a\n' + b'\x00' * 32):
+        result = normalize_image(data)
+
+        assert result['data'] == data
+        assert result['media_type'] == 'image/png'
+        assert result['size'] is None
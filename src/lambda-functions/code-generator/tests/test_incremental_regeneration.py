@@ -0,0 +1,201 @@
+import asyncio
+import contextvars
+import io
+import json
+import os
+import re
+import zipfile
+
+import pytest
+from botocore.exceptions import ClientError
+
+import a2cai_v2
+import code_generator_utils_v2
+import run_manifest
+from a2cai_v2 import a2c_ai_do_it_all
+from artifact_writer import ArtifactWriter
+from execution_context import set_execution
+from utils2_v2 import load_stack_generation_prompts, load_yaml_data
+
+CODE_GENERATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What the model makes of each diagram: the first edit adds a queue to the data module, and the
+# networking module is described in other words but has the same resources; the second edit
+# only changes the number of subnets of the VPC
+DIAGRAMS = {
+    b'diagram v1': {
+        'Networking Module': ('A VPC with two private subnets.', [('AWS::EC2::VPC', 'AppVpc', {'private_subnets': 2}, [])]),
+        'Data Module': ('An S3 bucket for uploads.', [('AWS::S3::Bucket', 'UploadBucket', {}, [])]),
+    },
+    b'diagram v2': {
+        'Networking Module': ('Networking: one VPC that has two private subnets.', [('AWS::EC2::VPC', 'App VPC', {'Private Subnets': '2'}, [])]),
+        'Data Module': ('An S3 bucket for uploads and an SQS queue.', [('AWS::S3::Bucket', 'UploadBucket', {}, ['JobsQueue']),
+                                                                      ('AWS::SQS::Queue', 'JobsQueue', {}, [])]),
+    },
+    b'diagram v3': {
+        'Networking Module': ('Networking: one VPC that has four private subnets.', [('AWS::EC2::VPC', 'App VPC', {'Private Subnets': '4'}, [])]),
+        'Data Module': ('An S3 bucket for uploads and an SQS queue.', [('AWS::S3::Bucket', 'UploadBucket', {}, ['JobsQueue']),
+                                                                      ('AWS::SQS::Queue', 'JobsQueue', {}, [])]),
+    },
+}
+
+# Resource spec of each diagram; the second edit also changes the spec of the queue
+RESOURCE_SPECS = {
+    b'diagram v3': [{'type': 'AWS::SQS::Queue', 'name': 'JobsQueue', 'consumers': ['Worker']}],
+}
+
+CODE = '```python\nfrom aws_cdk import Stack\n\n\nclass {name}Stack(Stack):\n    def __init__(self, scope, construct_id, **kwargs):\n        super().__init__(scope, construct_id, **kwargs)\n```'
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+
+class FakeModels:
+    """
+    Bedrock and completions stand-ins; the completions side records which modules were generated.
+    """
+
+    def __init__(self, prompts):
+        self.prompts = prompts
+        self.diagram = None
+        self.modules = None
+        self.generated = []
+        self.module_started = None
+        self.spec_overlapped_modules = []
+
+    async def invoke_bedrock_model(self, request_body, modelId=None, budget=None):
+        content = request_body['messages'][0]['content']
+        text = ''.join(block.get('text', '') for block in content)
+        images = [block['source']['data'].data for block in content if block['type'] == 'image']
+        if images:
+            self.diagram = bytes(images[0])
+            self.modules = DIAGRAMS[self.diagram]
+            self.module_started = asyncio.Event()
+            answer = ' '.join(f'{name}: {description}' for name, (description, _) in self.modules.items())
+        elif text.startswith(self.prompts['resource_spec_prompt']):
+            # The spec is only answered once module generation has started, unless that waits for it
+            try:
+                await asyncio.wait_for(self.module_started.wait(), 2)
+                self.spec_overlapped_modules.append(True)
+            except asyncio.TimeoutError:
+                self.spec_overlapped_modules.append(False)
+            except asyncio.CancelledError:
+                self.spec_overlapped_modules.append('cancelled')
+                raise
+            answer = json.dumps({'resources': RESOURCE_SPECS.get(self.diagram, [])})
+        else:
+            modules_description = {'use case description': 'File uploads'}
+            modules_description.update({name: description for name, (description, _) in self.modules.items()})
+            modules_description['Module Resources'] = {
+                name: [{'type': resource_type, 'name': resource_name, 'configuration': configuration, 'connections': connections}
+                       for resource_type, resource_name, configuration, connections in resources]
+                for name, (_, resources) in self.modules.items()
+            }
+            modules_description['Module List'] = [name.replace('Module', 'Stack') for name in self.modules]
+            answer = json.dumps(modules_description)
+        return {'content': [{'type': 'text', 'text': answer}], 'stop_reason': 'end_turn'}
+
+    async def get_ai_response(self, session, api_key, role, prompt, model, base_url=None, on_chunk=None, budget=None):
+        # Every step answers with the module's stack, so the module can be read from any step's prompt
+        module_name = re.search(r"module name '(\w+) Module'|class (\w+)Stack", prompt)
+        name = module_name.group(1) or module_name.group(2)
+        if "module name '" in prompt:
+            self.generated.append(f'{name} Module')
+            self.module_started.set()
+        response = CODE.format(name=name)
+        if on_chunk:
+            on_chunk(response)
+        return response
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    s3 = FakeS3()
+    prompts = load_yaml_data(os.path.join(CODE_GENERATOR_DIR, 'a2cai_prompts.yaml'))
+    stack_prompts = load_stack_generation_prompts(os.path.join(CODE_GENERATOR_DIR, 'stack_gen_prompts.yaml'))
+    models = FakeModels(prompts)
+
+    async def no_session():
+        return None
+
+    monkeypatch.setenv('MODEL_STREAMING', 'false')
+    monkeypatch.setenv('STAGING_GENERATOR', 'template')
+    monkeypatch.delenv('FUSED_MODULE_STAGE', raising=False)
+    monkeypatch.delenv('SYNTHESIS_PROGRESS_TABLE', raising=False)
+    monkeypatch.setattr(a2cai_v2, 'invoke_bedrock_model', models.invoke_bedrock_model)
+    monkeypatch.setattr(a2cai_v2, 'get_http_session', no_session)
+    monkeypatch.setattr(code_generator_utils_v2, 'get_ai_response', models.get_ai_response)
+    monkeypatch.setattr(run_manifest, 'get_client', lambda service_name: s3)
+
+    def generate(execution_id, diagram, previous_execution_id=None):
+        set_execution(execution_id, bypass_cache=True)
+        writer = ArtifactWriter('results', s3_client=s3)
+        return a2c_ai_do_it_all(f's3://diagrams/{execution_id}.png', str(tmp_path), 'python', prompts, stack_prompts, 'key', 'model',
+                                image_bytes=diagram, artifact_writer=writer, previous_execution_id=previous_execution_id)
+
+    def run(execution_id, diagram, previous_execution_id=None):
+        models.generated = []
+        models.spec_overlapped_modules = []
+        contextvars.copy_context().run(lambda: asyncio.run(generate(execution_id, diagram, previous_execution_id)))
+        manifest = json.loads(s3.objects[f'manifests/{execution_id}.json'])
+        with zipfile.ZipFile(io.BytesIO(s3.objects[manifest['artifact_key']])) as archive:
+            manifest['archive'] = sorted(archive.namelist())
+        assert models.spec_overlapped_modules == [True]
+        return sorted(models.generated), manifest
+
+    run.generate = generate
+    run.models = models
+    return run
+
+
+def test_edited_diagram_regenerates_only_the_modules_whose_resources_changed(pipeline):
+    generated, first_manifest = pipeline('exec-1', b'diagram v1')
+    assert generated == ['Data Module', 'Networking Module']
+
+    generated, manifest = pipeline('exec-2', b'diagram v2', previous_execution_id='exec-1')
+
+    assert generated == ['Data Module']
+    assert manifest['modules']['Networking Module']['file'] == first_manifest['modules']['Networking Module']['file']
+    assert manifest['archive'] == first_manifest['archive']
+    assert manifest['modules']['Data Module']['resources'] == [
+        {'type': 'aws::s3::bucket', 'name': 'uploadbucket', 'configuration': {}, 'connections': ['jobsqueue']},
+        {'type': 'aws::sqs::queue', 'name': 'jobsqueue', 'configuration': {}, 'connections': []},
+    ]
+
+    # A configuration change keeps the resource names and types, but the module is regenerated;
+    # the data module is unchanged, but regenerated because the spec of its queue changed
+    generated, _ = pipeline('exec-3', b'diagram v3', previous_execution_id='exec-2')
+    assert generated == ['Data Module', 'Networking Module']
+
+    # Without a previous execution everything is generated again
+    generated, _ = pipeline('exec-4', b'diagram v2')
+    assert generated == ['Data Module', 'Networking Module']
+
+
+def test_background_model_calls_are_cancelled_when_a_module_fails(pipeline, monkeypatch):
+    async def failing_module(session, api_key, role, prompt, model, base_url=None, on_chunk=None, budget=None):
+        # Fails once the resource spec call is under way
+        await asyncio.sleep(0.05)
+        raise RuntimeError('completions endpoint down')
+
+    monkeypatch.setattr(code_generator_utils_v2, 'get_ai_response', failing_module)
+
+    async def generate():
+        with pytest.raises(RuntimeError, match='completions endpoint down'):
+            await pipeline.generate('exec-1', b'diagram v1')
+        # Let the cancellations be delivered; the spec would otherwise wait for 2 seconds
+        await asyncio.sleep(0.1)
+        return list(pipeline.models.spec_overlapped_modules)
+
+    # The resource spec call was still waiting for the modules when step 7 failed
+    assert contextvars.copy_context().run(asyncio.run, generate()) == ['cancelled']
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+from model_transport import make_transport_key, call_model, stream_model, save_cassette, get_cassette, CassetteMissError
+
+REQUEST = {'messages': [{'role': 'user', 'content': 'Describe the diagram'}], 'max_tokens': 100}
+
+
+@pytest.fixture
+def cassette_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cassette.jsonl.gz')
+    monkeypatch.setenv('MODEL_CASSETTE', path)
+    return path
+
+
+def collect(stream):
+    async def drain():
+        return [event async for event in stream]
+    return asyncio.run(drain())
+
+
+def test_recorded_responses_and_streams_replay_without_model_calls(cassette_path, monkeypatch):
+    live_calls = []
+
+    def invoke():
+        live_calls.append('invoke')
+        return {'content': [{'type': 'text', 'text': 'A VPC'}]}
+
+    async def events():
+        live_calls.append('stream')
+        for text in ('A ', 'VPC'):
+            yield {'type': 'content_block_delta', 'delta': {'text': text}}
+
+    key = make_transport_key('bedrock', 'model', REQUEST)
+    stream_key = make_transport_key('bedrock', 'model', REQUEST, streaming=True)
+    assert key != stream_key
+
+    monkeypatch.setenv('MODEL_TRANSPORT_MODE', 'record')
+    recorded = call_model(key, 'bedrock', 'model', invoke)
+    recorded_events = collect(stream_model(stream_key, 'bedrock', 'model', events))
+    save_cassette()
+
+    monkeypatch.setenv('MODEL_TRANSPORT_MODE', 'replay')
+    # A new cassette object, as in a fresh process
+    monkeypatch.setattr('model_transport._cassette', None)
+    assert call_model(key, 'bedrock', 'model', invoke) == recorded
+    assert collect(stream_model(stream_key, 'bedrock', 'model', events)) == recorded_events
+    assert live_calls == ['invoke', 'stream']
+    assert len(get_cassette()) == 2
+
+
+def test_replay_fails_for_unrecorded_requests(cassette_path, monkeypatch):
+    monkeypatch.setenv('MODEL_TRANSPORT_MODE', 'replay')
+    monkeypatch.setattr('model_transport._cassette', None)
+
+    with pytest.raises(CassetteMissError):
+        call_model(make_transport_key('completions', 'model', REQUEST), 'completions', 'model', lambda: {})
+
+
+def test_replay_can_emulate_recorded_stream_timing(cassette_path, monkeypatch):
+    async def slow_events():
+        yield {'delta': 'first'}
+        await asyncio.sleep(0.05)
+        yield {'delta': 'second'}
+
+    key = make_transport_key('completions', 'model', REQUEST, streaming=True)
+    monkeypatch.setenv('MODEL_TRANSPORT_MODE', 'record')
+    collect(stream_model(key, 'completions', 'model', slow_events))
+
+    monkeypatch.setenv('MODEL_TRANSPORT_MODE', 'replay')
+    started = time.monotonic()
+    collect(stream_model(key, 'completions', 'model', slow_events))
+    assert time.monotonic() - started < 0.04
+
+    monkeypatch.setenv('MODEL_REPLAY_TIMING', 'original')
+    started = time.monotonic()
+    collect(stream_model(key, 'completions', 'model', slow_events))
+    assert time.monotonic() - started >= 0.045
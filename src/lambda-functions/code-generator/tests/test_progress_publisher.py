@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+
+import a2cai_code_generator_main as main
+import progress_publisher
+from progress_publisher import ProgressPublisher, publish_progress
+
+
+class RecordingTable:
+    """
+    Applies the monotonic condition like DynamoDB would and records every accepted write.
+    """
+
+    def __init__(self):
+        self.progress = None
+        self.writes = []
+
+    def update_item(self, **kwargs):
+        progress = kwargs['ExpressionAttributeValues'][':p']
+        assert kwargs['ConditionExpression'] == progress_publisher.MONOTONIC_PROGRESS_CONDITION
+        if self.progress is not None and progress <= self.progress:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+        self.progress = progress
+        self.writes.append(progress)
+
+
+def use_table(monkeypatch, table):
+    class DynamoDB:
+        def Table(self, name):
+            return table
+
+    monkeypatch.setattr(progress_publisher, 'get_resource', lambda *args, **kwargs: DynamoDB())
+
+
+def test_burst_is_coalesced_to_latest_value(monkeypatch):
+    table = RecordingTable()
+    use_table(monkeypatch, table)
+
+    async def scenario():
+        publisher = ProgressPublisher('progress-table', 'execution-1', interval=0.2)
+        publisher.publish(10)
+        await asyncio.sleep(0.05)
+        for progress in (20, 30, 40):
+            publisher.publish(progress)
+        await asyncio.sleep(0.4)
+
+    asyncio.run(scenario())
+
+    assert table.writes == [10, 40]
+
+
+def test_flush_writes_pending_value_without_waiting_for_interval(monkeypatch):
+    table = RecordingTable()
+    use_table(monkeypatch, table)
+
+    async def scenario():
+        publisher = ProgressPublisher('progress-table', 'execution-1', interval=60)
+        publisher.publish(10)
+        publisher.publish(71)
+        await asyncio.wait_for(publisher.flush(), 1)
+
+    asyncio.run(scenario())
+
+    assert table.writes[-1] == 71
+
+
+def test_progress_never_moves_backwards(monkeypatch):
+    table = RecordingTable()
+    table.progress = 50
+    use_table(monkeypatch, table)
+
+    async def scenario():
+        publisher = ProgressPublisher('progress-table', 'execution-1', interval=0)
+        publisher.publish(40)
+        await publisher.flush()
+        publisher.publish(30)
+        publisher.publish(60)
+        await publisher.flush()
+
+    asyncio.run(scenario())
+
+    assert table.writes == [60]
+
+
+def test_failed_invocation_is_marked_failed_and_releases_its_publisher(monkeypatch):
+    table = RecordingTable()
+    use_table(monkeypatch, table)
+    monkeypatch.setenv('SYNTHESIS_PROGRESS_TABLE', 'progress-table')
+    monkeypatch.setenv('PROGRESS_UPDATE_INTERVAL_SECONDS', '60')
+    failures = []
+
+    async def generate_code(event, api_key, config):
+        publish_progress(10)
+        publish_progress(20)
+        raise RuntimeError('model unavailable')
+
+    async def send_failure_notification(message):
+        failures.append(message)
+
+    monkeypatch.setattr(main, 'get_api_key_from_secrets', lambda: 'key')
+    monkeypatch.setattr(main, 'load_generation_config', lambda: ({}, {}, 'model'))
+    monkeypatch.setattr(main, 'generate_code', generate_code)
+    monkeypatch.setattr(main, 'send_failure_notification', send_failure_notification)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.async_lambda_handler({'execution_id': 'execution-1'}, None))
+
+    assert failures == ['model unavailable']
+    # The pending value is written before the publisher is released
+    assert table.writes == [20]
+    assert progress_publisher._publishers == {}
@@ -0,0 +1,48 @@
+import asyncio
+import os
+
+import a2cai_v2
+from code_generator_utils_v2 import record_completion_usage
+from stage_cache import StageCache
+from tracing import start_trace
+from utils2_v2 import load_yaml_data
+
+
+def test_static_prompt_is_a_cache_checkpoint_ahead_of_the_variable_text(monkeypatch):
+    monkeypatch.setenv('PROMPT_CACHE_MIN_TOKENS', '1')
+    requests = []
+
+    def call_bedrock_model(request_body, modelId):
+        requests.append(request_body)
+        return {
+            'content': [{'type': 'text', 'text': '{"resources": []}'}],
+            'stop_reason': 'end_turn',
+            'usage': {'input_tokens': 40, 'output_tokens': 8, 'cache_read_input_tokens': 1100, 'cache_creation_input_tokens': 0},
+        }
+
+    monkeypatch.setattr(a2cai_v2, 'call_bedrock_model', call_bedrock_model)
+    monkeypatch.setattr(a2cai_v2, 'get_stage_cache', lambda: StageCache(None))
+    root = start_trace('run')
+
+    asyncio.run(a2cai_v2.generate_resource_spec({'architecture_description': 'A VPC'}, 'Extract the resources.'))
+    record_completion_usage({'prompt_tokens': 1500, 'completion_tokens': 300, 'prompt_tokens_details': {'cached_tokens': 1024}})
+
+    assert requests[0]['messages'][0]['content'] == [
+        {'type': 'text', 'text': 'Extract the resources.', 'cache_control': {'type': 'ephemeral'}},
+        {'type': 'text', 'text': 'A VPC'},
+    ]
+    totals = root.totals()
+    assert (totals['cache_read_tokens'], totals['cache_write_tokens'], totals['input_tokens']) == (1100 + 1024, 0, 40 + 476)
+
+    monkeypatch.setenv('PROMPT_CACHING', 'false')
+    assert a2cai_v2.cacheable_prompt_content('Extract the resources.') == [{'type': 'text', 'text': 'Extract the resources.'}]
+
+
+def test_prefixes_below_the_minimum_cacheable_length_are_not_checkpoints(monkeypatch):
+    monkeypatch.delenv('PROMPT_CACHE_MIN_TOKENS', raising=False)
+    prompts = load_yaml_data(os.path.join(os.path.dirname(a2cai_v2.__file__), 'a2cai_prompts.yaml'))
+
+    # None of the shipped stage prompts reaches the 1024-token minimum of Claude Sonnet
+    for name, prompt in prompts.items():
+        assert 'cache_control' not in a2cai_v2.cacheable_prompt_content(prompt)[0], name
+    assert 'cache_control' in a2cai_v2.cacheable_prompt_content('x' * 4096)[0]
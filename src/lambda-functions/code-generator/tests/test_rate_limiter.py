@@ -0,0 +1,124 @@
+import asyncio
+import heapq
+import itertools
+import types
+
+import pytest
+
+import rate_limiter
+from rate_limiter import ModelRequestScheduler, RetryableModelError
+
+
+class VirtualClock:
+    """
+    Virtual time for the scheduler: sleeps wait until drive() advances the clock to their wake time.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self._sleepers = []
+        self._order = itertools.count()
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        if delay <= 0:
+            await asyncio.sleep(0)
+            return
+        wake_up = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self.now + delay, next(self._order), wake_up))
+        await wake_up
+
+    async def drive(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        while not task.done():
+            # Let every task run until it waits on the clock
+            for _ in range(20):
+                await asyncio.sleep(0)
+            if self._sleepers and not task.done():
+                wake_at, _, wake_up = heapq.heappop(self._sleepers)
+                self.now = max(self.now, wake_at)
+                wake_up.set_result(None)
+        return task.result()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(rate_limiter, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(rate_limiter, 'asyncio', types.SimpleNamespace(
+        sleep=clock.sleep, get_running_loop=asyncio.get_running_loop, Semaphore=asyncio.Semaphore))
+    # Jitter always draws its upper bound
+    monkeypatch.setattr(rate_limiter, 'random', types.SimpleNamespace(uniform=lambda low, high: high))
+    return clock
+
+
+def test_requests_per_minute_paces_calls_after_the_burst(clock):
+    scheduler = ModelRequestScheduler('completions', max_in_flight=4, requests_per_minute=2)
+    started = []
+
+    async def call():
+        started.append(clock.now)
+
+    async def scenario():
+        for _ in range(4):
+            await scheduler.run(call)
+
+    asyncio.run(clock.drive(scenario()))
+
+    assert started == [0, 0, 30, 60]
+
+
+def test_in_flight_requests_are_capped(clock):
+    scheduler = ModelRequestScheduler('bedrock', max_in_flight=2)
+    in_flight, peak = [0], [0]
+
+    async def call():
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await clock.sleep(1)
+        in_flight[0] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(scheduler.run(call) for _ in range(5)))
+
+    asyncio.run(clock.drive(scenario()))
+
+    assert peak[0] == 2
+    assert clock.now == 3
+
+
+def test_retry_after_pauses_every_caller_and_retries_are_bounded(clock):
+    scheduler = ModelRequestScheduler('completions', max_in_flight=4, max_retries=2)
+    calls = []
+
+    async def throttled_once():
+        calls.append(('first', clock.now))
+        if len(calls) == 1:
+            raise RetryableModelError('HTTP 429', retry_after=10)
+
+    async def second():
+        calls.append(('second', clock.now))
+
+    async def later_caller():
+        await clock.sleep(1)
+        await scheduler.run(second)
+
+    async def scenario():
+        await asyncio.gather(scheduler.run(throttled_once), later_caller())
+
+    asyncio.run(clock.drive(scenario()))
+    # The other caller waits out the Retry-After too; the throttled one adds up to 1s of jitter
+    assert sorted(calls, key=lambda call: call[1]) == [('first', 0), ('second', 10), ('first', 11)]
+
+    attempts = []
+
+    async def always_throttled():
+        attempts.append(clock.now)
+        raise RetryableModelError('HTTP 503')
+
+    with pytest.raises(RetryableModelError):
+        asyncio.run(clock.drive(scheduler.run(always_throttled)))
+    # Exponential backoff: 1s, then 2s
+    assert [attempt - attempts[0] for attempt in attempts] == [0, 1, 3]
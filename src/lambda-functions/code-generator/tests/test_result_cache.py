@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta, timezone
+
+import result_cache
+from result_cache import compute_result_cache_key, evict_cache_entries, lookup_cached_artifact
+
+PROMPTS = {'architecture_description_prompt': 'Describe the diagram.'}
+STACK_PROMPTS = {'step_1_prefix': 'Generate the stack.'}
+
+
+class ListingS3:
+    def __init__(self, entries):
+        self.entries = entries
+        self.deleted = []
+
+    def get_paginator(self, name):
+        entries = self.entries
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [entry for entry in entries if entry['Key'].startswith(Prefix)]}
+
+        return Paginator()
+
+    def delete_objects(self, Bucket, Delete):
+        self.deleted.extend(item['Key'] for item in Delete['Objects'])
+
+
+def test_cache_key_changes_with_every_input_that_affects_the_output():
+    key = compute_result_cache_key(b'diagram', 'python', 'model', PROMPTS, STACK_PROMPTS)
+
+    assert compute_result_cache_key(b'diagram', 'Python', ' model ', dict(PROMPTS), dict(STACK_PROMPTS)) == key
+    assert compute_result_cache_key(b'diagram 2', 'python', 'model', PROMPTS, STACK_PROMPTS) != key
+    assert compute_result_cache_key(b'diagram', 'typescript', 'model', PROMPTS, STACK_PROMPTS) != key
+    assert compute_result_cache_key(b'diagram', 'python', 'other-model', PROMPTS, STACK_PROMPTS) != key
+    assert compute_result_cache_key(b'diagram', 'python', 'model', {'architecture_description_prompt': 'Describe it.'}, STACK_PROMPTS) != key
+    assert compute_result_cache_key(b'diagram', 'python', 'model', PROMPTS, {}) != key
+
+
+def test_cache_key_changes_with_the_pipeline_flags(monkeypatch):
+    key = compute_result_cache_key(b'diagram', 'python', 'model', PROMPTS, STACK_PROMPTS)
+    monkeypatch.setenv('STAGING_GENERATOR', 'Template')
+    assert compute_result_cache_key(b'diagram', 'python', 'model', PROMPTS, STACK_PROMPTS) == key
+
+    for name, value in (('FUSED_MODULE_STAGE', 'true'), ('STAGING_GENERATOR', 'llm'),
+                        ('PROMPT_CACHING', 'false'), ('TOKEN_BUDGET_MODE', 'fixed')):
+        with monkeypatch.context() as flags:
+            flags.setenv(name, value)
+            assert compute_result_cache_key(b'diagram', 'python', 'model', PROMPTS, STACK_PROMPTS) != key
+
+
+def test_a_hit_refreshes_the_entry_and_keeps_its_metadata(monkeypatch):
+    metadata = {'artifact-name': 'result.zip', 'execution-id': 'run-1'}
+
+    class HitS3:
+        copies = []
+
+        def head_object(self, Bucket, Key):
+            return {'LastModified': datetime.now(timezone.utc) - timedelta(days=2), 'Metadata': dict(metadata)}
+
+        def copy_object(self, **kwargs):
+            self.copies.append(kwargs)
+
+    s3 = HitS3()
+    monkeypatch.setattr(result_cache, 'get_client', lambda service_name: s3)
+
+    assert lookup_cached_artifact('results', 'abc') == ('cache/abc.zip', 'result.zip', 'run-1')
+    assert s3.copies == [{
+        'Bucket': 'results',
+        'Key': 'cache/abc.zip',
+        'CopySource': {'Bucket': 'results', 'Key': 'cache/abc.zip'},
+        'Metadata': metadata,
+        'MetadataDirective': 'REPLACE',
+    }]
+
+
+def test_eviction_drops_expired_then_oldest_entries_over_the_size_limit(monkeypatch):
+    now = datetime.now(timezone.utc)
+    s3 = ListingS3([
+        {'Key': 'cache/expired.zip', 'Size': 10, 'LastModified': now - timedelta(days=8)},
+        {'Key': 'cache/old.zip', 'Size': 60, 'LastModified': now - timedelta(days=2)},
+        {'Key': 'cache/new.zip', 'Size': 60, 'LastModified': now - timedelta(hours=1)},
+        {'Key': 'output/result.zip', 'Size': 500, 'LastModified': now - timedelta(days=30)},
+    ])
+    monkeypatch.setattr(result_cache, 'get_client', lambda service_name: s3)
+
+    assert evict_cache_entries('results', ttl_seconds=7 * 86400, max_bytes=100) == 2
+    assert s3.deleted == ['cache/expired.zip', 'cache/old.zip']
@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import io
+import json
+import zipfile
+from datetime import datetime, timezone
+
+import a2cai_code_generator_main as main
+import result_cache
+import run_manifest
+from execution_context import set_execution
+from botocore.exceptions import ClientError
+from run_manifest import IncrementalPlan, build_run_manifest, diff_resource_specs, load_run_manifest, normalize_module_resources, read_artifact_files, store_run_manifest
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'LastModified': datetime.now(timezone.utc), 'Metadata': self.metadata.get(Key, {})}
+
+    def copy_object(self, Bucket, Key, CopySource, Metadata=None, **kwargs):
+        self.objects[Key] = self.objects[CopySource['Key']]
+        self.metadata[Key] = Metadata or self.metadata.get(CopySource['Key'], {})
+
+
+def previous_manifest():
+    module_prompt_dict = {'Network': 'Network module: a VPC', 'Storage': 'Storage module: a bucket'}
+    module_files = {'Network': 'network_stack.py', 'Storage': 'storage_stack.py'}
+    resource_spec = {'resources': [{'type': 'AWS::S3::Bucket', 'name': 'Data'}, {'type': 'AWS::EC2::VPC', 'name': 'Vpc'}]}
+    module_resources = {'Network': normalize_module_resources([{'type': 'AWS::EC2::VPC', 'name': 'Vpc'}])}
+    return build_run_manifest('exec-1', 'Python', 'model', 'prompts', 'results/exec-1.zip', module_prompt_dict, module_files,
+                              ['Network', 'Storage'], 'app.py', resource_spec, module_resources)
+
+
+def test_modules_are_reused_on_unchanged_resources_and_otherwise_on_unchanged_descriptions():
+    manifest = previous_manifest()
+    vpc = normalize_module_resources([{'type': ' aws::ec2::vpc', 'name': 'VPC'}])
+    assert vpc == manifest['modules']['Network']['resources'] == [{'type': 'aws::ec2::vpc', 'name': 'vpc', 'configuration': {}, 'connections': []}]
+
+    # A reworded description with the same resources is reused, unless one of them changed in the resource spec
+    reworded = {'Network': 'Network module: one VPC', 'Storage': 'Storage module: a bucket'}
+    assert IncrementalPlan(manifest, reworded, ['Network', 'Storage'], {'Network': vpc}).reused_modules == {
+        'Network': 'network_stack.py', 'Storage': 'storage_stack.py'}
+    plan = IncrementalPlan(manifest, reworded, ['Network', 'Storage'], {'Network': vpc})
+    assert plan.invalidate_resources(['Data', 'VPC']) == ['Network']
+    assert (plan.reused_modules, plan.changed_modules) == ({'Storage': 'storage_stack.py'}, ['Network'])
+    subnet = normalize_module_resources([{'type': 'AWS::EC2::Subnet', 'name': 'Private'}])
+    assert IncrementalPlan(manifest, reworded, ['Network', 'Storage'], {'Network': vpc + subnet}).changed_modules == ['Network']
+
+    # Configuration and connections are part of the inventory, whatever their order, case or JSON type
+    configured = normalize_module_resources([{'type': 'AWS::EC2::VPC', 'name': 'Vpc', 'configuration': {'Private Subnets': '2', 'AZs': ['b', 'a']}, 'connections': ['Flow Logs']}])
+    assert normalize_module_resources([{'type': 'AWS::EC2::VPC', 'name': 'vpc', 'configuration': {'private_subnets': 2, 'azs': ['A', 'B']}, 'connections': ['FlowLogs']}]) == configured
+    assert normalize_module_resources([{'type': 'AWS::EC2::VPC', 'name': 'Vpc', 'configuration': {'private_subnets': 4, 'azs': ['a', 'b']}, 'connections': ['FlowLogs']}]) != configured
+    assert normalize_module_resources([{'type': 'AWS::EC2::VPC', 'name': 'Vpc', 'configuration': {'private_subnets': 2, 'azs': ['a', 'b']}}]) != configured
+    assert IncrementalPlan(manifest, reworded, ['Network', 'Storage'], {'Network': configured}).changed_modules == ['Network']
+
+    edited = IncrementalPlan(manifest, {'Network': 'Network module: a VPC', 'Storage': 'Storage module: two buckets'}, ['Network', 'Storage'])
+    assert edited.reused_modules == {'Network': 'network_stack.py'}
+    assert edited.changed_modules == ['Storage']
+    assert not edited.module_set_changed
+    assert edited.reusable_files == ['network_stack.py', 'app.py']
+
+    # A new module changes the staging file, which is then regenerated as well
+    extended = IncrementalPlan(manifest, {'Network': 'Network module: a VPC', 'Queue': 'Queue module: a queue'}, ['Network', 'Queue'])
+    assert (extended.changed_modules, extended.removed_modules, extended.module_set_changed) == (['Queue'], ['Storage'], True)
+    assert extended.reusable_files == ['network_stack.py']
+
+    resource_spec = {'resources': [{'type': 'AWS::S3::Bucket', 'name': 'Data', 'versioned': True}, {'type': 'AWS::SQS::Queue', 'name': 'Jobs'}]}
+    assert diff_resource_specs(manifest['resource_spec'], resource_spec) == {'added': ['Jobs'], 'removed': ['Vpc'], 'changed': ['Data']}
+
+
+def test_manifest_is_reused_only_with_the_same_settings(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(run_manifest, 'get_client', lambda service_name: s3)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr('network_stack.py', 'class NetworkStack: pass')
+    s3.objects['results/exec-1.zip'] = archive.getvalue()
+    store_run_manifest('results', previous_manifest())
+
+    assert load_run_manifest('results', 'exec-1', 'python', 'model', 'prompts')['modules']['Storage']['file'] == 'storage_stack.py'
+    assert load_run_manifest('results', 'exec-1', 'python', 'other-model', 'prompts') is None
+    assert load_run_manifest('results', '../exec-1', 'python', 'model', 'prompts') is None
+    assert read_artifact_files('results', 'results/exec-1.zip', ['network_stack.py', 'app.py']) == {'network_stack.py': b'class NetworkStack: pass'}
+
+
+def test_result_cache_hit_takes_over_the_manifest_of_the_cached_run(monkeypatch):
+    s3 = FakeS3()
+    for module in (result_cache, run_manifest):
+        monkeypatch.setattr(module, 'get_client', lambda service_name: s3)
+    monkeypatch.setattr(result_cache, 'evict_cache_entries', lambda bucket_name: 0)
+    monkeypatch.setenv('RESULTS_BUCKET_NAME', 'results')
+    s3.objects['results/exec-1.zip'] = b'zip'
+    store_run_manifest('results', previous_manifest())
+    cache_key = 'a' * 64
+    result_cache.store_uploaded_artifact_in_cache('results', 'results/exec-1.zip', cache_key, 'exec-1')
+
+    async def download_notification(url):
+        pass
+
+    monkeypatch.setattr(main, 'read_s3_object', lambda s3_uri: b'diagram')
+    monkeypatch.setattr(main, 'compute_result_cache_key', lambda *args: cache_key)
+    monkeypatch.setattr(main, 'generate_presigned_url', lambda bucket_name, s3_key, expiration: f'https://{bucket_name}/{s3_key}')
+    monkeypatch.setattr(main, 'send_download_notification', download_notification)
+
+    def cache_hit(execution_id):
+        set_execution(execution_id)
+        return asyncio.run(main.generate_code({'file_path': 's3://diagrams/a.png', 'code_language': 'python'}, 'key', ({}, {}, 'model')))
+
+    result = contextvars.copy_context().run(cache_hit, 'exec-2')
+
+    manifest = json.loads(s3.objects['manifests/exec-2.json'])
+    assert manifest['execution_id'] == 'exec-2'
+    assert result['presigned_url'] == f"https://results/{manifest['artifact_key']}"
+    assert manifest['modules'] == previous_manifest()['modules']
+
+    # Entries stored without the producing execution are served without a manifest
+    s3.metadata[f'cache/{cache_key}.zip'] = {}
+    contextvars.copy_context().run(cache_hit, 'exec-3')
+    assert 'manifests/exec-3.json' not in s3.objects
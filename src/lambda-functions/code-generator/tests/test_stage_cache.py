@@ -0,0 +1,86 @@
+import contextvars
+import io
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+import stage_cache
+from execution_context import set_execution
+from image_ingest import InlineImage
+from stage_cache import LocalDirStageCacheBackend, MemoryStageCacheBackend, S3StageCacheBackend, StageCache, make_stage_cache_key
+
+MESSAGES = [{'role': 'user', 'content': [{'type': 'text', 'text': 'Describe the diagram'}]}]
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = (Body, datetime.now(timezone.utc) + timedelta(seconds=len(self.objects)))
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key][0])}
+
+    def get_paginator(self, name):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': key, 'Size': len(body), 'LastModified': modified}
+                                    for key, (body, modified) in objects.items() if key.startswith(Prefix)]}
+
+        return Paginator()
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete['Objects']:
+            self.objects.pop(item['Key'])
+
+
+def image_messages(image_bytes):
+    return [{'role': 'user', 'content': [{'type': 'image', 'source': {'type': 'base64', 'data': InlineImage(image_bytes)}}]}]
+
+
+def test_key_is_stable_for_identical_inputs_and_changes_with_any_of_them():
+    key = make_stage_cache_key('bedrock', 'model', MESSAGES, 2048, None)
+
+    assert make_stage_cache_key('bedrock', ' model ', [dict(message) for message in MESSAGES], 2048, None) == key
+    assert make_stage_cache_key('completions', 'model', MESSAGES, 2048, None) != key
+    assert make_stage_cache_key('bedrock', 'model', MESSAGES, 4096, None) != key
+    assert make_stage_cache_key('bedrock', 'model', MESSAGES, 2048, 0.0) != key
+    # Inline images are keyed on a digest of their bytes
+    image_key = make_stage_cache_key('bedrock', 'model', image_messages(b'diagram'), 2048, None)
+    assert make_stage_cache_key('bedrock', 'model', image_messages(bytearray(b'diagram')), 2048, None) == image_key
+    assert make_stage_cache_key('bedrock', 'model', image_messages(b'edited diagram'), 2048, None) != image_key
+
+
+def test_backends_store_and_evict_within_their_size_limit(tmp_path, monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(stage_cache, 'get_client', lambda service_name: s3)
+    backends = [
+        MemoryStageCacheBackend(max_bytes=10),
+        LocalDirStageCacheBackend(str(tmp_path), max_bytes=10),
+        S3StageCacheBackend('results', max_bytes=10, evict_every=1),
+    ]
+    for backend in backends:
+        backend.put('first', b'123456')
+        backend.put('second', b'abcdef')
+
+        assert backend.get('second') == b'abcdef'
+        assert backend.get('first') is None
+        assert backend.get('missing') is None
+
+
+def test_bypass_skips_reads_but_still_stores_fresh_responses():
+    cache = StageCache(MemoryStageCacheBackend())
+
+    def bypassed_run():
+        set_execution('execution-1', bypass_cache=True)
+        cache.put('key', 'fresh response')
+        return cache.get('key')
+
+    assert contextvars.copy_context().run(bypassed_run) is None
+    assert cache.get('key') == 'fresh response'
+    assert StageCache(None).get('key') is None
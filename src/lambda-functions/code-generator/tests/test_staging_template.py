@@ -0,0 +1,78 @@
+from staging_template import render_staging_app, write_staging_app_file
+
+PYTHON_STACK = '''from aws_cdk import Stack
+from constructs import Construct
+
+
+class NetworkingStack(Stack):
+    def __init__(self, scope: Construct, construct_id: str, cidr: str = "10.0.0.0/16", **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+'''
+
+PYTHON_STACK_WITH_INPUTS = '''from typing import Dict
+from aws_cdk import Stack, aws_ec2 as ec2
+
+
+class DataStack(Stack):
+    def __init__(self, scope, construct_id: str, vpc: ec2.IVpc, tags: Dict[str, str] = None, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+'''
+
+TYPESCRIPT_STACK = '''import * as cdk from 'aws-cdk-lib';
+
+export class WebUiStack extends cdk.Stack {
+  constructor(scope: Construct, id: string, props?: cdk.StackProps) {
+    super(scope, id, props);
+  }
+}
+'''
+
+TYPESCRIPT_STACK_WITH_INPUTS = TYPESCRIPT_STACK.replace('props?: cdk.StackProps', 'props: WebUiStackProps')
+
+# Constructors that can't take the env the template passes
+PYTHON_STACK_WITHOUT_KWARGS = PYTHON_STACK.replace(', **kwargs) -> None', ') -> None')
+TYPESCRIPT_STACK_WITHOUT_PROPS = TYPESCRIPT_STACK.replace(', props?: cdk.StackProps', '')
+
+
+def write_modules(tmp_path, sources):
+    paths = []
+    for file_name, source in sources:
+        path = tmp_path / file_name
+        path.write_text(source)
+        paths.append(str(path))
+    return paths
+
+
+def test_rendered_apps_instantiate_stacks_in_order_without_dependencies_or_tags():
+    stacks = [('networking_stack', 'NetworkingStack'), ('data_stack', 'DataStack'), ('archive_stack', 'DataStack')]
+
+    python_app = render_staging_app(stacks, 'python')
+    typescript_app = render_staging_app(stacks, 'typescript')
+
+    compile(python_app, 'app.py', 'exec')
+    assert 'from archive_stack import DataStack as DataStack2' in python_app
+    assert python_app.index('NetworkingStack(app') < python_app.index('DataStack(app') < python_app.index('DataStack2(app')
+    assert "import { DataStack as DataStack2 } from './archive_stack';" in typescript_app
+    assert "const dataStack2 = new DataStack2(app, 'DataStack2', { env });" in typescript_app
+    for app in (python_app, typescript_app):
+        assert 'ependency' not in app
+        assert 'Tags' not in app
+
+
+def test_template_is_only_used_when_every_stack_can_be_built_from_scope_and_id(tmp_path):
+    paths = write_modules(tmp_path, [('networking_stack.py', PYTHON_STACK), ('data_stack.py', PYTHON_STACK_WITH_INPUTS)])
+    assert write_staging_app_file(['Data Module', 'Networking Module'], paths[::-1], ['Networking Stack', 'Data Stack'], 'python', str(tmp_path), 'out') is None
+
+    app_path = write_staging_app_file(['Networking Module'], paths[:1], ['Networking Stack'], 'python', str(tmp_path), 'out')
+    assert 'networking_stack = NetworkingStack(app, "NetworkingStack", env=env)' in open(app_path).read()
+
+    typescript_paths = write_modules(tmp_path, [('web_ui_stack.ts', TYPESCRIPT_STACK), ('props_stack.ts', TYPESCRIPT_STACK_WITH_INPUTS)])
+    assert write_staging_app_file(['Web UI Module'], typescript_paths[:1], ['Web UI Stack'], 'typescript', str(tmp_path), 'out')
+    assert write_staging_app_file(['Web UI Module'], typescript_paths[1:], ['Web UI Stack'], 'typescript', str(tmp_path), 'out') is None
+
+
+def test_template_is_not_used_when_a_constructor_cannot_take_env(tmp_path):
+    paths = write_modules(tmp_path, [('networking_stack.py', PYTHON_STACK_WITHOUT_KWARGS), ('web_ui_stack.ts', TYPESCRIPT_STACK_WITHOUT_PROPS)])
+
+    assert write_staging_app_file(['Networking Module'], paths[:1], ['Networking Stack'], 'python', str(tmp_path), 'out') is None
+    assert write_staging_app_file(['Web UI Module'], paths[1:], ['Web UI Stack'], 'typescript', str(tmp_path), 'out') is None
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import a2cai_v2
+import code_generator_utils_v2
+from code_generator_utils_v2 import ModelAuthError, get_ai_response, strip_reopened_fence
+from stage_cache import MemoryStageCacheBackend, StageCache
+from tracing import start_trace
+from warm_state import RefreshAheadValue
+from utils2_v2 import IncrementalCodeWriter, write_code_to_file
+
+RESPONSE = 'Here is the stack:\n```python\nfrom aws_cdk import Stack\n\nclass DataStack(Stack):\n    pass\n```\nIt creates a bucket.'
+
+
+class FakeEventStream:
+    """
+    botocore EventStream stand-in; with hold_after set, blocks after that many events until closed.
+    """
+
+    def __init__(self, events, hold_after=None):
+        self.events = events
+        self.hold_after = hold_after
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        for index, event in enumerate(self.events):
+            if index == self.hold_after:
+                self.closed.wait(5)
+            if self.closed.is_set():
+                return
+            yield {'chunk': {'bytes': json.dumps(event).encode('utf-8')}}
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeSSEResponse:
+    headers = {}
+
+    def __init__(self, lines, status=200, body=None):
+        self.lines = lines
+        self.status = status
+        self.body = body
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return 'Unauthorized'
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    def content(self):
+        async def lines():
+            for line in self.lines:
+                yield line.encode('utf-8')
+        return lines()
+
+
+class FakeSession:
+    def __init__(self, lines, valid_key=None):
+        self.lines = lines
+        self.valid_key = valid_key
+        self.payloads = []
+        self.keys = []
+
+    def post(self, url, json=None, headers=None):
+        self.payloads.append(json)
+        self.keys.append(headers['Authorization'])
+        if self.valid_key and headers['Authorization'] != f'Bearer {self.valid_key}':
+            return FakeSSEResponse([], status=401)
+        return FakeSSEResponse(self.lines)
+
+
+class ContinuedSession(FakeSession):
+    """
+    Answers each request with the next completion; every completion is sent as SSE chunks.
+    """
+
+    def __init__(self, completions):
+        super().__init__(None)
+        self.completions = list(completions)
+
+    def post(self, url, json=None, headers=None):
+        self.payloads.append(json)
+        chunks, finish_reason = self.completions.pop(0)
+        events = [{'choices': [{'delta': {'content': chunk}}]} for chunk in chunks]
+        events.append({'choices': [{'delta': {}, 'finish_reason': finish_reason}]})
+        body = {'choices': [{'message': {'content': ''.join(chunks)}, 'finish_reason': finish_reason}]}
+        return FakeSSEResponse(sse_lines(events), body=body)
+
+
+def sse_lines(events):
+    return [f'data: {json.dumps(event)}' for event in events] + ['data: [DONE]']
+
+
+def bedrock_events(texts, stop_reason='end_turn'):
+    return ([{'type': 'message_start', 'message': {'usage': {'input_tokens': 30}}}]
+            + [{'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': text}} for text in texts]
+            + [{'type': 'message_delta', 'delta': {'stop_reason': stop_reason}, 'usage': {'output_tokens': 12}}])
+
+
+def use_bedrock_stream(monkeypatch, event_stream):
+    class BedrockRuntime:
+        def invoke_model_with_response_stream(self, modelId, body):
+            return {'body': event_stream}
+
+    monkeypatch.setattr(a2cai_v2, 'get_client', lambda service_name: BedrockRuntime())
+    monkeypatch.setattr(a2cai_v2, 'get_stage_cache', lambda: StageCache(None))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, len(RESPONSE)])
+def test_code_writer_matches_the_extracted_code_block_whatever_the_chunking(tmp_path, chunk_size):
+    writer = IncrementalCodeWriter(str(tmp_path / 'stack' / 'data_stack.py'), 'python')
+    for start in range(0, len(RESPONSE), chunk_size):
+        writer.feed(RESPONSE[start:start + chunk_size])
+    writer.close()
+
+    expected_path = write_code_to_file(RESPONSE, str(tmp_path), 'expected', 'python', 'Data Module')
+    assert writer.completed
+    assert open(writer.code_file_path).read() == open(expected_path).read()
+
+
+def test_code_writer_reports_a_code_block_without_closing_fence(tmp_path):
+    writer = IncrementalCodeWriter(str(tmp_path / 'data_stack.py'), 'python')
+    writer.feed('```python\nclass DataStack(Stack):\n')
+    writer.close()
+
+    assert not writer.completed
+
+
+@pytest.mark.parametrize('streaming', ['true', 'false'])
+def test_module_file_is_the_same_on_a_stage_cache_hit_and_miss_with_escaped_line_breaks(monkeypatch, tmp_path, streaming):
+    # The model escapes the line breaks inside the code block; get_ai_response turns them into real ones
+    escaped = 'Here is the stack:\n```python\nfrom aws_cdk import Stack\\n\\nclass DataStack(Stack):\\n    pass\n```'
+    stage_cache = StageCache(MemoryStageCacheBackend())
+    monkeypatch.setattr(code_generator_utils_v2, 'get_stage_cache', lambda: stage_cache)
+    monkeypatch.setenv('MODEL_STREAMING', streaming)
+    # Every escaped line break is split across two chunks
+    parts = escaped.split('\\')
+    session = ContinuedSession([([part + '\\' for part in parts[:-1]] + parts[-1:], 'stop')])
+
+    files = []
+    for run in ('miss', 'hit'):
+        writer = IncrementalCodeWriter(str(tmp_path / run / 'data_stack.py'), 'python')
+        text = asyncio.run(get_ai_response(session, 'key', 'role', 'Generate the stack', model='model', on_chunk=writer.feed))
+        writer.close()
+        code_file_path = writer.code_file_path if writer.completed else write_code_to_file(text, str(tmp_path), run, 'python', 'Data Module')
+        files.append(open(code_file_path).read())
+
+    assert len(session.payloads) == 1
+    assert files == ['from aws_cdk import Stack\n\nclass DataStack(Stack):\n    pass'] * 2
+
+
+def test_server_sent_events_are_assembled_into_the_completion(monkeypatch):
+    monkeypatch.setattr(code_generator_utils_v2, 'get_stage_cache', lambda: StageCache(None))
+    events = [{'choices': [{'delta': {'content': text}}]} for text in ('class ', 'DataStack', ':')]
+    events.append({'choices': [{'delta': {}, 'finish_reason': 'stop'}], 'usage': {'prompt_tokens': 50, 'completion_tokens': 4}})
+    session = FakeSession([': keep-alive', ''] + [f'data: {json.dumps(event)}' for event in events] + ['data: [DONE]', 'data: ignored'])
+    chunks = []
+    root = start_trace('run')
+
+    text = asyncio.run(get_ai_response(session, 'key', 'role', 'Generate the stack', model='model', on_chunk=chunks.append))
+
+    assert text == 'class DataStack:'
+    assert chunks == ['class ', 'DataStack', ':']
+    assert session.payloads[0]['stream'] is True
+    assert (root.totals()['input_tokens'], root.totals()['output_tokens']) == (50, 4)
+
+
+@pytest.mark.parametrize('streaming', ['true', 'false'])
+def test_continuation_reopening_the_code_fence_is_joined_into_one_block(monkeypatch, tmp_path, streaming):
+    monkeypatch.setattr(code_generator_utils_v2, 'get_stage_cache', lambda: StageCache(None))
+    monkeypatch.setenv('MODEL_STREAMING', streaming)
+    cut_off = RESPONSE.index('class DataStack')
+    first, rest = RESPONSE[:cut_off], RESPONSE[cut_off:]
+    session = ContinuedSession([
+        ([first[:20], first[20:]], 'length'),
+        # The model re-opens the block, with the fence split across chunks
+        (['\n``', '`pyth', 'on\n', rest[:10], rest[10:]], 'stop'),
+    ])
+    writer = IncrementalCodeWriter(str(tmp_path / 'streamed' / 'data_stack.py'), 'python')
+
+    text = asyncio.run(get_ai_response(session, 'key', 'role', 'Generate the stack', model='model', on_chunk=writer.feed))
+    writer.close()
+
+    assert text == RESPONSE
+    assert session.payloads[1]['messages'][2] == {'role': 'assistant', 'content': first}
+    assert open(write_code_to_file(text, str(tmp_path), 'stack', 'python', 'Data Module')).read() == 'from aws_cdk import Stack\n\nclass DataStack(Stack):\n    pass'
+    if streaming == 'true':
+        assert writer.completed
+        assert open(writer.code_file_path).read() == open(write_code_to_file(RESPONSE, str(tmp_path), 'expected', 'python', 'Data Module')).read()
+
+
+def test_continuation_outside_a_code_block_is_kept_as_is():
+    assert strip_reopened_fence('Here is the stack:\n', '```python\ncode') == '```python\ncode'
+    assert strip_reopened_fence('```python\nx = 1\n', '  \n```python\ny = 2') == 'y = 2'
+    assert strip_reopened_fence('```python\nx = 1\n', '`y` = 2') == '`y` = 2'
+
+
+def test_rejected_api_key_is_reloaded_and_the_call_retried_once(monkeypatch):
+    monkeypatch.setattr(code_generator_utils_v2, 'get_stage_cache', lambda: StageCache(None))
+    keys = iter(['old', 'rotated', 'rotated'])
+    source = RefreshAheadValue(lambda: next(keys), ttl=900, refresh_ahead=0)
+    monkeypatch.setattr(code_generator_utils_v2, '_api_key_source', source)
+    done = {'choices': [{'delta': {'content': 'ok'}, 'finish_reason': 'stop'}]}
+    session = FakeSession([f'data: {json.dumps(done)}', 'data: [DONE]'], valid_key='rotated')
+
+    assert asyncio.run(get_ai_response(session, source.get(), 'role', 'Generate the stack', model='model')) == 'ok'
+    assert session.keys == ['Bearer old', 'Bearer rotated']
+    # A later call still holding the old key picks up the reloaded one without another reload
+    assert asyncio.run(get_ai_response(session, 'old', 'role', 'Generate another stack', model='model')) == 'ok'
+    assert next(keys) == 'rotated'
+
+    session.valid_key = 'never'
+    with pytest.raises(ModelAuthError):
+        asyncio.run(get_ai_response(session, 'old', 'role', 'Generate a third stack', model='model'))
+
+
+def test_bedrock_stream_is_assembled_into_a_response_body(monkeypatch):
+    use_bedrock_stream(monkeypatch, FakeEventStream(bedrock_events(['A VPC ', 'with two subnets'])))
+    chunks = []
+    request_body = {'max_tokens': 100, 'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': 'Describe'}]}]}
+
+    response_body = asyncio.run(a2cai_v2.invoke_bedrock_model_streaming(request_body, on_chunk=chunks.append))
+
+    assert response_body == {
+        'content': [{'type': 'text', 'text': 'A VPC with two subnets'}],
+        'stop_reason': 'end_turn',
+        'usage': {'input_tokens': 30, 'output_tokens': 12},
+    }
+    assert chunks == ['A VPC ', 'with two subnets']
+
+
+def test_bedrock_stream_is_closed_without_draining_when_the_consumer_fails(monkeypatch):
+    event_stream = FakeEventStream(bedrock_events(['A VPC ', 'never read']), hold_after=2)
+    use_bedrock_stream(monkeypatch, event_stream)
+    request_body = {'max_tokens': 100, 'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': 'Describe'}]}]}
+
+    def on_chunk(text):
+        raise ValueError('consumer failed')
+
+    started = time.monotonic()
+    with pytest.raises(ValueError):
+        asyncio.run(a2cai_v2.invoke_bedrock_model_streaming(request_body, on_chunk=on_chunk))
+
+    assert event_stream.closed.is_set()
+    assert time.monotonic() - started < 2
@@ -0,0 +1,99 @@
+import asyncio
+import gzip
+import json
+
+import structured_logging
+from structured_logging import get_logger, get_transcript, flush_transcript
+
+log = get_logger('test')
+
+
+def logged_records(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_records_are_json_lines_with_fields_and_truncated_payload(monkeypatch, capsys):
+    monkeypatch.setenv('_EXECUTION_ID', 'execution-1')
+    monkeypatch.setenv('LOG_MAX_PAYLOAD_CHARS', '10')
+
+    log.info("Step %d response", 2, module='Data Module', payload='x' * 25)
+
+    (record,) = logged_records(capsys)
+    assert record['message'] == 'Step 2 response'
+    assert record['level'] == 'INFO'
+    assert record['executionId'] == 'execution-1'
+    assert record['module'] == 'Data Module'
+    assert record['payloadChars'] == 25
+    assert record['payload'] == 'x' * 10 + '... [15 more chars]'
+
+
+def test_disabled_level_skips_formatting(capsys):
+    class Expensive:
+        def __str__(self):
+            raise AssertionError('formatted although DEBUG is disabled')
+
+    log.debug("Prompt %s", Expensive())
+
+    assert logged_records(capsys) == []
+
+
+def test_payload_sampling_is_decided_per_execution(monkeypatch, capsys):
+    monkeypatch.setenv('LOG_PAYLOAD_SAMPLE_RATE', '0')
+
+    log.info("Step response", payload='generated code')
+
+    (record,) = logged_records(capsys)
+    assert 'payload' not in record
+
+
+def test_transcript_keeps_full_payloads_and_uploads_gzipped_parts(monkeypatch, capsys):
+    uploads = {}
+
+    class S3:
+        def put_object(self, Bucket, Key, Body, **kwargs):
+            uploads[Key] = gzip.decompress(Body).decode('utf-8')
+
+    monkeypatch.setattr('aws_clients.get_client', lambda service_name, region_name=None: S3())
+    monkeypatch.setenv('LOG_TRANSCRIPTS', 's3')
+    monkeypatch.setenv('RESULTS_BUCKET_NAME', 'results')
+    monkeypatch.setenv('_EXECUTION_ID', 'execution-2')
+    monkeypatch.setattr(structured_logging, 'DEFAULT_TRANSCRIPT_PART_BYTES', 300)
+
+    # DEBUG is disabled on stdout, but the transcript still gets the full payloads
+    log.debug("Step prompt", step=1, payload='p' * 100)
+    log.debug("Step response", step=1, payload='r' * 100)
+    log.debug("Step prompt", step=2, payload='q' * 10)
+    assert get_transcript('execution-2') is not None
+
+    keys = asyncio.run(flush_transcript())
+
+    assert len(keys) == 2
+    assert all(key.startswith('transcripts/execution-2/') and key.endswith('.jsonl.gz') for key in keys)
+    lines = [json.loads(line) for key in sorted(keys) for line in uploads[key].splitlines()]
+    assert [(line['step'], line['payload']) for line in lines] == [(1, 'p' * 100), (1, 'r' * 100), (2, 'q' * 10)]
+    assert asyncio.run(flush_transcript()) == []
+
+
+def test_step_outputs_are_kept_by_default_without_the_other_payloads(monkeypatch):
+    uploads = {}
+
+    class S3:
+        def put_object(self, Bucket, Key, Body, **kwargs):
+            uploads[Key] = gzip.decompress(Body).decode('utf-8')
+
+    monkeypatch.setattr('aws_clients.get_client', lambda service_name, region_name=None: S3())
+    monkeypatch.delenv('LOG_TRANSCRIPTS', raising=False)
+    monkeypatch.setenv('RESULTS_BUCKET_NAME', 'results')
+    monkeypatch.setenv('_EXECUTION_ID', 'execution-3')
+
+    log.debug("Step prompt", module='Data Module', step=1, payload='prompt')
+    log.step_output('Data Module', 1, 'first')
+    log.step_output('staging', 1, 'app')
+
+    (key,) = asyncio.run(flush_transcript())
+    lines = [json.loads(line) for line in uploads[key].splitlines()]
+    assert [(line['module'], line['step'], line['payload']) for line in lines] == [('Data Module', 1, 'first'), ('staging', 1, 'app')]
+
+    monkeypatch.setenv('LOG_TRANSCRIPTS', 'off')
+    log.step_output('Data Module', 2, 'second')
+    assert get_transcript('execution-3', step_output=True) is None
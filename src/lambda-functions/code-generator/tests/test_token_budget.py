@@ -0,0 +1,50 @@
+import asyncio
+
+import a2cai_v2
+from stage_cache import StageCache
+from token_budget import OutputHistory, TokenBudget
+
+
+def test_budget_follows_input_size_and_output_history(monkeypatch):
+    history = OutputHistory()
+    small = TokenBudget('module_step_4', input_tokens=500, history=history)
+    large = TokenBudget('module_step_4', input_tokens=6000, history=history)
+    assert small.max_tokens < large.max_tokens <= large.ceiling == 20000
+
+    # Outputs consistently half the prior estimate shrink the next budgets
+    for _ in range(3):
+        large.record(int(large.prior / 2))
+    assert TokenBudget('module_step_4', input_tokens=6000, history=history).max_tokens < large.max_tokens
+    assert TokenBudget('module_step_4', input_tokens=100, history=history).max_tokens == 1024
+
+    monkeypatch.setenv('TOKEN_BUDGET_MODE', 'fixed')
+    assert TokenBudget('module_step_4', input_tokens=500, history=history).max_tokens == 20000
+
+
+def test_truncated_bedrock_response_is_continued_from_the_partial_text(monkeypatch):
+    full_text = '{"resources": [' + ', '.join(f'"bucket-{index}"' for index in range(40)) + ']}'
+    requests = []
+
+    def call_bedrock_model(request_body, modelId):
+        requests.append(request_body)
+        messages = request_body['messages']
+        prefill = messages[-1]['content'][0]['text'] if messages[-1]['role'] == 'assistant' else ''
+        remaining = full_text[len(prefill):]
+        size = request_body['max_tokens'] // 10
+        return {
+            'content': [{'type': 'text', 'text': remaining[:size]}],
+            'stop_reason': 'max_tokens' if len(remaining) > size else 'end_turn',
+            'usage': {'input_tokens': 10, 'output_tokens': len(remaining[:size]) // 4},
+        }
+
+    monkeypatch.setattr(a2cai_v2, 'call_bedrock_model', call_bedrock_model)
+    monkeypatch.setattr(a2cai_v2, 'get_stage_cache', lambda: StageCache(None))
+    budget = TokenBudget('resource_spec', input_tokens=0, history=OutputHistory())
+    request_body = {'max_tokens': budget.max_tokens, 'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': 'spec'}]}]}
+
+    response_body = asyncio.run(a2cai_v2.invoke_bedrock_model(request_body, budget=budget))
+
+    assert response_body['content'][0]['text'] == full_text
+    assert response_body['stop_reason'] == 'end_turn'
+    assert [request['max_tokens'] for request in requests] == [2048, 4096]
+    assert requests[1]['messages'][-1] == {'role': 'assistant', 'content': [{'type': 'text', 'text': full_text[:204].rstrip()}]}
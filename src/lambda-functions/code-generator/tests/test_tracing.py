@@ -0,0 +1,115 @@
+import json
+import asyncio
+import contextvars
+import time
+
+import tracing
+from rate_limiter import ModelRequestScheduler, RetryableModelError
+from tracing import trace_span, traced, record_model_call, start_trace, finish_trace, summarize_trace
+
+
+def run_in_trace(coroutine_function):
+    """
+    Run a coroutine under a fresh trace in an isolated context and return the finished root span.
+    """
+    def scenario():
+        root = start_trace('test', execution_id='execution-1')
+        asyncio.run(coroutine_function())
+        root.end = time.monotonic()
+        return root
+
+    return contextvars.copy_context().run(scenario)
+
+
+def test_spans_nest_across_gathered_tasks_and_roll_up_counters():
+    async def module(name):
+        with trace_span('module', module=name):
+            with trace_span('module_step_1'):
+                await asyncio.sleep(0.01)
+                record_model_call(model_calls=1, input_tokens=10, output_tokens=5)
+
+    async def pipeline():
+        with trace_span('step_07_module_stacks'):
+            await asyncio.gather(module('A'), module('B'))
+
+    root = run_in_trace(pipeline)
+
+    summary = summarize_trace(root)
+    spans = {span['name']: span for span in summary['spans']}
+    assert set(spans) == {
+        'test/step_07_module_stacks',
+        'test/step_07_module_stacks/module[A]',
+        'test/step_07_module_stacks/module[A]/module_step_1',
+        'test/step_07_module_stacks/module[B]',
+        'test/step_07_module_stacks/module[B]/module_step_1',
+    }
+    assert spans['test/step_07_module_stacks']['inputTokens'] == 20
+    assert summary['outputTokens'] == 10
+    assert summary['modelCalls'] == 2
+
+
+def test_critical_path_follows_slowest_branch_and_skips_detached_work():
+    async def pipeline():
+        background = asyncio.ensure_future(traced('resource_spec', asyncio.sleep(0.03)))
+        with trace_span('step_04'):
+            await asyncio.sleep(0.01)
+        with trace_span('step_07'):
+            async def module(name, seconds):
+                with trace_span('module', module=name):
+                    await asyncio.sleep(seconds)
+            await asyncio.gather(module('fast', 0.01), module('slow', 0.05))
+        with trace_span('step_10'):
+            await background
+
+    root = run_in_trace(pipeline)
+
+    assert summarize_trace(root)['criticalPath'] == ['test/step_04', 'test/step_07/module[slow]', 'test/step_10']
+
+
+def test_scheduler_records_queue_wait_and_retries():
+    scheduler = ModelRequestScheduler('test', max_in_flight=1, max_retries=2)
+    attempts = []
+
+    async def flaky_call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RetryableModelError('throttled', retry_after=0)
+        return 'ok'
+
+    async def pipeline():
+        with trace_span('step'):
+            assert await scheduler.run(flaky_call) == 'ok'
+
+    root = run_in_trace(pipeline)
+
+    totals = root.children[0].totals()
+    assert totals['model_calls'] == 1
+    assert totals['retries'] == 1
+    assert totals['queue_wait_seconds'] > 0
+
+
+def test_finish_trace_emits_emf_and_attaches_summary(monkeypatch, capsys):
+    updates = []
+    monkeypatch.setenv('SYNTHESIS_PROGRESS_TABLE', 'progress-table')
+    monkeypatch.setattr(tracing, 'update_progress_item', lambda table_name, **kwargs: updates.append(kwargs))
+
+    async def pipeline():
+        with trace_span('step_03_architecture_description'):
+            record_model_call(model_calls=1, input_tokens=1200, output_tokens=300)
+
+    def scenario():
+        root = start_trace('code_generation', execution_id='execution-1')
+        asyncio.run(pipeline())
+        finish_trace(root)
+
+    contextvars.copy_context().run(scenario)
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+    step = next(record for record in records if record['Stage'] == 'step_03_architecture_description')
+    assert step['InputTokens'] == 1200
+    assert step['executionId'] == 'execution-1'
+    assert step['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Stage']]
+
+    (update,) = updates
+    assert update['Key'] == {'executionId': 'execution-1'}
+    assert update['ExpressionAttributeValues'][':tr']['criticalPath'] == ['code_generation/step_03_architecture_description']
@@ -0,0 +1,86 @@
+import os
+import time
+
+import warm_state
+from warm_state import RefreshAheadValue, load_cached_file, get_language_prompts
+
+
+def test_refresh_ahead_value_serves_cached_value_until_refresh_window():
+    calls = []
+    value = RefreshAheadValue(lambda: calls.append(1) or len(calls), ttl=60, refresh_ahead=1)
+
+    assert value.get() == 1
+    assert value.get() == 1
+    assert len(calls) == 1
+
+
+def test_refresh_ahead_value_refreshes_in_background_and_keeps_value_on_failure():
+    results = iter(['first', RuntimeError('throttled'), 'second', 'third'])
+
+    def loader():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    value = RefreshAheadValue(loader, ttl=60, refresh_ahead=60)
+    assert value.get() == 'first'
+
+    # Inside the refresh window: the cached value is returned while the (failing) refresh runs
+    assert value.get() == 'first'
+    _wait_for_refresh(value)
+    assert value.get() == 'first'
+    _wait_for_refresh(value)
+    assert value.get() == 'second'
+
+
+def test_refresh_ahead_value_reloads_after_invalidate():
+    calls = []
+    value = RefreshAheadValue(lambda: calls.append(1) or len(calls), ttl=60, refresh_ahead=0)
+
+    assert value.get() == 1
+    value.invalidate()
+    assert value.get() == 2
+
+
+def test_load_cached_file_reparses_only_when_file_changes(tmp_path):
+    config_file = tmp_path / 'prompts.yaml'
+    config_file.write_text('a')
+    parsed = []
+
+    def parser(path):
+        with open(path) as f:
+            parsed.append(f.read())
+        return {'content': parsed[-1]}
+
+    first = load_cached_file(str(config_file), parser)
+    assert load_cached_file(str(config_file), parser) is first
+
+    config_file.write_text('bb')
+    os.utime(config_file, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+    assert load_cached_file(str(config_file), parser) == {'content': 'bb'}
+    assert parsed == ['a', 'bb']
+
+
+def test_get_language_prompts_substitutes_language_once():
+    prompts = {
+        'module_prompt_suffix': 'suffix',
+        'step_2': 'two',
+        'step_3': 'three in {code_language}',
+        'step_4': 'four in {code_language}',
+    }
+    warm_state._language_prompts.clear()
+
+    python_prompts = get_language_prompts(prompts, 'python')
+
+    assert python_prompts['step_3_prefix'] == 'three in python\n'
+    assert python_prompts['step_4_prefix'] == 'four in python\n'
+    assert python_prompts['step_1_prefix'] == 'suffix\n'
+    assert get_language_prompts(dict(prompts), 'python') is python_prompts
+    assert get_language_prompts(prompts, 'typescript')['step_4_prefix'] == 'four in typescript\n'
+
+
+def _wait_for_refresh(value, timeout=5):
+    deadline = time.monotonic() + timeout
+    while value._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
@@ -0,0 +1,145 @@
+import os
+import math
+import threading
+from collections import defaultdict, deque
+from rate_limiter import estimate_tokens
+from tracing import record_model_call
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+# Budget parameters per model stage:
+#   ceiling - most a single request may reserve (the provider/stage limit, formerly the fixed max_tokens)
+#   floor   - least a request reserves
+#   base, ratio - prior output estimate, base + ratio * tokens of the variable input the stage
+#                 works on (the architecture description, a module description, the previous step's
+#                 output), used until enough output history was observed for the stage
+STAGE_TOKEN_BUDGETS = {
+    'architecture_description': {'ceiling': 2048, 'floor': 1024, 'base': 1536, 'ratio': 0.0},
+    'module_descriptions': {'ceiling': 5048, 'floor': 1024, 'base': 512, 'ratio': 1.0},
+    'deployment_sequence': {'ceiling': 10000, 'floor': 1024, 'base': 256, 'ratio': 1.2},
+    'modules_with_deployment_sequence': {'ceiling': 10000, 'floor': 1024, 'base': 512, 'ratio': 2.0},
+    'resource_spec': {'ceiling': 16000, 'floor': 2048, 'base': 1024, 'ratio': 3.0},
+    'module_step_1': {'ceiling': 20000, 'floor': 1024, 'base': 1024, 'ratio': 6.0},
+    'module_step_2': {'ceiling': 20000, 'floor': 1024, 'base': 512, 'ratio': 1.0},
+    'module_step_3': {'ceiling': 20000, 'floor': 1024, 'base': 512, 'ratio': 0.8},
+    'module_step_4': {'ceiling': 20000, 'floor': 1024, 'base': 512, 'ratio': 1.2},
+    'staging': {'ceiling': 20000, 'floor': 1024, 'base': 1024, 'ratio': 0.5},
+    'completion': {'ceiling': 20000, 'floor': 1024, 'base': 4096, 'ratio': 1.0},
+}
+
+# Stop reasons of a response cut off at max_tokens: Bedrock (Anthropic) and chat completions
+TRUNCATED_STOP_REASONS = ('max_tokens', 'length')
+
+DEFAULT_TOKEN_BUDGET_MODE = 'adaptive'
+DEFAULT_TOKEN_BUDGET_HEADROOM = 1.25
+DEFAULT_TOKEN_BUDGET_QUANTILE = 0.9
+DEFAULT_TOKEN_BUDGET_HISTORY = 50
+DEFAULT_TOKEN_BUDGET_MIN_SAMPLES = 3
+DEFAULT_MAX_CONTINUATIONS = 3
+# Budgets are rounded up to this step so similar requests reserve the same amount
+BUDGET_STEP_TOKENS = 256
+
+
+def is_truncated(stop_reason):
+    return stop_reason in TRUNCATED_STOP_REASONS
+
+
+def _setting(name, default, cast=float):
+    return cast(os.environ.get(name, default))
+
+
+class OutputHistory:
+    """
+    Observed output/prior-estimate ratios per stage, kept for the lifetime of the container.
+    Thread-safe.
+
+    Args:
+        size (int, optional): Samples kept per stage (TOKEN_BUDGET_HISTORY).
+    """
+
+    def __init__(self, size=None):
+        self.size = int(size or _setting('TOKEN_BUDGET_HISTORY', DEFAULT_TOKEN_BUDGET_HISTORY, int))
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.size))
+
+    def add(self, stage, ratio):
+        with self._lock:
+            self._samples[stage].append(ratio)
+
+    def scale(self, stage):
+        """
+        The TOKEN_BUDGET_QUANTILE (0.9) quantile of the stage's observed/prior ratios, or None
+        while fewer than TOKEN_BUDGET_MIN_SAMPLES were observed.
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if len(samples) < _setting('TOKEN_BUDGET_MIN_SAMPLES', DEFAULT_TOKEN_BUDGET_MIN_SAMPLES, int):
+            return None
+        quantile = _setting('TOKEN_BUDGET_QUANTILE', DEFAULT_TOKEN_BUDGET_QUANTILE)
+        return samples[min(len(samples) - 1, max(0, math.ceil(quantile * len(samples)) - 1))]
+
+
+class TokenBudget:
+    """
+    The max_tokens plan of one model request.
+
+    Args:
+        stage (str): Key in STAGE_TOKEN_BUDGETS.
+        input_tokens (int): Estimated tokens of the variable input the output is sized on.
+        history (OutputHistory): Where the produced output size is recorded.
+    """
+
+    def __init__(self, stage, input_tokens, history):
+        params = STAGE_TOKEN_BUDGETS.get(stage, STAGE_TOKEN_BUDGETS['completion'])
+        self.stage = stage
+        self.history = history
+        self.ceiling = params['ceiling']
+        self.prior = params['base'] + params['ratio'] * input_tokens
+        self.max_continuations = _setting('TOKEN_BUDGET_MAX_CONTINUATIONS', DEFAULT_MAX_CONTINUATIONS, int)
+        if os.environ.get('TOKEN_BUDGET_MODE', DEFAULT_TOKEN_BUDGET_MODE).lower() == 'fixed':
+            self.max_tokens = self.ceiling
+            return
+        scale = history.scale(stage) or 1.0
+        headroom = _setting('TOKEN_BUDGET_HEADROOM', DEFAULT_TOKEN_BUDGET_HEADROOM)
+        estimate = math.ceil(self.prior * scale * headroom / BUDGET_STEP_TOKENS) * BUDGET_STEP_TOKENS
+        self.max_tokens = int(min(self.ceiling, max(params['floor'], estimate)))
+
+    def continuation_max_tokens(self, continuation):
+        """
+        max_tokens for the n-th (1-based) continuation of a truncated response: twice the previous
+        request's budget, up to the ceiling.
+        """
+        return min(self.ceiling, self.max_tokens * 2 ** continuation)
+
+    def record(self, output_tokens, continuations=0):
+        """
+        Record the tokens a request produced in total, over `continuations` continuation calls.
+        """
+        if continuations:
+            record_model_call(continuations=continuations)
+        if output_tokens and self.prior:
+            self.history.add(self.stage, output_tokens / self.prior)
+        log.debug("Token budget used", stage=self.stage, max_tokens=self.max_tokens, output_tokens=output_tokens, continuations=continuations)
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_output_history():
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = OutputHistory()
+        return _history
+
+
+def plan_tokens(stage, sized_on=''):
+    """
+    Budget a request of `stage` whose output scales with the text `sized_on`, e.g.
+    plan_tokens('module_step_4', step_3_response). The budget is the stage's prior estimate for
+    that input, corrected by the observed output history and TOKEN_BUDGET_HEADROOM, between the
+    stage's floor and ceiling. TOKEN_BUDGET_MODE=fixed always reserves the ceiling.
+    """
+    return TokenBudget(stage, estimate_tokens(sized_on), get_output_history())
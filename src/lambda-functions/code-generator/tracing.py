@@ -0,0 +1,249 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from progress_publisher import update_progress_item
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_METRICS_NAMESPACE = 'A2C/CodeGenerator'
+
+# Counters recorded by model calls; a span reports its own plus all of its descendants'
+# input_tokens counts uncached prompt tokens; cache_read/cache_write_tokens the provider's prompt cache use
+COUNTERS = ('queue_wait_seconds', 'model_seconds', 'model_calls', 'cache_hits', 'retries', 'input_tokens', 'output_tokens',
+            'reserved_tokens', 'continuations', 'cache_read_tokens', 'cache_write_tokens')
+
+_current_span = ContextVar('trace_span', default=None)
+
+
+class Span:
+    """
+    One timed stage of a pipeline run.
+
+    Args:
+        name (str): Stage name, e.g. 'step_03_architecture_description' or 'module_step_2'.
+        parent (Span, optional): Enclosing span; None for the root of a trace.
+        attributes: Extra identifying values (e.g. module='Web UI Module').
+    """
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.children = []
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.status = 'ok'
+        # Started with ensure_future: runs alongside its parent's later steps instead of gating them
+        self.detached = False
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.end = None
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def label(self):
+        module = self.attributes.get('module')
+        return f"{self.name}[{module}]" if module else self.name
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+    def totals(self):
+        totals = dict(self.counters)
+        for child in self.children:
+            for counter, value in child.totals().items():
+                totals[counter] += value
+        return totals
+
+    def walk(self, path=''):
+        path = f"{path}/{self.label}" if path else self.label
+        yield path, self
+        for child in self.children:
+            yield from child.walk(path)
+
+
+@contextmanager
+def trace_span(name, detached=False, **attributes):
+    """
+    Time the enclosed block as a child of the current span.
+
+    Works in sync and async code alike: the current span is a context variable, so tasks created
+    inside the block (asyncio.gather, ensure_future) record into it. Does nothing outside a trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(name, parent, **attributes)
+    span.detached = detached
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException:
+        span.status = 'error'
+        raise
+    finally:
+        span.end = time.monotonic()
+        _current_span.reset(token)
+
+
+async def traced(name, awaitable, **attributes):
+    """
+    Await `awaitable` inside a span. Wrap coroutines passed to ensure_future with it so work
+    that outlives the current block is still attributed to the span it was started from.
+    """
+    with trace_span(name, detached=True, **attributes):
+        return await awaitable
+
+
+def record_model_call(**counters):
+    """
+    Add counters (see COUNTERS) to the current span, e.g. record_model_call(input_tokens=812).
+    """
+    span = _current_span.get()
+    if span is None:
+        return
+    for counter, value in counters.items():
+        if value:
+            span.counters[counter] += value
+
+
+def start_trace(name, execution_id=''):
+    """
+    Start a trace in the current context and return its root span. Tasks created afterwards
+    from this context (including loop.run_until_complete) record into it.
+    """
+    root = Span(name)
+    root.execution_id = execution_id
+    _current_span.set(root)
+    return root
+
+
+def critical_path(span):
+    """
+    Return the chain of leaf spans that gated the end of `span`.
+    """
+    path = []
+    cursor = span.end if span.end is not None else time.monotonic()
+    remaining = [child for child in span.children if child.end is not None and not child.detached]
+    gating = []
+    while True:
+        # Small tolerance: a parent resumes a moment after the child it awaited finished
+        candidates = [child for child in remaining if child.end <= cursor + 0.001]
+        if not candidates:
+            break
+        child = max(candidates, key=lambda c: c.end)
+        gating.append(child)
+        remaining.remove(child)
+        cursor = child.start
+    for child in reversed(gating):
+        path.extend((critical_path(child) if child.children else None) or [child])
+    return path
+
+
+def _milliseconds(seconds):
+    return int(round(seconds * 1000))
+
+
+def span_summary(path, span, root):
+    totals = span.totals()
+    return {
+        'name': path,
+        'status': span.status,
+        'startMs': _milliseconds(span.start - root.start),
+        'durationMs': _milliseconds(span.duration),
+        'queueWaitMs': _milliseconds(totals['queue_wait_seconds']),
+        'modelMs': _milliseconds(totals['model_seconds']),
+        'modelCalls': totals['model_calls'],
+        'cacheHits': totals['cache_hits'],
+        'retries': totals['retries'],
+        'inputTokens': totals['input_tokens'],
+        'outputTokens': totals['output_tokens'],
+        'reservedTokens': totals['reserved_tokens'],
+        'continuations': totals['continuations'],
+        'cacheReadTokens': totals['cache_read_tokens'],
+        'cacheWriteTokens': totals['cache_write_tokens'],
+    }
+
+
+def summarize_trace(root):
+    """
+    Summarize a finished trace for the progress table: every span (named by its path from the
+    root, with times in milliseconds and counters including descendants) plus the critical path.
+    """
+    summary = span_summary(root.label, root, root)
+    summary['spans'] = [span_summary(path, span, root) for path, span in root.walk() if span is not root]
+    labels = {span: path for path, span in root.walk()}
+    summary['criticalPath'] = [labels[span] for span in critical_path(root)]
+    return summary
+
+
+def emf_record(span, execution_id, namespace):
+    """
+    CloudWatch Embedded Metric Format record for one span, dimensioned by stage name.
+    """
+    totals = span.totals()
+    metrics = {
+        'Duration': (_milliseconds(span.duration), 'Milliseconds'),
+        'QueueWait': (_milliseconds(totals['queue_wait_seconds']), 'Milliseconds'),
+        'ModelCalls': (totals['model_calls'], 'Count'),
+        'CacheHits': (totals['cache_hits'], 'Count'),
+        'Retries': (totals['retries'], 'Count'),
+        'InputTokens': (totals['input_tokens'], 'Count'),
+        'OutputTokens': (totals['output_tokens'], 'Count'),
+        'ReservedTokens': (totals['reserved_tokens'], 'Count'),
+        'Continuations': (totals['continuations'], 'Count'),
+        'CacheReadTokens': (totals['cache_read_tokens'], 'Count'),
+        'CacheWriteTokens': (totals['cache_write_tokens'], 'Count'),
+    }
+    record = {
+        '_aws': {
+            'Timestamp': int(span.started_at * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['Stage']],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+        'Stage': span.name,
+        'executionId': execution_id,
+        'status': span.status,
+    }
+    record.update(span.attributes)
+    record.update({name: value for name, (value, _) in metrics.items()})
+    return record
+
+
+def finish_trace(root):
+    """
+    End the trace, print one EMF line per span and attach the summary to the execution's
+    progress-table item (as 'trace'). Failures are logged and never raised.
+    """
+    root.end = time.monotonic()
+    if _current_span.get() is root:
+        _current_span.set(None)
+    execution_id = root.execution_id
+    namespace = os.environ.get('TRACE_METRICS_NAMESPACE', DEFAULT_METRICS_NAMESPACE)
+    try:
+        for _, span in root.walk():
+            # EMF records must be bare JSON lines, so they bypass the structured logger
+            print(json.dumps(emf_record(span, execution_id, namespace)))
+
+        summary = summarize_trace(root)
+        if summary['criticalPath']:
+            log.info("Critical path: %s", ' -> '.join(summary['criticalPath']))
+        table_name = os.environ.get('SYNTHESIS_PROGRESS_TABLE')
+        if table_name and execution_id:
+            update_progress_item(
+                table_name,
+                Key={'executionId': execution_id},
+                UpdateExpression='SET #tr = :tr',
+                ExpressionAttributeValues={':tr': summary},
+                ExpressionAttributeNames={'#tr': 'trace'},
+            )
+    except Exception as e:
+        log.error("Error publishing trace: %s", e)
@@ -1,14 +1,18 @@
 import os
-import shutil
-import datetime 
-from datetime import datetime  # Redundant import
-import boto3
+import uuid
+from datetime import datetime
 from botocore.exceptions import ClientError
-import botocore
-import zipfile
 import yaml
 import re
 import json
+from aws_async import run_blocking
+from aws_clients import get_client
+from progress_publisher import update_progress_item, publish_progress, flush_progress
+from warm_state import load_cached_file
+from execution_context import current_execution_id
+from structured_logging import get_logger
+
+log = get_logger(__name__)
 
 
 def get_stack_name():
@@ -18,13 +22,24 @@ def get_stack_name():
     """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
-    stack_dirname = "a2a-ai-stack" + '-' + str (timestamp)  
+    # The random suffix keeps executions started in the same second (batch jobs) apart
+    stack_dirname = "a2a-ai-stack" + '-' + str (timestamp) + '-' + uuid.uuid4().hex[:8]
     
     stack_logfiles_dir = stack_dirname + "_logs"
     
     return  stack_dirname, stack_logfiles_dir
 
 
+def get_module_filename(module_name, code_language):
+    """
+    returns the stack file name for a module, e.g. 'Web UI Module' -> 'web_ui_stack.py'
+    """
+    if code_language.lower() == 'python': 
+        return module_name.lower().replace(' module', '').replace(' ', '_') + '_stack' + ".py"
+    elif code_language.lower() == 'typescript' :
+        return module_name.lower().replace(' module', '').replace(' ', '_') + '_stack' + ".ts"
+
+
 def write_code_to_file(code_str, local_dir, stack_dirname, code_language, module_name):
     """
     writes genearetd code strings of modules to code files in the local stack folder
@@ -39,23 +54,86 @@ def write_code_to_file(code_str, local_dir, stack_dirname, code_language, module
     
     makedirpath =os.path.join(local_dir,stack_dirname) 
     os.makedirs(makedirpath, exist_ok=True)
-    print("CODE DIR PATH", makedirpath)
 
-    if code_language.lower() == 'python': 
-        filename = module_name.lower().replace(' module', '').replace(' ', '_') + '_stack' + ".py"
-    elif code_language.lower() == 'typescript' :
-        filename = module_name.lower().replace(' module', '').replace(' ', '_') + '_stack' + ".ts"
+    filename = get_module_filename(module_name, code_language)
     
     code_file_path = os.path.join(makedirpath, filename)
     
     with open(code_file_path, 'w') as f:
         f.write(code)
     
-    print("CODE FILE PATH", code_file_path)  
+    log.debug("Code file written", path=code_file_path)
     
     return code_file_path 
 
 
+class IncrementalCodeWriter:
+    """
+    Writes the fenced code block of a streamed model response to a file while it is being generated.
+
+    Literal '\\n' sequences are turned into line breaks as get_ai_response does for the returned
+    text, text before the opening ``<language> fence is skipped and writing stops at the closing
+    fence, so the file matches what write_code_to_file extracts from the returned response.
+    `completed` tells whether a closing fence was seen, i.e. the file holds the whole code block.
+    """
+
+    def __init__(self, code_file_path, code_language):
+        self.code_file_path = code_file_path
+        self.open_fence = '``' + code_language.lower() + '\n'
+        self.close_fence = '\n``'
+        self.first_output_at = None
+        self.completed = False
+        self._pending = ''
+        self._backslash = ''
+        self._state = 'searching'
+        self._file = None
+
+    def feed(self, chunk):
+        if self._state == 'closed':
+            return
+        # Hold back a trailing backslash, it may start a '\\n' completed by the next chunk
+        chunk = self._backslash + chunk
+        self._backslash = '\\' if chunk.endswith('\\') else ''
+        self._pending += chunk[:len(chunk) - len(self._backslash)].replace('\\n', '\n')
+        if self._state == 'searching':
+            start = self._pending.find(self.open_fence)
+            if start == -1:
+                # Keep enough text to match a fence split across chunks
+                self._pending = self._pending[-len(self.open_fence):]
+                return
+            self._pending = self._pending[start + len(self.open_fence):]
+            self._state = 'emitting'
+            os.makedirs(os.path.dirname(self.code_file_path), exist_ok=True)
+            self._file = open(self.code_file_path, 'w')
+
+        end = self._pending.find(self.close_fence)
+        if end != -1:
+            self._write(self._pending[:end])
+            self.completed = True
+            self.close()
+            return
+        # Hold back a possible partial closing fence
+        hold = len(self.close_fence) - 1
+        if len(self._pending) > hold:
+            self._write(self._pending[:-hold])
+            self._pending = self._pending[-hold:]
+
+    def _write(self, text):
+        if not text:
+            return
+        if self.first_output_at is None:
+            self.first_output_at = datetime.now()
+        self._file.write(text)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._state = 'closed'
+        self._pending = ''
+
+
 def write_staging_code_to_file(code_str, local_dir, stack_dirname, code_language):
     """
     writes code to app.py file in the local stack folder
@@ -80,38 +158,11 @@ def write_staging_code_to_file(code_str, local_dir, stack_dirname, code_language
     with open(code_file_path, 'w') as f:
         f.write(code)
     
-    print("CODE FILE PATH", code_file_path)  
+    log.debug("Staging file written", path=code_file_path)
     
     return code_file_path 
 
 
-def write_log_to_file(prompt_response,local_dir,log_files_dir):
-    """
-    
-    
-    Writes prompt responses to files
-    
-    Args:
-    prompt_response (str): The string to be written to the file
-    log_files_dir (str): The directory path where the file should be saved
-    
-    Returns:
-    str: The full path of the created log file
-    """
-    makedirpath =os.path.join(local_dir,log_files_dir)  # ISSUE: Inconsistent spacing around = operator
-    os.makedirs(makedirpath, exist_ok=True)
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"log_{timestamp}.txt"
-    
-    logfile_path = os.path.join(makedirpath, filename)
-    
-    with open(logfile_path, 'w') as f:
-        f.write(prompt_response)
-    
-    return logfile_path
-
-
 def generate_presigned_url(bucket_name, object_key, expiration=86400):
     """
     Generate a pre-signed URL for an S3 object.
@@ -121,31 +172,36 @@ def generate_presigned_url(bucket_name, object_key, expiration=86400):
     :param expiration: Time in seconds for the URL to remain valid (default: 24 hours)
     :return: Pre-signed URL as string. If error, returns None.
     """
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
     try:
         url = s3_client.generate_presigned_url('get_object',
                                                Params={'Bucket': bucket_name,
                                                        'Key': object_key},
                                                ExpiresIn=expiration)
     except ClientError as e:
-        print(f"Error generating pre-signed URL: {e}")  # ISSUE: Should use logging instead of print
+        log.error("Error generating pre-signed URL: %s", e)
         return None
     
     return url
 
 
-def copy_file_to_s3(local_file_path, bucket_name):
-   
-
-
+def build_output_key(file_name):
+    """
+    Build the results bucket key for a generated artifact: output/<timestamp>/<file_name>
+    """
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
     subdirectory = f'output/{timestamp}/'
     
+    return f'{subdirectory}{file_name}'
+
+
+def copy_file_to_s3(local_file_path, bucket_name):
+   
     file_name = os.path.basename(local_file_path)
-    s3_key = f'{subdirectory}{file_name}'
+    s3_key = build_output_key(file_name)
     
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
     
     s3_client.upload_file(local_file_path, bucket_name, s3_key)
     
@@ -153,6 +209,18 @@ def copy_file_to_s3(local_file_path, bucket_name):
     return final_s3_path, s3_key
 
 
+def write_reused_file(data, local_dir, stack_dirname, file_name):
+    """
+    Write a file taken over from a previous execution's artifact into the local stack folder.
+    """
+    makedirpath = os.path.join(local_dir, stack_dirname)
+    os.makedirs(makedirpath, exist_ok=True)
+    filepath = os.path.join(makedirpath, file_name)
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    return filepath
+
+
 def write_resource_spec_to_file(resource_spec, local_dir, stack_dirname):
     """Write resource spec JSON to resource_spec.json in the stack output directory."""
     makedirpath = os.path.join(local_dir, stack_dirname)
@@ -160,25 +228,24 @@ def write_resource_spec_to_file(resource_spec, local_dir, stack_dirname):
     filepath = os.path.join(makedirpath, 'resource_spec.json')
     with open(filepath, 'w') as f:
         json.dump(resource_spec, f, indent=2)
-    print("RESOURCE SPEC FILE PATH", filepath)
+    log.debug("Resource spec written", path=filepath)
     return filepath
 
 
 def zip_directory(source_dir):
     """
-   
+    Zip /tmp/<source_dir> to /tmp/<source_dir>.zip. Only used when no ArtifactWriter is given.
     """
+    import zipfile
     workingdir = '/tmp'
     zip_filename = source_dir + '.zip'
     dest_zip = os.path.join('/tmp', zip_filename)
    
-    print("List of files in source directory:", os.listdir(os.path.join(workingdir, source_dir)))
+    log.debug("Zipping directory", source_dir=source_dir)
 
     with zipfile.ZipFile(dest_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for root, _, files in os.walk(os.path.join(workingdir, source_dir)):
             for file in files:
-                print("Root:", root)
-                print("File:", file)
                 file_path = os.path.join(root, file)
                 zipf.write(file_path, os.path.relpath(file_path, os.path.join(workingdir, source_dir)))                
     destzip_path=os.path.join(source_dir,dest_zip)
@@ -186,50 +253,74 @@ def zip_directory(source_dir):
 
 
 
+def _read_yaml_keys(file_path, keys_to_read):
+    with open(file_path, 'r') as file:
+        data = yaml.safe_load(file)
+    
+    result = {}
+    for key in keys_to_read:
+        if key in data:
+            result[key] = data[key]
+        else:
+            log.warning("Key '%s' not found in the YAML file.", key, path=file_path)
+    
+    return result
+
+
+def _parse_prompt_config(file_path):
+    return _read_yaml_keys(file_path, [
+        'architecture_description_prompt',
+        'staging_prompt_template',
+        'modules_description_prompt',
+        'deployment_sequence_prompt',
+        'resource_spec_prompt',
+        'modules_with_deployment_sequence_prompt'
+    ])
+
+
+def _parse_model_name(file_path):
+    with open(file_path, 'r') as file:
+        data = yaml.safe_load(file)
+
+    if 'MODEL_NAME' in data:
+        return data['MODEL_NAME']
+    else:
+        log.warning("Key 'MODEL_NAME' not found in the YAML file.", path=file_path)
+        return None
+
+
+def _parse_stack_generation_prompts(file_path):
+    return _read_yaml_keys(file_path, [
+        'module_prompt_suffix',
+        'step_2',
+        'step_3',
+        'step_4'
+    ])
+
+
 def load_yaml_data(file_path):
+    """
+    Load the main prompts from a YAML file. The parsed prompts are kept across warm
+    invocations until the file changes; callers must not mutate the returned dictionary.
+    """
     try:
-        with open(file_path, 'r') as file:
-            data = yaml.safe_load(file)
-        
-        keys_to_read = [
-            'architecture_description_prompt',
-            'staging_prompt_template',
-            'modules_description_prompt',
-            'deployment_sequence_prompt',
-            'resource_spec_prompt'
-        ]
-        
-        result = {}
-        for key in keys_to_read:
-            if key in data:
-                result[key] = data[key]
-            else:
-                print(f"Warning: Key '{key}' not found in the YAML file.")
-        
-        return result
+        return load_cached_file(file_path, _parse_prompt_config)
     except FileNotFoundError:
-        print(f"Error: File '{file_path}' not found.")
+        log.error("File '%s' not found.", file_path)
     except yaml.YAMLError as e:
-        print(f"Error: Failed to parse YAML file. {e}")
+        log.error("Failed to parse YAML file: %s", e, path=file_path)
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        log.exception("An unexpected error occurred: %s", e, path=file_path)
         
 def load_model_name(file_path):
     try:
-        with open(file_path, 'r') as file:
-            data = yaml.safe_load(file)
-
-        if 'MODEL_NAME' in data:
-            return data['MODEL_NAME']
-        else:
-            print("Warning: Key 'MODEL_NAME' not found in the YAML file.")
-            return None
+        return load_cached_file(file_path, _parse_model_name)
     except FileNotFoundError:
-        print(f"Error: File '{file_path}' not found.")
+        log.error("File '%s' not found.", file_path)
     except yaml.YAMLError as e:
-        print(f"Error: Failed to parse YAML file. {e}")
+        log.error("Failed to parse YAML file: %s", e, path=file_path)
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")        
+        log.exception("An unexpected error occurred: %s", e, path=file_path)        
         
 def load_stack_generation_prompts(file_path):
     
@@ -253,67 +344,27 @@ def load_stack_generation_prompts(file_path):
 
     Note:
         If any expected keys are missing from the YAML file, a warning message
-        will be printed and the key will be omitted from the returned dictionary.
+        will be logged and the key will be omitted from the returned dictionary.
+        The parsed prompts are kept across warm invocations until the file changes
+        (see warm_state.load_cached_file); callers must not mutate the returned dictionary.
     """
     try:
-        with open(file_path, 'r') as file:
-            data = yaml.safe_load(file)
-        
-        keys_to_read = [
-            'module_prompt_suffix',
-            'step_2',
-            'step_3',
-            'step_4'
-        ]
-        
-        stack_generation_prompt_dict = {}
-        for key in keys_to_read:
-            if key in data:
-                stack_generation_prompt_dict[key] = data[key]
-            else:
-                print(f"Warning: Key '{key}' not found in the YAML file.")
-        
-        return stack_generation_prompt_dict
+        return load_cached_file(file_path, _parse_stack_generation_prompts)
     except FileNotFoundError:
-        print(f"Error: File '{file_path}' not found.")
+        log.error("File '%s' not found.", file_path)
     except yaml.YAMLError as e:
-        print(f"Error: Failed to parse YAML file. {e}")
+        log.error("Failed to parse YAML file: %s", e, path=file_path)
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        log.exception("An unexpected error occurred: %s", e, path=file_path)
 
 async def send_progress_update(progress):
     """
-    Write progress update to DynamoDB synthesis progress table.
+    Queue a progress update for the DynamoDB synthesis progress table.
+
+    The write is done by the execution's background ProgressPublisher, so this returns
+    without waiting for DynamoDB; bursts of updates are coalesced into one write.
     """
-    try:
-        table_name = os.environ.get('SYNTHESIS_PROGRESS_TABLE')
-        execution_id = os.environ.get('_EXECUTION_ID', 'unknown')
-        if not table_name:
-            print(f"Code synthesis progress: {progress}% (no table configured)")
-            return
-        
-        import time
-        dynamodb = boto3.resource('dynamodb', region_name=os.environ.get('REGION', 'us-west-2'))
-        table = dynamodb.Table(table_name)
-        
-        update_expr = 'SET progress = :p, #s = :s, updatedAt = :u, #t = :ttl'
-        expr_values = {
-            ':p': progress,
-            ':s': 'RUNNING' if progress < 100 else 'SUCCEEDED',
-            ':u': int(time.time()),
-            ':ttl': int(time.time()) + 86400,  # 24 hour TTL
-        }
-        expr_names = {'#s': 'status', '#t': 'ttl'}
-        
-        table.update_item(
-            Key={'executionId': execution_id},
-            UpdateExpression=update_expr,
-            ExpressionAttributeValues=expr_values,
-            ExpressionAttributeNames=expr_names,
-        )
-        print(f"Progress updated: {progress}% for execution {execution_id}")
-    except Exception as e:
-        print(f"Error writing progress to DynamoDB: {e}")
+    publish_progress(progress)
 
 
 async def send_download_notification(presigned_url):
@@ -321,17 +372,20 @@ async def send_download_notification(presigned_url):
     Write the download URL to DynamoDB synthesis progress table.
     """
     try:
+        # Pending progress must land first; the download URL write is the last one of the run
+        await flush_progress()
+
         table_name = os.environ.get('SYNTHESIS_PROGRESS_TABLE')
-        execution_id = os.environ.get('_EXECUTION_ID', 'unknown')
+        execution_id = current_execution_id() or 'unknown'
         if not table_name:
-            print(f"Code synthesis complete. Download URL: {presigned_url}")
+            log.info("Code synthesis complete", download_url=presigned_url)
             return
         
         import time
-        dynamodb = boto3.resource('dynamodb', region_name=os.environ.get('REGION', 'us-west-2'))
-        table = dynamodb.Table(table_name)
         
-        table.update_item(
+        await run_blocking(
+            update_progress_item,
+            table_name,
             Key={'executionId': execution_id},
             UpdateExpression='SET progress = :p, #s = :s, downloadUrl = :d, updatedAt = :u, #t = :ttl',
             ExpressionAttributeValues={
@@ -343,9 +397,42 @@ async def send_download_notification(presigned_url):
             },
             ExpressionAttributeNames={'#s': 'status', '#t': 'ttl'},
         )
-        print(f"Download URL written for execution {execution_id}")
+        log.info("Download URL written", execution=execution_id)
     except Exception as e:
-        print(f"Error writing download URL to DynamoDB: {e}")
+        log.error("Error writing download URL to DynamoDB: %s", e)
+
+
+
 
 
+async def send_failure_notification(error_message):
+    """
+    Mark the current execution FAILED in the synthesis progress table, with the error message.
+    """
+    try:
+        await flush_progress()
 
+        table_name = os.environ.get('SYNTHESIS_PROGRESS_TABLE')
+        execution_id = current_execution_id() or 'unknown'
+        if not table_name:
+            log.info("Code synthesis failed", error=error_message)
+            return
+
+        import time
+
+        await run_blocking(
+            update_progress_item,
+            table_name,
+            Key={'executionId': execution_id},
+            UpdateExpression='SET #s = :s, #e = :e, updatedAt = :u, #t = :ttl',
+            ExpressionAttributeValues={
+                ':s': 'FAILED',
+                ':e': error_message[:1000],
+                ':u': int(time.time()),
+                ':ttl': int(time.time()) + 86400,
+            },
+            ExpressionAttributeNames={'#s': 'status', '#e': 'error', '#t': 'ttl'},
+        )
+        log.info("Failure written", execution=execution_id)
+    except Exception as e:
+        log.error("Error writing failure to DynamoDB: %s", e)
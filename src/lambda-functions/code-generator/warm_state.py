@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+from aws_async import get_aws_io_executor
+from structured_logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_SECRET_CACHE_TTL_SECONDS = 900
+# A refresh is started in the background once the value is this close to expiring, so warm
+# invocations keep getting the cached value instead of waiting on Secrets Manager
+DEFAULT_SECRET_REFRESH_AHEAD_SECONDS = 180
+
+
+class RefreshAheadValue:
+    """
+    Caches the result of a blocking loader for ttl seconds, refreshing it ahead of expiry.
+    """
+
+    def __init__(self, loader, ttl=None, refresh_ahead=None, name='value'):
+        self.loader = loader
+        self.name = name
+        self.ttl = float(ttl if ttl is not None else os.environ.get('SECRET_CACHE_TTL_SECONDS', DEFAULT_SECRET_CACHE_TTL_SECONDS))
+        refresh_ahead = float(refresh_ahead if refresh_ahead is not None else os.environ.get('SECRET_REFRESH_AHEAD_SECONDS', DEFAULT_SECRET_REFRESH_AHEAD_SECONDS))
+        self.refresh_ahead = min(refresh_ahead, self.ttl)
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires_at = 0.0
+        self._refreshing = False
+
+    def get(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._value is not None and now < self._expires_at:
+                if now >= self._expires_at - self.refresh_ahead and not self._refreshing:
+                    self._refreshing = True
+                    get_aws_io_executor().submit(self._refresh)
+                return self._value
+        # Missing or expired: load in the caller. Concurrent callers may each load once, which
+        # is cheaper than serializing every warm read behind the lock
+        return self._load()
+
+    def invalidate(self):
+        """Drop the cached value, e.g. after the credential it holds was rejected."""
+        with self._lock:
+            self._value = None
+            self._expires_at = 0.0
+
+    def _load(self):
+        value = self.loader()
+        with self._lock:
+            self._value = value
+            self._expires_at = time.monotonic() + self.ttl
+        return value
+
+    def _refresh(self):
+        try:
+            self._load()
+        except Exception as e:
+            log.warning("Background refresh of %s failed, keeping the cached value: %s", self.name, e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+_file_cache = {}
+_file_cache_lock = threading.Lock()
+
+
+def load_cached_file(file_path, parser):
+    """
+    Return parser(file_path), parsing the file again only when it changes.
+
+    The returned object is shared between invocations and must not be mutated.
+
+    Raises:
+        FileNotFoundError: If the file does not exist. Errors are never cached.
+    """
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    identity = (stat.st_mtime_ns, stat.st_size)
+    cache_key = (path, parser)
+    with _file_cache_lock:
+        cached = _file_cache.get(cache_key)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+    parsed = parser(path)
+    with _file_cache_lock:
+        _file_cache[cache_key] = (identity, parsed)
+    return parsed
+
+
+_language_prompts = {}
+
+
+def get_language_prompts(stack_generation_prompt_dict, code_language):
+    """
+    Return the per-module step prompt prefixes for a code language, built once per template set.
+
+    Returns:
+        dict: 'step_1_prefix', 'step_2_prefix', 'step_3_prefix' and 'step_4_prefix'
+    """
+    templates = tuple(stack_generation_prompt_dict[key] for key in ('module_prompt_suffix', 'step_2', 'step_3', 'step_4'))
+    cache_key = (code_language,) + templates
+    prompts = _language_prompts.get(cache_key)
+    if prompts is None:
+        module_prompt_suffix, step_2, step_3, step_4 = templates
+        prompts = {
+            'step_1_prefix': module_prompt_suffix + '\n',
+            'step_2_prefix': step_2 + '\n',
+            'step_3_prefix': step_3.replace('{code_language}', code_language) + '\n',
+            'step_4_prefix': step_4.replace('{code_language}', code_language) + '\n',
+        }
+        # Only a handful of languages and template versions exist per container
+        _language_prompts[cache_key] = prompts
+    return prompts
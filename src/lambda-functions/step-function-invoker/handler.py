@@ -51,7 +51,11 @@ def handler(event, context):
             "file_path": file_path,
             "code_language": code_language,
             "execution_id": execution_id,
+            "bypass_cache": bool(request_body.get('bypass_cache', False)),
         }
+        # Resubmission of an edited diagram: only modules changed since that execution are regenerated
+        if request_body.get('previous_execution_id'):
+            step_function_input["previous_execution_id"] = str(request_body['previous_execution_id'])
             
         print(f"Step function input: {step_function_input}")
             
@@ -85,6 +85,21 @@ describe('ProcessingStack', () => {
     });
   });
 
+  describe('Code Generator Configuration', () => {
+    it('should allow result cache eviction under the cache prefix', () => {
+      template.hasResourceProperties('AWS::IAM::Policy', {
+        PolicyDocument: {
+          Statement: Match.arrayWith([
+            Match.objectLike({
+              Action: 's3:DeleteObject',
+              Effect: 'Allow',
+            }),
+          ]),
+        },
+      });
+    });
+  });
+
   describe('Stack Outputs', () => {
     it('should export Streaming Lambda ARN', () => {
       template.hasOutput('StreamingLambdaArn', {